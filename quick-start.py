@@ -10,12 +10,16 @@
 #
 ######################################
 
-import pickle
+import os
+import sys
+import argparse
 import numpy as np
-from sklearn import ensemble
-import pandas as pd
 from datetime import datetime
-from src.dataEng import FeatureEngineering
+from src.compactModel import MODEL_DIR, EXPORT_FORMATS, EXPORT_TOLERANCE, CompactScorer
+from src.profiling import MODES as PROFILE_MODES, configure as configure_profiling, stage
+
+# Note: to keep single evaluations fast, pandas, scikit-learn and scipy
+# are only imported by the commands which need them
 
 # For ease of use, write the model  
 # date as a global variable
@@ -35,6 +39,9 @@ class InputHelper:
     print_hello()
         Prints the hello message for the start of the program
 
+    get_user_numbers() -> tuple
+        Gets the user input and validates it. Returns the sorted numbers and lucky numbers
+
     get_user_input() -> pd.DataFrame
         Gets the user input and validates it. Returns dataframe of inputs
     
@@ -69,16 +76,15 @@ class InputHelper:
         print("#                                                            #")
         print("##############################################################")
 
-    def get_user_input(self) -> pd.DataFrame:
+    def get_user_numbers(self) -> tuple:
         """
         Prompts the user to input 5 number N,
         and 2 lucky number L. 
 
         Returns
         -------
-        pd.Dataframe
-            A dataframe which can be used for feature 
-            engineering and machine learning
+        tuple
+            The sorted lists of numbers Ns and lucky numbers Ls
         """
 
         # get 5 unique number N from user between 1 and 50
@@ -89,6 +95,23 @@ class InputHelper:
         # validate the user input
         self.validate_nums(nums = Ls, nnums = 2, nmin = 1, nmax = 12)
 
+        return Ns, Ls
+
+    def get_user_input(self) -> "pd.DataFrame":
+        """
+        Prompts the user to input 5 number N,
+        and 2 lucky number L. 
+
+        Returns
+        -------
+        pd.Dataframe
+            A dataframe which can be used for feature 
+            engineering and machine learning
+        """
+        import pandas as pd
+
+        Ns, Ls = self.get_user_numbers()
+
         # create a dataframe with all the information
 
         tags = ['N'+str(i) for i in range(1,6,1)] + ['L1', 'L2']
@@ -142,68 +165,510 @@ class InputHelper:
 
         return True
 
-if __name__ == "__main__":
+def num_to_words(index: int) -> str:
+    """
+    Retruns whether 'best_label' points to 
+    a good or bad betting number.
+    """
+    return "BAD" if not index else "GOOD"  
+
+def format_numbers(numbers : list) -> str:
+    """
+    Formats a single ticket as a table, the way
+    pandas prints a one-row DataFrame
+    """
+    tags = ['N'+str(i) for i in range(1,6,1)] + ['L1', 'L2']
+    widths = [max(len(tag), len(str(n))) for tag, n in zip(tags, numbers)]
+    header = " " + "".join("  " + tag.rjust(w) for tag, w in zip(tags, widths))
+    row    = "0" + "".join("  " + str(n).rjust(w) for n, w in zip(numbers, widths))
+    return header + "\n" + row
 
+def load_scorer(model_dir : str):
+    """
+    Loads the lean CompactScorer (src/compactModel.py) if the model has
+    been exported, otherwise (or if the export is of another model, e.g.
+    one retrained since) the full TicketScorer (src/scoring.py)
+    """
+    if CompactScorer.available(model_dir):
+        try:
+            return CompactScorer(model_dir)
+        except ValueError as error:
+            print(f"{error}, falling back to the pickled model", file=sys.stderr)
+
+    from src.scoring import TicketScorer
+    return TicketScorer(model_dir)
+
+def run_interactive(args) -> None:
+    """
+    Prompts the user for a single number and evaluates it
+    """
     # ------------------------------ get the user input ------------------------------ 
     # Input is handled through the InputHelper class
     
     helper = InputHelper()
-    user_input = helper.get_user_input()
-    user_cols = user_input.columns
-
-    # ------------------------------ get the original dataset ------------------------------ 
-    # In order to get realistically engineered features, 
-    # we need to import the whole dataset.
-    # 
-    # Note: This is a bit of a hack. The engineered features,
-    # especially the binned ones, are defined w.r.t the whole dataset
-    # (for example via "pd.cut(self.data['N sum'], 6)" in sec/dataEng.py).
-    # The hack here is to just append the user's data to the whole dataset
-    # and reengineer all the features. While this isn't perfect, the assumption
-    # is that the dataset is sufficiently large that this gives an equivalent
-    # set of engineered features as in the original analysis.
-    
-    dataset_filename = 'saved-models/saved-dataset.sav'
-    dataset = pickle.load(open(dataset_filename, 'rb'))
-    user_plus_dataset = pd.concat([dataset.loc[:, user_cols], user_input])
-
-    # ------------------------------ engineer the necessary features ------------------------------ 
-    # For this we use the FeatureEngineering class located in src/dataEng.py
-    eng = FeatureEngineering(user_plus_dataset)
-    eng.engineer_features()
-    eng.drop_unwanted_values()
+    with stage('user input'):
+        Ns, Ls = helper.get_user_numbers()
 
-        
     # ------------------------------ load the model from disk ------------------------------ 
-    # This model is generated through euromillions.ipynb
-    model_filename  = 'saved-models/soft-vote-model.sav'
-    loaded_model  = pickle.load(open(model_filename, 'rb'))
-
-    # ------------------------------ Load the model's used features ------------------------------ 
-    # The model features are generated through euromillions.ipynb and saved on the disk
-    features_filename = 'saved-models/model-lables.sav'
-    model_features  = pickle.load(open(features_filename, 'rb'))
-    
-    # ------------------------------ Make a prediction ------------------------------ 
-    
-    # To evaluate the prediction, re-select the user's entry 
-    # (index -1 in the user_plus_dataset DataFrame), and select only the model-relevant
-    # featrues. Then, evaluate the prediction and format it nicely
+    # The model, its features and the frozen feature state are generated through 
+    # euromillions.ipynb. For a single evaluation, the model tabulated by the
+    # 'export' command is all that is needed
+    with stage('load scorer'):
+        scorer = load_scorer(args.model_dir)
 
-    formated_input = user_plus_dataset.iloc[[-1]][model_features]
-
-    result = loaded_model.predict_proba(formated_input)
+    # ------------------------------ Make a prediction ------------------------------ 
+    with stage('predict', 1):
+        result = scorer.predict_proba(np.array([Ns + Ls]), helper.year)
     best_label = np.argmax(result[0])
 
-    # a helper function
-    def num_to_words(index: int) -> str:
-        """
-        Retruns whether 'best_label' points to 
-        a good or bad betting number.
-        """
-        return "BAD" if not index else "GOOD"  
-
     # format the output and give it to the user
     print("\n--------------------------------------------------------------")
     print("The model predicts your number:\n{0}\nis a {1} number to bet on with {2:.1f}% confidence"
-          .format(user_input.drop('YYYY', axis=1), num_to_words(best_label),result[0][best_label]*100))
\ No newline at end of file
+          .format(format_numbers(Ns + Ls), num_to_words(best_label),result[0][best_label]*100))
+
+def run_batch(args) -> None:
+    """
+    Scores a whole file (or stream) of tickets in one go
+    """
+    from src.scoring import TicketScorer, read_tickets, write_scores
+
+    if args.chunk_size is not None or args.features:
+        return run_batch_stream(args)
+
+    with stage('load scorer'):
+        scorer = TicketScorer(args.model_dir)
+    with stage('read tickets') as frame:
+        tickets = read_tickets(args.tickets)
+        frame['rows'] = len(tickets)
+    scores = scorer.score(tickets, year=args.year, drop_invalid=args.skip_invalid,
+                          backend=args.backend, workers=args.workers)
+    with stage('write scores', len(scores)):
+        write_scores(scores, args.output)
+    print_batch_stats(scorer, len(scores))
+
+def print_batch_stats(scorer, rows : int) -> None:
+    """
+    Reports how many tickets were scored, and how well the prediction cache did
+    """
+    stats = scorer.predictor.stats()
+    if stats['rows'] == 0:
+        # the process backend caches in the worker processes
+        print(f"scored {rows} tickets", file=sys.stderr)
+        return
+    print(f"scored {rows} tickets, {stats['misses']} distinct feature signatures "
+          f"passed to the model (cache hit rate {100*stats['hit rate']:.2f}%)", file=sys.stderr)
+
+def run_batch_stream(args) -> None:
+    """
+    Scores (or engineers the features of) a file of tickets chunk by
+    chunk, such that the memory does not grow with the size of the file
+    """
+    from src.vecEng import FeatureState
+    from src.streaming import read_ticket_chunks, engineer_chunks, score_chunks, write_chunks
+
+    chunks = read_ticket_chunks(args.tickets, args.chunk_size)
+    if args.features:
+        state = FeatureState.load(os.path.join(args.model_dir, 'feature-state.sav'))
+        rows = write_chunks(engineer_chunks(chunks, state, year=args.year, drop_invalid=args.skip_invalid), args.output)
+        print(f"engineered the features of {rows} tickets", file=sys.stderr)
+        return
+
+    from src.scoring import TicketScorer
+
+    with stage('load scorer'):
+        scorer = TicketScorer(args.model_dir)
+    rows = write_chunks(score_chunks(scorer, chunks, year=args.year, drop_invalid=args.skip_invalid,
+                                     backend=args.backend, workers=args.workers), args.output)
+    print_batch_stats(scorer, rows)
+
+def run_rank(args) -> None:
+    """
+    Ranks all possible tickets and writes out the best and worst ones
+    """
+    from src.rank import TicketRanking
+    from src.scoring import write_scores
+
+    ranking = TicketRanking(top_k=args.top, bottom_k=args.bottom, chunk_size=args.chunk_size,
+                            year=args.year, checkpoint=args.checkpoint)
+    ranking.run(args.model_dir, processes=args.processes, limit=args.limit)
+    write_scores(ranking.results(), args.output)
+
+def run_export(args) -> None:
+    """
+    Exports the trained model to a compact artifact
+    """
+    from src.scoring import TicketScorer
+    from src.compactModel import export_model, source_hash
+
+    scorer = TicketScorer(args.model_dir)
+    predictor, error = export_model(scorer.model, scorer.model_features, scorer.state,
+                                    fmt=args.format, tolerance=args.tolerance)
+    predictor.source = source_hash(args.model_dir)
+    filename = os.path.join(args.model_dir, EXPORT_FORMATS[args.format])
+    predictor.save(filename)
+    if args.format == 'table':
+        print(f"tabulated the model for {len(predictor.table)} feature combinations in {filename}")
+    else:
+        print(f"flattened the model's {len(predictor.members)} estimators into {filename}")
+    print(f"largest difference to the model's probabilities: {error:.3g}")
+
+def run_startup_report(args) -> None:
+    """
+    Reports how long a cold start of a single evaluation takes
+    """
+    from src.startupReport import startup_report
+
+    print(startup_report([sys.argv[0], "--model-dir", args.model_dir], stdin="45 30 12 1 7\n7 12\n", top=args.top))
+
+def run_serve(args) -> None:
+    """
+    Serves ticket scores over HTTP, with the model loaded once
+    """
+    from src.scoring import TicketScorer
+    from src.server import make_server
+
+    scorer = TicketScorer(args.model_dir)
+    server = make_server(scorer, host=args.host, port=args.port, unix_socket=args.unix_socket,
+                         max_batch_size=args.max_batch_size, max_wait=args.max_wait_ms / 1e3)
+    where = args.unix_socket if args.unix_socket is not None else f"http://{args.host}:{args.port}"
+    print(f"scoring tickets on {where} (POST /score, GET /metrics)", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
+
+def run_train(args) -> None:
+    """
+    Retrains the model on the csv files and writes the artifacts this script loads
+    """
+    from src.train import train
+
+    cache_dir = args.cache_dir if args.cache_dir is not None else os.path.join(args.model_dir, "cache")
+    train(model_dir=args.model_dir, cache_dir=cache_dir, n_jobs=args.jobs, reuse_params=args.reuse_params)
+
+def run_ingest(args) -> None:
+    """
+    Ingests the draws added to the csv files since the last ingest, and
+    reports whether the drift of the dataset needs a rebin or a retrain
+    """
+    from src.ingest import DrawIngest
+
+    ingest = DrawIngest(model_dir=args.model_dir)
+    report = ingest.bootstrap() if args.rebuild or not ingest.exists() else ingest.ingest()
+    if args.reset_reference:
+        ingest.reset_reference()
+        report = ingest.drift()
+
+    for key, value in report.items():
+        print(f"{key:<22} {value}")
+    if report['rebin']:
+        print("The sum means and bins drifted: rerun 'train' to refit them with the model")
+    elif report['retrain']:
+        print("The labels drifted: rerun 'train'")
+
+def run_benchmark(args) -> None:
+    """
+    Times the feature engineering, scoring and inference, and
+    optionally fails on regressions w.r.t. a baseline
+    """
+    import json
+    from src.benchmark import run_benchmarks, compare, regressions
+
+    results = run_benchmarks(pattern=args.filter, max_size=args.max_size, repeat=args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f"wrote {len(results['results'])} results to {args.output}", file=sys.stderr)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            comparison = compare(results, json.load(f))
+        for key, before, after, ratio in comparison:
+            print(f"{key:<50} {before:12.6f} s -> {after:12.6f} s  x{ratio:.2f}")
+        slower = regressions(comparison, args.threshold)
+        if slower:
+            print(f"{len(slower)} benchmarks are more than {args.threshold:.0%} slower than {args.baseline}", file=sys.stderr)
+            sys.exit(1)
+
+def run_equivalence(args) -> None:
+    """
+    Checks that the fast feature engines and prediction paths match the
+    reference row per row methods, and reports their rows per second
+    """
+    import json
+    from src.equivalence import check_equivalence
+
+    result = check_equivalence(rows=args.rows, seed=args.seed, model_dir=args.model_dir,
+                               tolerance=args.tolerance, predictions=not args.no_predictions)
+    features, paths = result['features'], result['predictions']
+    print(result['throughput'].to_string(index=False), file=sys.stderr)
+    if len(paths):
+        print(paths.to_string(index=False), file=sys.stderr)
+    for _, row in features[features['mismatches'] > 0].iterrows():
+        print(f"{row['suite']}: {row['engine']} differs in '{row['feature']}' on {row['mismatches']} tickets, "
+              f"e.g. {row['first mismatch']}", file=sys.stderr)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            report = {key: result[key].to_dict(orient='records') for key in ('features', 'predictions', 'throughput')}
+            report.update(passed=result['passed'], seed=result['seed'])
+            json.dump(report, f, indent=1, default=str)
+    print(f"{'passed' if result['passed'] else 'FAILED'}, seed {result['seed']}", file=sys.stderr)
+    if not result['passed']:
+        sys.exit(1)
+
+def run_simulate(args) -> None:
+    """
+    Estimates the expected pari-mutuel payout of a ticket (prompted
+    for) or of a batch of tickets by Monte Carlo
+    """
+    from src.vecEng import N_COLS, L_COLS, TICKET_COLS
+    from src.simulate import load_crowding_model, simulate, payout_quantiles
+
+    if args.tickets is None:
+        helper = InputHelper()
+        Ns, Ls = helper.get_user_numbers()
+        numbers, years = np.array([Ns + Ls]), helper.year
+    else:
+        from src.scoring import read_tickets, validate_tickets
+
+        tickets = read_tickets(args.tickets)
+        if not validate_tickets(tickets).all():
+            print("Error: the tickets must have 5 unique numbers between 1 and 50 "
+                  "and 2 unique lucky numbers between 1 and 12", file=sys.stderr)
+            sys.exit(1)
+        numbers = np.hstack([np.sort(tickets[N_COLS].to_numpy(), axis=1),
+                             np.sort(tickets[L_COLS].to_numpy(), axis=1)])
+        years = tickets['YYYY'].to_numpy() if 'YYYY' in tickets.columns else (args.year or datetime.today().year)
+
+    model  = load_crowding_model(args.source, args.model_dir, refit=args.refit)
+    result = simulate(numbers, years, model, draws=args.draws, seed=args.seed,
+                      sales=args.sales, processes=args.processes)
+    quantiles = payout_quantiles(result['histogram'])
+
+    if args.tickets is None:
+        print("\n--------------------------------------------------------------")
+        print("Expected payout of\n{0}\nin units of the prize fund per unit of sales, from {1} simulated draws:"
+              .format(format_numbers(Ns + Ls), args.draws))
+        print(f"EV = {result['ev'][0]:.4f}, 95% CI [{result['ev low'][0]:.4f}, {result['ev high'][0]:.4f}]")
+        print(f"Pr[win] = 1/{1/result['prob win'][0]:.2f}; given a win, the payout median is "
+              f"{quantiles[0, 0]:.3g} and the 99th percentile {quantiles[0, 2]:.3g}")
+        for tag, ev in zip(model.tags, result['group ev'][0]):
+            print(f"  {tag:>4}  {ev:.4f}")
+    else:
+        from src.scoring import write_scores
+
+        out = tickets.copy()
+        out[TICKET_COLS] = numbers
+        for key in ('ev', 'ev low', 'ev high', 'std error', 'prob win'):
+            out[key] = result[key]
+        for i, q in enumerate(('p50', 'p90', 'p99')):
+            out[f"payout {q}"] = quantiles[:, i]
+        write_scores(out, args.output)
+    print(f"seed {result['seed']}", file=sys.stderr)
+
+def run_portfolio(args) -> None:
+    """
+    Picks a portfolio of lines with a high GOOD probability or expected
+    payout, which share few numbers with each other
+    """
+    import pandas as pd
+    from src.vecEng import TICKET_COLS
+    from src.scoring import write_scores
+    from src.portfolio import optimise_portfolio
+
+    if args.pool is not None and args.pool < args.lines:
+        print(f"Error: cannot pick {args.lines} lines out of a pool of {args.pool}", file=sys.stderr)
+        sys.exit(1)
+    scorer, crowding = None, None
+    if args.objective == 'good':
+        with stage('load scorer'):
+            scorer = load_scorer(args.model_dir)
+    else:
+        from src.simulate import load_crowding_model
+
+        crowding = load_crowding_model(args.source, args.model_dir, refit=args.refit)
+    result = optimise_portfolio(args.lines, args.objective, scorer=scorer, crowding=crowding,
+                                year=args.year or datetime.today().year, candidates=args.candidates,
+                                pool=args.pool, penalty=args.overlap_penalty, seed=args.seed, sales=args.sales)
+
+    out = pd.DataFrame(result['numbers'], columns=TICKET_COLS)
+    out['P(GOOD)' if args.objective == 'good' else 'ev'] = result['score']
+    out['shared numbers'] = result['shared']
+    write_scores(out, args.output)
+    print(f"{args.lines} lines, total score {result['score'].sum():.4f}, objective with the overlap penalty "
+          f"{result['objective']:.4f}, at most {result['shared'].max()} shared numbers per pair", file=sys.stderr)
+    print(f"seed {result['seed']}", file=sys.stderr)
+
+def run_backtest(args) -> None:
+    """
+    Walks forward through the past draws, retraining the model before
+    every window, and reports what its GOOD/BAD picks would have paid out
+    """
+    import pickle
+    from src.scoring import write_scores
+    from src.dataLoad import read_dataset
+    from src.backtest import backtest
+
+    dataset = read_dataset(args.model_dir)
+    with open(os.path.join(args.model_dir, 'soft-vote-model.sav'), 'rb') as f:
+        model = pickle.load(f)
+    result = backtest(dataset, model, min_train=args.min_train, retrain_every=args.retrain_every,
+                      candidates=args.candidates, lines=args.lines, seed=args.seed, processes=args.processes,
+                      cache_dir=os.path.join(args.model_dir, 'cache'))
+    write_scores(result['draws'], args.output)
+    print(result['summary'].to_string(index=False), file=sys.stderr)
+    print(f"seed {result['seed']}", file=sys.stderr)
+
+def positive_int(value : str) -> int:
+    """
+    An argparse type for counts which must be at least 1
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the command line interface. Without a
+    command, the interactive quickstart is run.
+    """
+    parser = argparse.ArgumentParser(description="Evaluate EuroMillions numbers with the trained model.")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="directory with the saved model (default: %(default)s)")
+    parser.add_argument("--profile", default=None, choices=PROFILE_MODES,
+                        help="report the time, rows and peak memory of every stage as json/prometheus text, or dump "
+                             "a cprofile/pyinstrument profile (default: $EUROMILLIONS_PROFILE, off if not set)")
+    parser.add_argument("--profile-output", default=None,
+                        help="where to write the report or profile (default: $EUROMILLIONS_PROFILE_OUTPUT, "
+                             "else stderr for reports and euromillions.prof / euromillions-profile.html for profiles)")
+    parser.set_defaults(func=run_interactive)
+    commands = parser.add_subparsers(title="commands")
+
+    batch = commands.add_parser("batch", help="score a batch of tickets non-interactively")
+    batch.add_argument("tickets", help="a .csv/.parquet file with N1..N5, L1, L2 (and optionally YYYY) columns, "
+                                       "or a text file / '-' for stdin with 7 numbers per line")
+    batch.add_argument("-o", "--output", default="-", help="a .csv/.parquet file to write the scores to (default: stdout)")
+    batch.add_argument("--year", type=int, default=None, help="the year the tickets are played in, if not given per ticket (default: this year)")
+    batch.add_argument("--skip-invalid", action="store_true", help="drop invalid tickets instead of failing")
+    batch.add_argument("--chunk-size", type=int, default=None, help="read, score and write the tickets in chunks of this many, "
+                                                                     "such that files larger than the memory can be scored")
+    batch.add_argument("--features", action="store_true", help="write the engineered features instead of the scores")
+    batch.add_argument("--backend", default="serial", choices=["serial", "thread", "process"],
+                       help="score the tickets in this thread, or sharded over a thread or process pool (default: %(default)s)")
+    batch.add_argument("--workers", type=int, default=None, help="threads / processes of the backend (default: all cores)")
+    batch.set_defaults(func=run_batch)
+
+    rank = commands.add_parser("rank", help="rank all 139,838,160 possible tickets and write out the top and bottom ones")
+    rank.add_argument("-o", "--output", default="-", help="a .csv/.parquet file to write the ranking to (default: stdout)")
+    rank.add_argument("--top", type=int, default=100, help="how many of the best tickets to keep (default: %(default)s)")
+    rank.add_argument("--bottom", type=int, default=100, help="how many of the worst tickets to keep (default: %(default)s)")
+    rank.add_argument("--chunk-size", type=int, default=10000, help="combinations of 5 numbers per chunk, times 66 tickets (default: %(default)s)")
+    rank.add_argument("--processes", type=int, default=None, help="number of worker processes (default: all cores)")
+    rank.add_argument("--checkpoint", default=None, help="file to checkpoint to and resume from")
+    rank.add_argument("--limit", type=int, default=None, help="only rank the first LIMIT chunks")
+    rank.add_argument("--year", type=int, default=None, help="the year the tickets are played in (default: this year)")
+    rank.set_defaults(func=run_rank)
+
+    export = commands.add_parser("export", help="export the trained model to a compact artifact for fast single evaluations")
+    export.add_argument("--format", choices=list(EXPORT_FORMATS), default="table",
+                        help="table: the predictions for every feature combination; ensemble: the flattened "
+                             "trees and support vectors, for models with too many combinations (default: %(default)s)")
+    export.add_argument("--tolerance", type=float, default=EXPORT_TOLERANCE,
+                        help="the largest allowed difference to the model's probabilities (default: %(default)s)")
+    export.set_defaults(func=run_export)
+
+    serve = commands.add_parser("serve", help="serve ticket scores over HTTP, with the model loaded once")
+    serve.add_argument("--host", default="127.0.0.1", help="host to listen on (default: %(default)s)")
+    serve.add_argument("--port", type=int, default=8000, help="port to listen on (default: %(default)s)")
+    serve.add_argument("--unix-socket", default=None, help="listen on this Unix socket instead of host:port")
+    serve.add_argument("--max-batch-size", type=int, default=256, help="maximum tickets per micro-batch (default: %(default)s)")
+    serve.add_argument("--max-wait-ms", type=float, default=5., help="maximum time a request waits for others to join its batch (default: %(default)s)")
+    serve.set_defaults(func=run_serve)
+
+    training = commands.add_parser("train", help="retrain the model on datasets/*.csv, caching the searches and fits")
+    training.add_argument("--cache-dir", default=None, help="cache of the searches and fitted estimators (default: MODEL_DIR/cache)")
+    training.add_argument("--jobs", type=int, default=None, help="processes to search and fit with (default: all cpus)")
+    training.add_argument("--reuse-params", action="store_true", help="skip the grid searches and reuse the last tuned hyperparameters, e.g. after a new draw")
+    training.set_defaults(func=run_train)
+
+    ingest = commands.add_parser("ingest", help="ingest the new draws of datasets/*.csv and check for drift")
+    ingest.add_argument("--rebuild", action="store_true", help="re-ingest all draws from scratch")
+    ingest.add_argument("--reset-reference", action="store_true", help="measure the drift from now on, e.g. after retraining")
+    ingest.set_defaults(func=run_ingest)
+
+    bench = commands.add_parser("benchmark", help="time the feature engineering, scoring and inference")
+    bench.add_argument("-o", "--output", default="benchmark.json", help="where to write the results as JSON (default: %(default)s)")
+    bench.add_argument("--baseline", default=None, help="earlier results to compare to; exits with 1 on regressions")
+    bench.add_argument("--threshold", type=float, default=0.25, help="relative slow-down counted as a regression (default: %(default)s)")
+    bench.add_argument("--filter", default=None, help="only run the benchmarks matching this regular expression")
+    bench.add_argument("--max-size", type=int, default=None, help="skip synthetic batches larger than this")
+    bench.add_argument("--repeat", type=int, default=5, help="timed repeats per benchmark (default: %(default)s)")
+    bench.set_defaults(func=run_benchmark)
+
+    equiv = commands.add_parser("equivalence", help="check that the fast feature engines and prediction paths match the reference")
+    equiv.add_argument("-o", "--output", default=None, help="where to write the results as JSON (default: not written)")
+    equiv.add_argument("--rows", type=int, default=2000, help="random tickets per suite, besides the edge cases (default: %(default)s)")
+    equiv.add_argument("--seed", type=int, default=None, help="seed, to reproduce the tickets of an earlier check")
+    equiv.add_argument("--tolerance", type=float, default=EXPORT_TOLERANCE,
+                       help="largest difference of a probability counted as equal (default: %(default)s)")
+    equiv.add_argument("--no-predictions", action="store_true", help="only check the feature engines")
+    equiv.set_defaults(func=run_equivalence)
+
+    sim = commands.add_parser("simulate", help="estimate the expected pari-mutuel payout of tickets by Monte Carlo")
+    sim.add_argument("tickets", nargs="?", default=None, help="tickets as for 'batch'; if not given, a single ticket is prompted for")
+    sim.add_argument("-o", "--output", default="-", help="a .csv/.parquet file to write the estimates to (default: stdout)")
+    sim.add_argument("--source", default="winners", choices=["uniform", "winners", "classifier"],
+                     help="how the other players bet: uniformly, fitted to the winners data, or by the classifier's P(GOOD) (default: %(default)s)")
+    sim.add_argument("--draws", type=int, default=1000000, help="simulated draws per ticket (default: %(default)s)")
+    sim.add_argument("--seed", type=int, default=None, help="seed, to reproduce an earlier result with any number of processes")
+    sim.add_argument("--processes", type=int, default=1, help="worker processes, 0 for all cores (default: %(default)s)")
+    sim.add_argument("--sales", type=float, default=None, help="the sales of every draw (default: drawn from the past draws)")
+    sim.add_argument("--year", type=int, default=None, help="the year the tickets are played in, if not given per ticket (default: this year)")
+    sim.add_argument("--refit", action="store_true", help="refit the model of the other players on the saved dataset")
+    sim.set_defaults(func=run_simulate)
+
+    folio = commands.add_parser("portfolio", help="pick many lines with a high score, which share few numbers")
+    folio.add_argument("-o", "--output", default="-", help="a .csv/.parquet file to write the lines to (default: stdout)")
+    folio.add_argument("--lines", type=positive_int, default=100, help="the number of lines to buy (default: %(default)s)")
+    folio.add_argument("--objective", default="good", choices=["good", "ev"],
+                       help="maximise the classifier's P(GOOD) or the expected payout under the model of the other players (default: %(default)s)")
+    folio.add_argument("--overlap-penalty", type=float, default=1.0,
+                       help="the penalty of two lines sharing all of their numbers, in units of the objective; "
+                            "sharing k numbers costs (k/7)^2 of it (default: %(default)s)")
+    folio.add_argument("--candidates", type=int, default=2**20, help="random tickets to score (default: %(default)s)")
+    folio.add_argument("--pool", type=positive_int, default=None, help="best candidates to pick the lines from (default: 50 per line)")
+    folio.add_argument("--seed", type=int, default=None, help="seed, to reproduce an earlier portfolio")
+    folio.add_argument("--year", type=int, default=None, help="the year the lines are played in (default: this year)")
+    folio.add_argument("--source", default="winners", choices=["uniform", "winners", "classifier"],
+                       help="the model of the other players for --objective ev, as for 'simulate' (default: %(default)s)")
+    folio.add_argument("--sales", type=float, default=None, help="the sales of the draw for --objective ev (default: the median past sales)")
+    folio.add_argument("--refit", action="store_true", help="refit the model of the other players on the saved dataset")
+    folio.set_defaults(func=run_portfolio)
+
+    bt = commands.add_parser("backtest", help="walk forward through the past draws and report what the model's picks would have paid out")
+    bt.add_argument("-o", "--output", default="-", help="a .csv/.parquet file to write the report of every draw to (default: stdout)")
+    bt.add_argument("--min-train", type=int, default=300, help="the draws the first model is trained on (default: %(default)s)")
+    bt.add_argument("--retrain-every", type=int, default=50, help="the draws between retrainings (default: %(default)s)")
+    bt.add_argument("--candidates", type=int, default=1000, help="random tickets scored per draw (default: %(default)s)")
+    bt.add_argument("--lines", type=positive_int, default=10, help="lines bought per draw by every strategy (default: %(default)s)")
+    bt.add_argument("--seed", type=int, default=None, help="seed, to reproduce an earlier report with any number of processes")
+    bt.add_argument("--processes", type=int, default=1, help="worker processes, 0 for all cores (default: %(default)s)")
+    bt.set_defaults(func=run_backtest)
+
+    report = commands.add_parser("startup-report", help="time a cold start of a single evaluation, with a -X importtime breakdown")
+    report.add_argument("--top", type=int, default=15, help="how many of the slowest imports to list (default: %(default)s)")
+    report.set_defaults(func=run_startup_report)
+
+    return parser
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    try:
+        configure_profiling(args.profile, args.profile_output)
+    except (ImportError, ValueError) as error:
+        print(f"Error: {error}", file=sys.stderr)
+        sys.exit(1)
+    with stage(args.func.__name__[len('run_'):]):
+        args.func(args)
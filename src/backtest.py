@@ -0,0 +1,251 @@
+import os
+import io
+import contextlib
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+from sklearn.base import clone
+from src.vecEng import N_COLS, L_COLS, TICKET_COLS
+from src.tickets import N_MAX, STAR_SHIFT, TicketMasks, encode, popcount
+from src.dataLoad import draw_dates
+from src.dataEng import FeatureEngineering
+from src.eras import ERAS, ERA_L_MAX, draw_eras
+from src.simulate import sample_masks
+from src.train import TRAIN_CACHE_DIR, TARGET, CUTOFF, MODEL_FEATURES, TrainingPipeline, prepare_data, score_width
+
+# the draws the first model is trained on
+MIN_TRAIN = 300
+# the model is retrained every RETRAIN_EVERY draws, on all the draws before
+RETRAIN_EVERY = 50
+# random tickets scored per draw, and lines bought per draw and strategy
+CANDIDATES = 1000
+LINES = 10
+# good: the lines with the highest P(GOOD); bad: the lowest; random: the first candidates, unscored
+STRATEGIES = ('good', 'random', 'bad')
+
+_main_bits = np.arange(N_MAX, dtype=np.uint64)
+
+# the dataset and the settings of each worker process, set by _init_worker
+_worker = {}
+
+
+def walk_forward_windows(n_draws : int, min_train : int = MIN_TRAIN, retrain_every : int = RETRAIN_EVERY) -> list:
+    """
+    Splits the draws 0 -> n_draws (oldest first) into walk-forward
+    windows: the model of a window is trained on all the draws before it
+
+    Returns
+    -------
+    list
+        (start, stop) of the draws every window is tested on
+    """
+    if min_train >= n_draws:
+        raise ValueError(f"Cannot train on {min_train} of {n_draws} draws and test on the rest")
+    return [(start, min(start + retrain_every, n_draws)) for start in range(min_train, n_draws, retrain_every)]
+
+
+def group_tags(n_main : np.ndarray, n_stars : np.ndarray) -> np.ndarray:
+    """
+    The winning group tag (e.g. '5+2', '2') of every number of matched numbers and stars
+    """
+    return np.array([str(N) + ("+" + str(L) if L != 0 else "") for N, L in zip(n_main, n_stars)], dtype=object)
+
+
+def realised_payouts(lines : np.ndarray, draw : pd.Series, win_frac : dict) -> np.ndarray:
+    """
+    What each line would have paid out in a past draw: its group's share of
+    the prize fund, win_frac * sales / (winners + 1), in units of the prize
+    fund per unit of sales (as simulate and the 'avg win' of score_dataset),
+    with the real number of winners of the group. Lines which do not win
+    any group pay out nothing.
+
+    Parameters
+    ----------
+    lines : np.ndarray
+        uint64 array of lines (see src/tickets.py)
+    draw : pd.Series
+        The row of the draw in the dataset, with its numbers, winners and sales
+    win_frac : dict
+        N -> L -> the fraction of the prize fund of the group in the era of the draw (Era.win_frac)
+
+    Returns
+    -------
+    np.ndarray
+        The payout of every line
+    """
+    drawn   = encode(draw[TICKET_COLS].to_numpy(dtype=np.int64)[None, :])[0]
+    matched = popcount(lines & drawn)
+    n_main  = popcount(lines & drawn & np.uint64(2**N_MAX - 1))
+    n_stars = matched - n_main
+
+    payouts = np.zeros(len(lines))
+    for i, (N, L) in enumerate(zip(n_main, n_stars)):
+        tag = group_tags([N], [L])[0]
+        if N in win_frac and L in win_frac[N] and tag in draw.index and not pd.isna(draw[tag]):
+            payouts[i] = win_frac[N][L] * draw['Sales'] / (draw[tag] + 1)
+    return payouts
+
+
+def _init_worker(draws : pd.DataFrame, settings : dict) -> None:
+    """
+    Passes the draws and the settings once per worker process
+    """
+    _worker['draws'], _worker['settings'] = draws, settings
+
+
+def _backtest_window(task : tuple) -> pd.DataFrame:
+    window, (start, stop), seed = task
+    draws, settings = _worker['draws'], _worker['settings']
+
+    # ------------------------------ train on the draws before the window ------------------------------
+    engineering = FeatureEngineering(draws)
+    # prepare_data and score_numbers print the mean score
+    with contextlib.redirect_stdout(io.StringIO()):
+        data, state = prepare_data(draws.iloc[:start])
+    X, y = data[MODEL_FEATURES], np.ravel(data[TARGET])
+    pipeline = TrainingPipeline(cache_dir=settings['cache_dir'], n_jobs=1, verbose=False)
+    fitted = pipeline.fit_estimators(settings['estimators'], X, y)
+    model = pipeline.assemble(fitted, y, 'soft')
+
+    # the realised target of the drawn tickets, w.r.t. the mean score and the threshold of the training draws
+    train_mean = engineering.score_numbers_vectorised(draws.iloc[:start]).mean()
+    threshold  = 1 + score_width(data['avg win']) * CUTOFF
+    drawn_good = engineering.score_numbers_vectorised(draws.iloc[start:stop]).to_numpy() / train_mean >= threshold
+
+    # ------------------------------ score the candidates of every draw of the window at once ------------------------------
+    rng    = np.random.default_rng(seed)
+    window_draws = draws.iloc[start:stop]
+    eras   = draw_eras(window_draws)
+    lmax   = ERA_L_MAX[eras]
+    n      = settings['candidates']
+    # the drawn ticket is scored as the last candidate of its draw
+    masks  = np.empty((len(window_draws), n + 1), dtype=np.uint64)
+    for i, stars in enumerate(lmax):
+        star_bits = np.arange(STAR_SHIFT, STAR_SHIFT + stars, dtype=np.uint64)
+        masks[i, :n] = sample_masks(rng, _main_bits, len(N_COLS), n) | sample_masks(rng, star_bits, len(L_COLS), n)
+    masks[:, n] = encode(window_draws[TICKET_COLS].to_numpy(dtype=np.int64))
+    years    = np.repeat(window_draws['YYYY'].to_numpy(dtype=np.int64), n + 1)
+    features = TicketMasks(masks.ravel(), years).engineer_features(state)
+    proba    = model.predict_proba(pd.DataFrame({col: features[col] for col in MODEL_FEATURES}))[:, 1]
+    proba    = proba.reshape(masks.shape)
+
+    # ------------------------------ play every draw of the window ------------------------------
+    rows = []
+    for i in range(len(window_draws)):
+        draw = window_draws.iloc[i]
+        order = np.argsort(-proba[i, :n], kind='stable')
+        chosen = {'good': order[:settings['lines']], 'random': np.arange(settings['lines']),
+                  'bad': order[::-1][:settings['lines']]}
+
+        row = {'date': draw['date'], 'window': window, 'train draws': start, 'lmax': lmax[i],
+               'drawn P(GOOD)': proba[i, n], 'drawn good': bool(drawn_good[i])}
+        for strategy, lines in chosen.items():
+            payouts = realised_payouts(masks[i, lines], draw, ERAS[eras[i]].win_frac)
+            row[f"{strategy} payout"]  = payouts.sum()
+            row[f"{strategy} wins"]    = int((payouts > 0).sum())
+            row[f"{strategy} P(GOOD)"] = proba[i, lines].mean()
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def backtest(dataset : pd.DataFrame, model, min_train : int = MIN_TRAIN, retrain_every : int = RETRAIN_EVERY,
+             candidates : int = CANDIDATES, lines : int = LINES, seed : int = None, processes : int = 1,
+             cache_dir : str = TRAIN_CACHE_DIR) -> dict:
+    """
+    Walks forward through the draws of the dataset: every window of
+    retrain_every draws has its own model, with the hyperparameters of
+    the given model, trained (or loaded from the training cache) on all
+    draws before the window, with features and target engineered from
+    those draws only. At every draw of the window, random candidate
+    tickets are scored and each strategy buys lines of them, which are
+    paid out what they would have won with the real winners of the draw.
+
+    The windows are independent, so they run in parallel; their seeds are
+    spawned from a single SeedSequence, such that a seed reproduces the
+    same result with any number of processes.
+
+    Parameters
+    ----------
+    dataset : pd.DataFrame
+        The draws with their winners and sales, e.g. read_dataset(model_dir) of src/dataLoad.py
+    model : sklearn.ensemble.VotingClassifier
+        The model whose hyperparameters are backtested, e.g. the soft-voting classifier.
+        Note that these were tuned on all draws, the later ones included.
+    min_train : int
+        The draws the first model is trained on
+    retrain_every : int
+        The draws per window
+    candidates : int
+        The random tickets scored per draw
+    lines : int
+        The lines every strategy buys per draw
+    seed : int
+        The seed. If None, a fresh one is drawn from the OS
+    processes : int
+        The number of worker processes, 0 or None for all cores; 1 runs in this process
+    cache_dir : str
+        The cache of the fitted estimators (see TrainingPipeline)
+
+    Returns
+    -------
+    dict
+        'draws': one row per tested draw, with the payout, wins and mean
+        P(GOOD) of every strategy's lines and the P(GOOD) and the realised
+        target of the drawn ticket; 'summary': one row per strategy;
+        'seed': the entropy to reproduce the result with
+    """
+    if candidates < lines:
+        raise ValueError(f"Cannot buy {lines} lines out of {candidates} candidates")
+    # oldest first
+    dates = draw_dates(dataset)
+    order = np.argsort(dates, kind='stable')
+    draws = dataset.iloc[order].copy()
+    draws['date'] = dates[order]
+
+    windows = walk_forward_windows(len(draws), min_train, retrain_every)
+    root = np.random.SeedSequence(seed)
+    tasks = [(window, rows, window_seed) for window, (rows, window_seed) in enumerate(zip(windows, root.spawn(len(windows))))]
+    settings = {'estimators': [(name, clone(estimator)) for name, estimator in model.named_estimators_.items()],
+                'candidates': candidates, 'lines': lines, 'cache_dir': cache_dir}
+
+    if processes == 1:
+        _init_worker(draws, settings)
+        results = list(map(_backtest_window, tasks))
+    else:
+        with Pool(processes or os.cpu_count(), initializer=_init_worker, initargs=(draws, settings)) as pool:
+            # imap keeps the windows in order
+            results = list(pool.imap(_backtest_window, tasks))
+    report = pd.concat(results, ignore_index=True)
+    return {'draws': report, 'summary': summarise(report, lines), 'seed': root.entropy}
+
+
+def summarise(report : pd.DataFrame, lines : int) -> pd.DataFrame:
+    """
+    The payout per line, the fraction of winning lines and the mean
+    P(GOOD) of every strategy, and the accuracy of the model on the
+    drawn tickets (the same for all strategies)
+
+    Parameters
+    ----------
+    report : pd.DataFrame
+        The 'draws' of backtest
+    lines : int
+        The lines every strategy bought per draw
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per strategy
+    """
+    accuracy = ((report['drawn P(GOOD)'] >= 0.5) == report['drawn good']).mean()
+    rows = []
+    for strategy in STRATEGIES:
+        payout = report[f"{strategy} payout"]
+        rows.append({'strategy': strategy, 'draws': len(report), 'lines': lines * len(report),
+                     'payout per line': payout.sum() / (lines * len(report)),
+                     # the payouts of a draw are correlated, so the standard error is that of the draws' means
+                     'std error': payout.std() / lines / np.sqrt(len(report)),
+                     'win rate': report[f"{strategy} wins"].sum() / (lines * len(report)),
+                     'mean P(GOOD)': report[f"{strategy} P(GOOD)"].mean(),
+                     'drawn accuracy': accuracy})
+    return pd.DataFrame(rows)
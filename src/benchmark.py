@@ -0,0 +1,397 @@
+import io
+import os
+import re
+import sys
+import time
+import pickle
+import warnings
+import platform
+import contextlib
+import subprocess
+import numpy as np
+from datetime import datetime
+from src.vecEng import TICKET_COLS, VectorisedFeatureEngineering, FeatureState
+from src.compactModel import MODEL_DIR
+
+# the synthetic ticket batch sizes of the scaling benchmarks
+SIZES = (1, 1000, 100000, 10000000)
+# a benchmark is slower than its baseline if it takes more than (1 + threshold) times as long
+REGRESSION_THRESHOLD = 0.25
+# every timed repeat runs the benchmark for at least this long [s]
+MIN_REPEAT_TIME = 0.2
+
+# name -> (setup, sizes); filled by @benchmark
+BENCHMARKS = {}
+
+
+def benchmark(name : str, sizes : tuple = (None,)):
+    """
+    Registers a benchmark. The decorated function is the setup: it is
+    called (untimed) with the size and returns the function to time.
+
+    Parameters
+    ----------
+    name : str
+        The name of the benchmark
+    sizes : tuple
+        The sizes to run the benchmark at, (None,) if it has a fixed size
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, sizes)
+        return setup
+    return register
+
+
+def synthetic_tickets(n : int, seed : int = 0) -> np.ndarray:
+    """
+    n random valid, sorted tickets
+
+    Parameters
+    ----------
+    n : int
+        The number of tickets
+    seed : int
+        The seed of the random generator
+
+    Returns
+    -------
+    np.ndarray
+        (n, 7) array of tickets with columns N1 -> N5, L1, L2
+    """
+    rng = np.random.default_rng(seed)
+    tickets = np.empty((n, len(TICKET_COLS)), dtype=np.int64)
+    for cols, nmax in ((slice(0, 5), 50), (slice(5, 7), 12)):
+        numbers = rng.integers(1, nmax + 1, size=(n, cols.stop - cols.start))
+        numbers.sort(axis=1)
+        # redraw the rows with repeated numbers until every row is valid
+        repeated = (np.diff(numbers, axis=1) == 0).any(axis=1)
+        while repeated.any():
+            redrawn = np.sort(rng.integers(1, nmax + 1, size=(repeated.sum(), numbers.shape[1])), axis=1)
+            numbers[repeated] = redrawn
+            repeated[repeated] = (np.diff(redrawn, axis=1) == 0).any(axis=1)
+        tickets[:, cols] = numbers
+    return tickets
+
+
+_tickets = {}
+def _cached_tickets(n : int) -> np.ndarray:
+    # the 10M batch takes a while to draw, so it is drawn once per run
+    if n not in _tickets:
+        _tickets[n] = synthetic_tickets(n)
+    return _tickets[n]
+
+
+def _load(filename : str):
+    with open(os.path.join(MODEL_DIR, filename), 'rb') as f:
+        return pickle.load(f)
+
+
+def _dataset():
+    from src.dataLoad import read_dataset
+    return read_dataset(MODEL_DIR)
+
+
+# ---------------------------- feature engineering ----------------------------
+# every feature of VectorisedFeatureEngineering, at every synthetic batch size
+FEATURES = {'is date': lambda e: e.is_date(),
+            'is post 2000': lambda e: e.is_post_2000(),
+            'is this year': lambda e: e.is_this_year(),
+            'lucky numbers': lambda e: e.get_lucky_numbers(e.N),
+            'lucky lucky numbers': lambda e: e.get_lucky_numbers(e.L),
+            '7 pattern': lambda e: e.get_all_7_numbers(),
+            'N rows': lambda e: e.number_of_different_rows(),
+            'sum bins': lambda e: e.state.transform(e.N.sum(axis=1), e.L.sum(axis=1))}
+
+def _feature_benchmark(feature):
+    def setup(size):
+        engine = VectorisedFeatureEngineering(_cached_tickets(size), 2023)
+        engine.state = FeatureState.load(os.path.join(MODEL_DIR, 'feature-state.sav'))
+        return lambda: FEATURES[feature](engine)
+    return setup
+
+for _feature in FEATURES:
+    benchmark(f"feature: {_feature}", SIZES)(_feature_benchmark(_feature))
+
+
+@benchmark("engineer_features: vectorised", SIZES)
+def _engineer_vectorised(size):
+    engine = VectorisedFeatureEngineering(_cached_tickets(size), 2023)
+    state = FeatureState.load(os.path.join(MODEL_DIR, 'feature-state.sav'))
+    return lambda: engine.engineer_features(state)
+
+
+@benchmark("engineer_features: bitmask", SIZES)
+def _engineer_bitmask(size):
+    from src.tickets import TicketMasks
+    masks = TicketMasks.from_numbers(_cached_tickets(size), 2023)
+    state = FeatureState.load(os.path.join(MODEL_DIR, 'feature-state.sav'))
+    return lambda: masks.engineer_features(state)
+
+
+def _sharded_benchmark(backend):
+    def setup(size):
+        from src.parallel import engineer_features
+        tickets = _cached_tickets(size)
+        state = FeatureState.load(os.path.join(MODEL_DIR, 'feature-state.sav'))
+        return lambda: engineer_features(tickets, 2023, state, backend=backend)
+    return setup
+
+# the pools only pay off for large batches; compare to 'engineer_features: vectorised'
+for _backend in ('thread', 'process'):
+    benchmark(f"engineer_features: {_backend} pool", SIZES[2:])(_sharded_benchmark(_backend))
+
+
+@benchmark("engineer_features: dataset, vectorised")
+def _engineer_dataset_vectorised(size):
+    from src.dataEng import FeatureEngineering
+    dataset = _dataset()
+    return lambda: FeatureEngineering(dataset.copy()).engineer_features(vectorised=True)
+
+
+@benchmark("engineer_features: dataset, reference")
+def _engineer_dataset_reference(size):
+    from src.dataEng import FeatureEngineering
+    dataset = _dataset()
+    def run():
+        # the row per row engine warns about Series.iteritems on every row
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            FeatureEngineering(dataset.copy()).engineer_features(vectorised=False)
+    return run
+
+
+# ---------------------------- target and cleaning ----------------------------
+@benchmark("score_dataset: vectorised")
+def _score_vectorised(size):
+    from src.dataEng import FeatureEngineering
+    dataset = _dataset()
+    engineering = FeatureEngineering(dataset)
+    def run():
+        # score_dataset prints the mean score
+        with contextlib.redirect_stdout(io.StringIO()):
+            engineering.score_dataset(dataset, vectorised=True)
+    return run
+
+
+@benchmark("score_dataset: reference")
+def _score_reference(size):
+    from src.dataEng import FeatureEngineering
+    dataset = _dataset()
+    engineering = FeatureEngineering(dataset)
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            engineering.score_dataset(dataset, vectorised=False)
+    return run
+
+
+@benchmark("drop_unwanted_values")
+def _drop_unwanted(size):
+    # drop_unwanted_values drops in place, so the copy of the dataset is timed as well
+    from src.dataEng import FeatureEngineering
+    dataset = _dataset()
+    return lambda: FeatureEngineering(dataset.copy()).drop_unwanted_values()
+
+
+# ---------------------------- loading ----------------------------
+@benchmark("load_dataset: csv")
+def _load_csv(size):
+    from src.dataLoad import load_dataset
+    return lambda: load_dataset(use_cache=False)
+
+
+@benchmark("load_dataset: cached")
+def _load_cached(size):
+    from src.dataLoad import load_dataset
+    load_dataset()
+    return lambda: load_dataset()
+
+
+@benchmark("saved dataset: unpickle")
+def _unpickle_dataset(size):
+    # the whole pickled DataFrame, as euromillions.ipynb saves it, against the column store
+    data = pickle.dumps(_dataset())
+    return lambda: pickle.loads(data)
+
+
+@benchmark("saved dataset: column store")
+def _read_dataset(size):
+    from src.dataLoad import read_dataset
+    return lambda: read_dataset(MODEL_DIR)
+
+
+@benchmark("saved dataset: column store, numbers only")
+def _read_dataset_numbers(size):
+    # what TicketScorer reads without a feature state
+    from src.dataLoad import read_dataset
+    return lambda: read_dataset(MODEL_DIR, TICKET_COLS)
+
+
+@benchmark("unpickle: soft-vote-ensemble.sav")
+def _unpickle_ensemble(size):
+    return lambda: _load('soft-vote-ensemble.sav')
+
+
+@benchmark("unpickle: soft-vote-model.sav")
+def _unpickle_model(size):
+    # importing scikit-learn the first time is measured by the startup report, not here
+    import sklearn
+    return lambda: _load('soft-vote-model.sav')
+
+
+# ---------------------------- inference ----------------------------
+@benchmark("predict_proba: model", SIZES[:3])
+def _predict_model(size):
+    # the model alone takes minutes for 10M tickets, which is what the cached paths avoid
+    from src.scoring import TicketScorer
+    scorer = TicketScorer()
+    X = scorer.model_inputs(_cached_tickets(size), 2023)
+    return lambda: scorer.model.predict_proba(X)
+
+
+@benchmark("predict_proba: TicketScorer", SIZES)
+def _predict_scorer(size):
+    from src.scoring import TicketScorer
+    scorer = TicketScorer()
+    tickets = _cached_tickets(size)
+    # time the steady state, in which the cache is warm
+    scorer.predict_proba(tickets[:100000], 2023)
+    return lambda: scorer.predict_proba(tickets, 2023)
+
+
+@benchmark("predict_proba: CompactScorer", SIZES)
+def _predict_compact(size):
+    from src.compactModel import CompactScorer
+    scorer = CompactScorer()
+    tickets = _cached_tickets(size)
+    return lambda: scorer.predict_proba(tickets, 2023)
+
+
+@benchmark("predict_proba: EnsemblePredictor", SIZES[:3])
+def _predict_ensemble(size):
+    from src.compactModel import ENSEMBLE_FILE, EnsemblePredictor
+    from src.scoring import TicketScorer
+    scorer = TicketScorer()
+    X = scorer.model_inputs(_cached_tickets(size), 2023)
+    ensemble = EnsemblePredictor.load(os.path.join(MODEL_DIR, ENSEMBLE_FILE))
+    return lambda: ensemble.predict_proba(X)
+
+
+def time_function(function, repeat : int = 5) -> dict:
+    """
+    Times a function like timeit: each of the repeats calls it
+    often enough to run for at least MIN_REPEAT_TIME
+
+    Parameters
+    ----------
+    function : callable
+        The function to time
+    repeat : int
+        How many timed repeats to take
+
+    Returns
+    -------
+    dict
+        The minimum and median time per call [s], the repeats and the calls per repeat
+    """
+    start = time.perf_counter()
+    function()
+    first = time.perf_counter() - start
+    number = max(1, int(np.ceil(MIN_REPEAT_TIME / first))) if first > 0 else 1000
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+
+    return {'min s': min(times), 'median s': float(np.median(times)), 'repeat': repeat, 'number': number}
+
+
+def result_key(name : str, size : int) -> str:
+    """
+    The key of a benchmark's result, e.g. 'feature: N rows [1000]'
+    """
+    return name if size is None else f"{name} [{size}]"
+
+
+def environment() -> dict:
+    """
+    The versions and the machine the benchmarks are run with
+    """
+    import pandas
+    import sklearn
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {'date': datetime.now().isoformat(timespec='seconds'), 'commit': commit or None,
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pandas.__version__, 'sklearn': sklearn.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count()}
+
+
+def run_benchmarks(pattern : str = None, max_size : int = None, repeat : int = 5, log=sys.stderr) -> dict:
+    """
+    Runs the registered benchmarks
+
+    Parameters
+    ----------
+    pattern : str
+        Only run the benchmarks whose name matches this regular expression
+    max_size : int
+        Skip the sizes above this one
+    repeat : int
+        How many timed repeats to take of every benchmark
+    log : file-like
+        Where to report progress, None to be silent
+
+    Returns
+    -------
+    dict
+        {'environment': environment(), 'results': {result_key: time_function(...)}}
+    """
+    results = {}
+    for name, (setup, sizes) in BENCHMARKS.items():
+        if pattern is not None and not re.search(pattern, name):
+            continue
+        for size in sizes:
+            if size is not None and max_size is not None and size > max_size:
+                continue
+            key = result_key(name, size)
+            results[key] = time_function(setup(size), repeat=repeat)
+            if log is not None:
+                print(f"{key:<50} {results[key]['min s']:12.6f} s", file=log)
+    return {'environment': environment(), 'results': results}
+
+
+def compare(results : dict, baseline : dict) -> list:
+    """
+    Compares the fastest times of benchmark results to a baseline
+
+    Parameters
+    ----------
+    results : dict
+        The output of run_benchmarks
+    baseline : dict
+        An earlier output of run_benchmarks
+
+    Returns
+    -------
+    list
+        (key, baseline time, time, ratio) of every benchmark in both,
+        sorted from the largest slow-down on
+    """
+    comparison = []
+    for key, result in results['results'].items():
+        if key in baseline['results']:
+            before, after = baseline['results'][key]['min s'], result['min s']
+            comparison.append((key, before, after, after / before if before > 0 else np.inf))
+    return sorted(comparison, key=lambda c: -c[3])
+
+
+def regressions(comparison : list, threshold : float = REGRESSION_THRESHOLD) -> list:
+    """
+    The entries of compare which are more than threshold slower than their baseline
+    """
+    return [c for c in comparison if c[3] > 1 + threshold]
@@ -0,0 +1,136 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+
+def save_columns(df : pd.DataFrame, directory : str, meta : dict = None) -> None:
+    """
+    Saves a DataFrame as a directory with one .npy file per column
+    (and one for the index), plus a meta.json describing them.
+    Text columns are saved as categorical codes, such that every
+    column can be memory-mapped when it is read back.
+    The directory is written next to its destination and then
+    moved in place, so readers never see a half-written store.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The DataFrame to save
+    directory : str
+        The directory to save the columns to. It is replaced if it exists
+    meta : dict
+        Any extra (JSON-serialisable) information to keep with the columns
+    """
+    tmp = directory.rstrip(os.sep) + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    index = df.index.to_series(name=df.index.name)
+    columns = []
+    for i, (name, values) in enumerate([(df.index.name, index)] + list(df.items())):
+        column = {'name': name, 'file': f"{i:03d}.npy", 'categories': None}
+        if values.dtype == object:
+            values = values.astype('category')
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            column['categories'] = values.cat.categories.tolist()
+            values = values.cat.codes
+        np.save(os.path.join(tmp, column['file']), values.to_numpy())
+        columns.append(column)
+
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'index': columns[0], 'columns': columns[1:], 'rows': len(df), 'meta': meta or {}}, f, indent=1)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp, directory)
+
+
+class ColumnStore:
+    """
+    Lazy, memory-mapped access to a directory written by save_columns.
+    Only the columns which are accessed are read, and only the pages
+    of them which are touched are loaded into memory.
+
+    Attributes
+    ----------
+    directory : str
+        The directory of the store
+
+    columns : list
+        The names of the columns
+
+    meta : dict
+        The extra information saved with the columns
+
+    Methods
+    -------
+    column(name : str) -> np.ndarray
+        The raw values of a column (categorical codes for text columns)
+
+    to_dataframe(columns : list = None) -> pd.DataFrame
+        Builds a DataFrame of some or all of the columns
+    """
+
+    def __init__(self, directory : str, mmap : bool = True) -> None:
+        self.directory = directory
+        self.mmap_mode = 'r' if mmap else None
+
+        with open(os.path.join(directory, 'meta.json')) as f:
+            info = json.load(f)
+        self.info    = {column['name']: column for column in info['columns']}
+        self.index   = info['index']
+        self.columns = [column['name'] for column in info['columns']]
+        self.meta    = info['meta']
+        self.rows    = info['rows']
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __contains__(self, name : str) -> bool:
+        return name in self.info
+
+    def _read(self, column : dict):
+        values = np.load(os.path.join(self.directory, column['file']), mmap_mode=self.mmap_mode)
+        if column['categories'] is not None:
+            return pd.Categorical.from_codes(values, column['categories'])
+        return values
+
+    def column(self, name : str) -> np.ndarray:
+        """
+        The raw values of a column (categorical codes for text columns)
+
+        Parameters
+        ----------
+        name : str
+            The column name
+
+        Returns
+        -------
+        np.ndarray
+            The (memory-mapped) values
+        """
+        return np.load(os.path.join(self.directory, self.info[name]['file']), mmap_mode=self.mmap_mode)
+
+    def __getitem__(self, name : str):
+        return self._read(self.info[name])
+
+    def to_dataframe(self, columns : list = None) -> pd.DataFrame:
+        """
+        Builds a DataFrame of some or all of the columns
+
+        Parameters
+        ----------
+        columns : list
+            The columns to read, all of them if None
+
+        Returns
+        -------
+        pd.DataFrame
+            The columns, with the saved index
+        """
+        columns = self.columns if columns is None else columns
+        index = pd.Index(self._read(self.index), name=self.index['name'])
+        return pd.DataFrame({name: self[name] for name in columns}, index=index, columns=columns)
@@ -0,0 +1,627 @@
+import os
+import pickle
+import hashlib
+import itertools
+import numpy as np
+from src.vecEng import FeatureState
+from src.tickets import TicketMasks
+from src.profiling import instrument, stage
+
+# where euromillions.ipynb saves the model, its features and the dataset
+MODEL_DIR = 'saved-models'
+TABLE_FILE = 'soft-vote-table.sav'
+ENSEMBLE_FILE = 'soft-vote-ensemble.sav'
+# the artifacts a predictor is exported from: an export keeps their hash (see source_hash),
+# such that it is not used any more once the model is retrained without exporting it again
+SOURCE_FILES = ('soft-vote-model.sav', 'model-lables.sav', 'feature-state.sav')
+# table: the predictions for every combination of the feature values (TablePredictor)
+# ensemble: the flattened trees and support vectors of the model (EnsemblePredictor)
+EXPORT_FORMATS = {'table': TABLE_FILE, 'ensemble': ENSEMBLE_FILE}
+# the largest difference to the model's probabilities an exported predictor may have
+EXPORT_TOLERANCE = 1e-9
+# rows per block of EnsemblePredictor.predict_proba, bounding its (rows, trees / support vectors) arrays
+ENSEMBLE_BLOCK = 4096
+# the SVC kernels EnsemblePredictor evaluates
+SVC_KERNELS = ('rbf', 'linear', 'sigmoid')
+
+# the values every (non-binned) engineered feature can take for a valid ticket
+FEATURE_DOMAINS = {'is date': range(2), 'is post 2000': range(2), 'is this year': range(2),
+                   'lucky numbers': range(6), 'lucky lucky numbers': range(3),
+                   'has lucky': range(2), 'has lucky lucky': range(2),
+                   '7 pattern': range(6), 'N rows': range(1, 6),
+                   'N sum big': range(2), 'L sum big': range(2)}
+
+
+def source_hash(model_dir : str = MODEL_DIR) -> str:
+    """
+    The sha256 of the SOURCE_FILES in model_dir, i.e. of the pickled
+    model, its features and the feature state a predictor is exported from.
+    Only the bytes are hashed, nothing is unpickled.
+
+    Parameters
+    ----------
+    model_dir : str
+        The directory with the saved model
+
+    Returns
+    -------
+    str
+        The hex digest
+    """
+    digest = hashlib.sha256()
+    for filename in SOURCE_FILES:
+        with open(os.path.join(model_dir, filename), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def feature_domains(model_features : list, state : FeatureState) -> dict:
+    """
+    The values each of the model features can take
+
+    Parameters
+    ----------
+    model_features : list
+        The features of the model
+    state : FeatureState
+        The frozen state, which defines the codes of the binned features
+
+    Returns
+    -------
+    dict
+        Feature name -> range of its values
+    """
+    domains = {}
+    for col in model_features:
+        if col in FEATURE_DOMAINS:
+            domains[col] = FEATURE_DOMAINS[col]
+        elif col.endswith(' bin') and col[:-len(' bin')] in state.codes:
+            domains[col] = range(state.codes[col[:-len(' bin')]].max() + 1)
+        else:
+            raise ValueError(f"The feature '{col}' does not have a small, finite set of values")
+    return domains
+
+
+class TablePredictor:
+    """
+    The model's predictions for every combination of model feature
+    values, stored as a dense table. A prediction is a single lookup
+    of the feature values' mixed-radix index, needing only NumPy.
+
+    Attributes
+    ----------
+    model_features : list
+        The names of the model features, in the order of the table's axes
+
+    offsets : np.ndarray
+        The smallest value of each feature
+
+    sizes : np.ndarray
+        The number of values of each feature
+
+    table : np.ndarray
+        (prod(sizes), n_classes) array of class probabilities
+
+    source : str
+        The source_hash of the artifacts the table was exported from, if known
+
+    Methods
+    -------
+    export(model, model_features : list, state : FeatureState) -> TablePredictor
+        Tabulates the predictions of a model
+
+    predict_proba(X) -> np.ndarray
+        Looks up the class probabilities of the rows of X
+
+    save(filename : str)
+        Saves the table
+
+    load(filename : str) -> TablePredictor
+        Loads a saved table
+    """
+
+    def __init__(self, model_features : list, offsets : np.ndarray, sizes : np.ndarray, table : np.ndarray,
+                 source : str = None) -> None:
+        self.model_features = list(model_features)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.sizes   = np.asarray(sizes, dtype=np.int64)
+        self.table   = np.asarray(table)
+        self.source  = source
+        # row-major strides of the table's axes
+        self.strides = np.append(np.cumprod(self.sizes[::-1])[-2::-1], 1)
+
+    @classmethod
+    def export(cls, model, model_features : list, state : FeatureState) -> 'TablePredictor':
+        """
+        Tabulates the predictions of a model for every combination
+        of the model feature values. The model is called once on
+        all combinations, in the order of the table.
+
+        Parameters
+        ----------
+        model : sklearn estimator
+            The model, e.g. the soft-voting classifier
+        model_features : list
+            The features of the model
+        state : FeatureState
+            The frozen state the features are engineered with
+
+        Returns
+        -------
+        TablePredictor
+            The tabulated model
+        """
+        import pandas as pd
+
+        domains = feature_domains(model_features, state)
+        grid = np.array(list(itertools.product(*domains.values())), dtype=np.int64)
+        table = model.predict_proba(pd.DataFrame(grid, columns=model_features))
+
+        return cls(model_features, [d.start for d in domains.values()], [len(d) for d in domains.values()], table)
+
+    def predict_proba(self, X) -> np.ndarray:
+        """
+        Looks up the class probabilities of the rows of X
+
+        Parameters
+        ----------
+        X : pd.DataFrame or np.ndarray
+            The model features, as a DataFrame or as an
+            array with the columns in the order of model_features
+
+        Returns
+        -------
+        np.ndarray
+            The class probabilities of every row
+        """
+        values = np.asarray(X[self.model_features] if hasattr(X, 'columns') else X, dtype=np.int64)
+        values = values - self.offsets
+        if ((values < 0) | (values >= self.sizes)).any():
+            raise ValueError("Feature values outside of the tabulated domain")
+        return self.table[values @ self.strides]
+
+    def save(self, filename : str) -> None:
+        """
+        Saves the table with pickle
+
+        Parameters
+        ----------
+        filename : str
+            Where to save the table
+        """
+        with open(filename, 'wb') as f:
+            pickle.dump({'model_features': self.model_features, 'offsets': self.offsets,
+                         'sizes': self.sizes, 'table': self.table, 'source': self.source}, f)
+
+    @classmethod
+    def load(cls, filename : str) -> 'TablePredictor':
+        """
+        Loads a table saved with TablePredictor.save
+
+        Parameters
+        ----------
+        filename : str
+            The saved table
+
+        Returns
+        -------
+        TablePredictor
+            The loaded table
+        """
+        with open(filename, 'rb') as f:
+            return cls(**pickle.load(f))
+
+
+# ---------------------------- the flattened ensemble ----------------------------
+def _flatten_trees(trees : list, leaf_values : list) -> dict:
+    """
+    Concatenates the nodes of sklearn trees into flat arrays
+
+    Parameters
+    ----------
+    trees : list
+        The fitted sklearn.tree._tree.Tree objects (estimator.tree_)
+    leaf_values : list
+        The output of every node of each tree; only the leaves' are used
+
+    Returns
+    -------
+    dict
+        'feature', 'threshold', 'left', 'right', 'value' of all nodes, with
+        the children as indices into the flat arrays (-1 at the leaves),
+        'roots', the index of every tree's root, and 'depth', the largest depth
+    """
+    feature, threshold, left, right, value, roots = [], [], [], [], [], []
+    offset = 0
+    for tree, values in zip(trees, leaf_values):
+        leaf = tree.children_left < 0
+        roots.append(offset)
+        # the leaves compare feature 0 with anything, their children are never followed
+        feature.append(np.where(leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        left.append(np.where(leaf, -1, tree.children_left + offset))
+        right.append(np.where(leaf, -1, tree.children_right + offset))
+        value.append(np.asarray(values, dtype=np.float64))
+        offset += tree.node_count
+    return {'feature': np.concatenate(feature).astype(np.int64), 'threshold': np.concatenate(threshold),
+            'left': np.concatenate(left).astype(np.int64), 'right': np.concatenate(right).astype(np.int64),
+            'value': np.concatenate(value), 'roots': np.array(roots, dtype=np.int64),
+            'depth': max(tree.max_depth for tree in trees)}
+
+
+def _tree_values(member : dict, X : np.ndarray) -> np.ndarray:
+    """
+    The leaf value every tree of a flattened member assigns to the rows of X
+
+    Returns
+    -------
+    np.ndarray
+        (n, n_trees) array of leaf values
+    """
+    # sklearn compares the features as float32
+    X = X.astype(np.float32)
+    rows = np.arange(len(X))[:, None]
+    node = np.broadcast_to(member['roots'], (len(X), len(member['roots'])))
+    for _ in range(member['depth']):
+        go_left = X[rows, member['feature'][node]] <= member['threshold'][node]
+        child = np.where(go_left, member['left'][node], member['right'][node])
+        node = np.where(child < 0, node, child)
+    return member['value'][node]
+
+
+def _couple(pairwise : np.ndarray) -> np.ndarray:
+    """
+    libsvm's multiclass_probability, which sklearn uses to turn the pairwise
+    probabilities of an SVC into class probabilities, for every row at once.
+    It stops iterating once the error is below 0.005 / k, so even for two
+    classes the result differs from the pairwise probability by up to that.
+
+    Parameters
+    ----------
+    pairwise : np.ndarray
+        (n, k, k) array, [:, i, j] the probability of class i against class j
+
+    Returns
+    -------
+    np.ndarray
+        (n, k) array of class probabilities
+    """
+    n, k, _ = pairwise.shape
+    Q = np.zeros((n, k, k))
+    for t in range(k):
+        for j in range(k):
+            if j != t:
+                Q[:, t, t] += pairwise[:, j, t]**2
+                Q[:, t, j] = -pairwise[:, j, t] * pairwise[:, t, j]
+    p = np.full((n, k), 1 / k)
+    active = np.ones(n, dtype=bool)
+    for _ in range(max(100, k)):
+        Qp  = np.einsum('ntj,nj->nt', Q, p)
+        pQp = (p * Qp).sum(axis=1)
+        active &= np.abs(Qp - pQp[:, None]).max(axis=1) >= 0.005 / k
+        if not active.any():
+            break
+        for t in range(k):
+            diff = np.where(active, (pQp - Qp[:, t]) / Q[:, t, t], 0.)
+            p[:, t] += diff
+            pQp = (pQp + diff * (diff * Q[:, t, t] + 2 * Qp[:, t])) / (1 + diff)**2
+            Qp  = (Qp + diff[:, None] * Q[:, t, :]) / (1 + diff)[:, None]
+            p  /= (1 + diff)[:, None]
+    return p
+
+
+def _member_proba(member : dict, X : np.ndarray) -> np.ndarray:
+    """
+    The probability of class 1 of one flattened member of the ensemble
+    """
+    if member['kind'] == 'forest':
+        return _tree_values(member, X).mean(axis=1)
+    if member['kind'] == 'boosting':
+        raw = member['init'] + _tree_values(member, X).sum(axis=1)
+        return 1 / (1 + np.exp(-raw))
+
+    # svc: libsvm's decision value, the Platt scaling of the pair (0, 1) and the coupling
+    X  = X.astype(np.float64)
+    sv = member['support_vectors']
+    if member['kernel'] == 'rbf':
+        sq = (X**2).sum(axis=1)[:, None] + (sv**2).sum(axis=1)[None, :] - 2 * X @ sv.T
+        kernel = np.exp(-member['gamma'] * np.maximum(sq, 0))
+    elif member['kernel'] == 'sigmoid':
+        kernel = np.tanh(member['gamma'] * X @ sv.T + member['coef0'])
+    else:
+        kernel = X @ sv.T
+    decision = kernel @ member['dual_coef'] + member['intercept']
+    # sklearn flips the sign of libsvm's binary decision value
+    pairwise = 1 / (1 + np.exp(-decision * member['prob_a'] + member['prob_b']))
+    pairwise = np.clip(pairwise, 1e-7, 1 - 1e-7)
+    return _couple(np.stack([np.stack([np.zeros_like(pairwise), pairwise], axis=1),
+                             np.stack([1 - pairwise, np.zeros_like(pairwise)], axis=1)], axis=1))[:, 1]
+
+
+def _flatten_estimator(estimator) -> dict:
+    """
+    The NumPy arrays behind the predict_proba of a fitted binary sklearn estimator
+    """
+    from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier, GradientBoostingClassifier
+    from sklearn.svm import SVC
+
+    if list(estimator.classes_) != [0, 1]:
+        raise ValueError(f"Only binary 0/1 classifiers can be exported, not classes {list(estimator.classes_)}")
+
+    if isinstance(estimator, (RandomForestClassifier, ExtraTreesClassifier)):
+        trees = [tree.tree_ for tree in estimator.estimators_]
+        # a tree predicts the class fractions of its leaf
+        values = [tree.value[:, 0, 1] / tree.value[:, 0, :].sum(axis=1) for tree in trees]
+        return dict(kind='forest', **_flatten_trees(trees, values))
+
+    if isinstance(estimator, GradientBoostingClassifier):
+        if estimator.init_ == 'zero':
+            init = 0.
+        else:
+            # the log-odds of the prior, clipped as sklearn's binomial deviance does
+            eps   = np.finfo(np.float32).eps
+            prior = np.clip(estimator.init_.predict_proba(np.zeros((1, estimator.n_features_in_)))[0, 1], eps, 1 - eps)
+            init  = float(np.log(prior / (1 - prior)))
+        trees = [tree.tree_ for tree in estimator.estimators_[:, 0]]
+        values = [estimator.learning_rate * tree.value[:, 0, 0] for tree in trees]
+        return dict(kind='boosting', init=init, **_flatten_trees(trees, values))
+
+    if isinstance(estimator, SVC) and estimator.probability and estimator.kernel in SVC_KERNELS:
+        return {'kind': 'svc', 'kernel': estimator.kernel, 'gamma': float(estimator._gamma),
+                'coef0': float(estimator.coef0),
+                'support_vectors': np.asarray(estimator.support_vectors_, dtype=np.float64),
+                'dual_coef': np.asarray(estimator.dual_coef_[0], dtype=np.float64),
+                'intercept': float(estimator.intercept_[0]),
+                'prob_a': float(estimator.probA_[0]), 'prob_b': float(estimator.probB_[0])}
+
+    raise ValueError(f"Cannot flatten a {type(estimator).__name__}; export the model as a table instead")
+
+
+class EnsemblePredictor:
+    """
+    A soft-voting ensemble of random forests, gradient boosting and
+    SVCs, flattened into NumPy arrays: the nodes of all trees are in
+    flat arrays walked for every row at once, the SVCs are their
+    support vectors and Platt scaling. It reproduces predict_proba of
+    the sklearn model (up to rounding) for any feature values, without
+    needing scikit-learn, and does not grow with the feature domains
+    as the table of TablePredictor does.
+
+    Attributes
+    ----------
+    model_features : list
+        The names of the model features, in the order of the columns
+
+    members : list
+        The flattened estimators, dicts of NumPy arrays and numbers
+
+    weights : np.ndarray
+        The voting weight of every member
+
+    source : str
+        The source_hash of the artifacts the ensemble was exported from, if known
+
+    Methods
+    -------
+    export(model, model_features : list) -> EnsemblePredictor
+        Flattens a fitted model
+
+    predict_proba(X) -> np.ndarray
+        Predicts the class probabilities of the rows of X
+
+    save(filename : str)
+        Saves the flattened ensemble
+
+    load(filename : str) -> EnsemblePredictor
+        Loads a saved ensemble
+    """
+
+    def __init__(self, model_features : list, members : list, weights : np.ndarray, source : str = None) -> None:
+        self.model_features = list(model_features)
+        self.members = list(members)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.source  = source
+
+    @classmethod
+    def export(cls, model, model_features : list) -> 'EnsemblePredictor':
+        """
+        Flattens a fitted model
+
+        Parameters
+        ----------
+        model : sklearn estimator
+            A soft VotingClassifier of, or a single, RandomForestClassifier,
+            ExtraTreesClassifier, GradientBoostingClassifier or SVC
+            (with a kernel of SVC_KERNELS, probability=True)
+        model_features : list
+            The features of the model
+
+        Returns
+        -------
+        EnsemblePredictor
+            The flattened model
+        """
+        from sklearn.ensemble import VotingClassifier
+
+        if isinstance(model, VotingClassifier):
+            if model.voting != 'soft':
+                raise ValueError("Only soft-voting ensembles have probabilities to export")
+            estimators = model.estimators_
+            weights = model.weights if model.weights is not None else np.ones(len(estimators))
+        else:
+            estimators, weights = [model], [1.]
+        return cls(model_features, [_flatten_estimator(e) for e in estimators], weights)
+
+    def predict_proba(self, X) -> np.ndarray:
+        """
+        Predicts the class probabilities of the rows of X
+
+        Parameters
+        ----------
+        X : pd.DataFrame or np.ndarray
+            The model features, as a DataFrame or as an
+            array with the columns in the order of model_features
+
+        Returns
+        -------
+        np.ndarray
+            The class probabilities of every row
+        """
+        X = np.asarray(X[self.model_features] if hasattr(X, 'columns') else X)
+        proba = np.empty(len(X))
+        for start in range(0, len(X), ENSEMBLE_BLOCK):
+            block = X[start:start + ENSEMBLE_BLOCK]
+            members = np.stack([_member_proba(member, block) for member in self.members])
+            proba[start:start + ENSEMBLE_BLOCK] = self.weights @ members / self.weights.sum()
+        return np.column_stack([1 - proba, proba])
+
+    def save(self, filename : str) -> None:
+        """
+        Saves the flattened ensemble with pickle
+
+        Parameters
+        ----------
+        filename : str
+            Where to save the ensemble
+        """
+        with open(filename, 'wb') as f:
+            pickle.dump({'model_features': self.model_features, 'members': self.members,
+                         'weights': self.weights, 'source': self.source}, f)
+
+    @classmethod
+    def load(cls, filename : str) -> 'EnsemblePredictor':
+        """
+        Loads an ensemble saved with EnsemblePredictor.save
+
+        Parameters
+        ----------
+        filename : str
+            The saved ensemble
+
+        Returns
+        -------
+        EnsemblePredictor
+            The loaded ensemble
+        """
+        with open(filename, 'rb') as f:
+            return cls(**pickle.load(f))
+
+
+def export_model(model, model_features : list, state : FeatureState, fmt : str = 'table',
+                 tolerance : float = EXPORT_TOLERANCE):
+    """
+    Exports a model as a TablePredictor or an EnsemblePredictor and checks
+    that it reproduces the model's probabilities on every combination of
+    the feature values
+
+    Parameters
+    ----------
+    model : sklearn estimator
+        The model, e.g. the soft-voting classifier
+    model_features : list
+        The features of the model
+    state : FeatureState
+        The frozen state the features are engineered with
+    fmt : str
+        One of EXPORT_FORMATS
+    tolerance : float
+        The largest allowed difference to the model's probabilities
+
+    Returns
+    -------
+    tuple
+        (the predictor, the largest difference to the model's probabilities)
+    """
+    import pandas as pd
+
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {tuple(EXPORT_FORMATS)}")
+    if fmt == 'table':
+        predictor = TablePredictor.export(model, model_features, state)
+    else:
+        predictor = EnsemblePredictor.export(model, model_features)
+
+    domains = feature_domains(model_features, state)
+    grid = pd.DataFrame(list(itertools.product(*domains.values())), columns=model_features)
+    error = float(np.abs(predictor.predict_proba(grid) - model.predict_proba(grid)).max())
+    if error > tolerance:
+        raise ValueError(f"The exported {fmt} differs from the model by up to {error:.3g} > {tolerance:.3g}")
+    return predictor, error
+
+
+class CompactScorer:
+    """
+    A lean scorer which only needs NumPy: it engineers the features of
+    the tickets' bitmasks (src/tickets.py) with the frozen FeatureState
+    and looks the predictions up in the
+    tabulated model, such that neither pandas, scikit-learn nor scipy
+    are imported and the pickled model never needs to be loaded.
+    Without the table, it evaluates the flattened ensemble instead.
+    An export is only used if it was exported from the model and state
+    in model_dir (see source_hash), otherwise a ValueError is raised.
+
+    Attributes
+    ----------
+    state : FeatureState
+        The sum means and bins of the dataset the model was trained on
+
+    predictor : TablePredictor or EnsemblePredictor
+        The tabulated or flattened model
+
+    Methods
+    -------
+    available(model_dir : str) -> bool
+        Whether model_dir has the artifacts the compact scorer needs
+
+    predict_proba(numbers : np.ndarray, years : np.ndarray) -> np.ndarray
+        Predicts the bad/good probabilities of an array of tickets
+    """
+
+    def __init__(self, model_dir : str = MODEL_DIR, fmt : str = None) -> None:
+        # the table is a single lookup, so it is preferred over the ensemble
+        formats = [fmt] if fmt is not None else list(EXPORT_FORMATS)
+        source  = source_hash(model_dir)
+        self.predictor = None
+        for fmt in formats:
+            filename = os.path.join(model_dir, EXPORT_FORMATS[fmt])
+            if not os.path.exists(filename):
+                continue
+            with stage('unpickle ' + EXPORT_FORMATS[fmt]):
+                predictor = (TablePredictor if fmt == 'table' else EnsemblePredictor).load(filename)
+            if predictor.source == source:
+                self.predictor = predictor
+                break
+        if self.predictor is None:
+            raise ValueError(f"No {' or '.join(formats)} export of the model in {model_dir}: it is missing or was "
+                             "exported from another model or state, export it again with quick-start.py export")
+        with stage('unpickle feature-state.sav'):
+            self.state = FeatureState.load(os.path.join(model_dir, 'feature-state.sav'))
+
+    @staticmethod
+    def available(model_dir : str = MODEL_DIR) -> bool:
+        """
+        Whether model_dir has the artifacts the compact scorer needs
+        """
+        return (os.path.exists(os.path.join(model_dir, 'feature-state.sav'))
+                and any(os.path.exists(os.path.join(model_dir, f)) for f in EXPORT_FORMATS.values()))
+
+    @instrument()
+    def predict_proba(self, numbers : np.ndarray, years : np.ndarray) -> np.ndarray:
+        """
+        Predicts the probability of an array of (valid, sorted)
+        tickets to be a bad (column 0) or good (column 1) number
+
+        Parameters
+        ----------
+        numbers : np.ndarray
+            (n, 7) array of tickets with columns N1 -> N5, L1, L2
+        years : np.ndarray
+            The year of each ticket, or a single year for all of them
+
+        Returns
+        -------
+        np.ndarray
+            (n, 2) array of probabilities
+        """
+        features = TicketMasks.from_numbers(numbers, years).engineer_features(self.state)
+        return self.predictor.predict_proba(np.column_stack([features[col] for col in self.predictor.model_features]))
@@ -1,6 +1,11 @@
+import numpy as np
 import pandas as pd
 from scipy.special import binom
 import itertools
+from src.vecEng import TICKET_COLS, VectorisedFeatureEngineering, FeatureState
+from src.eras import WIN_FRAC, ERA_L_MAX, GROUP_TAGS, PRIZE_TABLE, draw_eras, row_era
+from src.parallel import engineer_features as engineer_sharded
+from src.profiling import instrument, stage
 class FeatureEngineering:
     """
     A feature engineering class.
@@ -14,11 +19,12 @@ class FeatureEngineering:
         The data which will be engineered
     
     win_frac: dict
-        The fraction of the prize pool for each winning category (See ../datasets/README.md for details)
+        The fraction of the prize pool for each winning category today (See ../datasets/README.md for details).
+        The fractions of the earlier eras are in src/eras.py
 
     Methods
     -------
-    engineer_features() -> pd.DataFrame
+    engineer_features(vectorised : bool = True, state : FeatureState = None) -> pd.DataFrame
         Engineer new features for self.data from existing ones
 
     is_date(c : pd.Series) -> bool
@@ -48,24 +54,27 @@ class FeatureEngineering:
     score_numbers(row: pd.Series) -> float
         Given a row from the euromillions dataset, generate a score for the given number with the recipe described in euromillions.ipynb
 
-    score_dataset(df : pd.DataFrame) -> pd.DataFrame
+    score_numbers_vectorised(df : pd.DataFrame) -> pd.Series
+        The same score as score_numbers, computed for all rows of df at once
+
+    lmax(df : pd.DataFrame) -> np.ndarray
+        The number of lucky numbers in the draw pool on the date of every row
+
+    score_dataset(df : pd.DataFrame, vectorised : bool = True) -> pd.DataFrame
         Scores the datset by assigning an 'avg win' column representing the average winnings relative to the whole dataset
     
     """
 
     def __init__(self, df : pd.DataFrame) -> None:
         self.data = df
-
-        self.win_frac= {5: {0: 0.0061, 1: 0.0261, 2: 0.5000},
-                        4: {0: 0.0026, 1: 0.0035, 2: 0.0019},
-                        3: {0: 0.0270, 1: 0.0145, 2: 0.0037},
-                        2: {0: 0.1659, 1: 0.1030, 2: 0.0130},
-                        1: {2: 0.0327}}
+        self.win_frac = WIN_FRAC
 
 
     #
     # --------------------------------- Methods for new features ---------------------------------
     #
+    # The row per row methods are called by DataFrame.apply for every row, so they are not
+    # timed themselves: each apply of engineer_features is a stage (see src/profiling.py)
     def is_date(self, c : pd.Series) -> bool:
         """ 
         Checks whether the row c contains
@@ -234,47 +243,97 @@ class FeatureEngineering:
         return len(binned_row.unique())
 
 
-    def engineer_features(self) -> pd.DataFrame:
+    def engineer_features(self, vectorised : bool = True, state : FeatureState = None,
+                          backend : str = 'serial', workers : int = None) -> pd.DataFrame:
         """
         Engineer new features for self.data from existing ones.
         Note that these new features are completely hard-coded.
 
+        Parameters
+        ----------
+        vectorised : bool
+            If True, compute the features on whole arrays through
+            VectorisedFeatureEngineering (src/vecEng.py). If False, use the
+            row per row methods of this class. Both give identical features.
+        state : FeatureState
+            Frozen sum means and bins (see src/vecEng.py) to engineer the
+            features with, instead of computing them w.r.t. self.data.
+            Only supported by the vectorised engine.
+        backend : str
+            How the vectorised engine runs: 'serial', or sharded over
+            the rows in a 'thread' or 'process' pool (see src/parallel.py)
+        workers : int
+            The number of threads / processes (default: all cores)
+
         Returns
         -------
         pd.DataFrame
             The newly engineered features
         """
 
-        N_numbers = self.data.loc[:,'YYYY':'N5']
-        L_numbers = self.data.loc[:, ['L1', 'L2']]
-
-        # ---------------------------- date-based-features -----------------------------------------
-        self.data["is date"]      = N_numbers.apply(self.is_date, axis = 1)
-        self.data["is post 2000"] = N_numbers.apply(self.is_post_2000, axis = 1)
-        self.data["is this year"] = N_numbers.apply(self.is_this_year, axis = 1)
-        # ---------------------------- lucky-numbers-based features -----------------------------------------
-        self.data["lucky numbers"]      = N_numbers.apply(self.get_lucky_numbers, axis = 1)
-        self.data["lucky lucky numbers"]= L_numbers.apply(self.get_lucky_numbers, axis = 1)
-        self.data["has lucky"]          = self.data["lucky numbers"]>0
-        self.data["has lucky lucky"]    = self.data["lucky lucky numbers"]>0
-        # ---------------------------- unlucky-numbers-based features -----------------------------------------
-        self.data["7 pattern"]          = N_numbers.apply(self.get_all_7_numbers, axis = 1)
-        # ---------------------------- betting-no-based features -----------------------------------------
-        self.data["N rows"]    = N_numbers.apply(self.number_of_different_rows, axis=1)
-        self.data["N sum"]     = N_numbers.loc[:,'N1':].apply(lambda c: c.sum(), axis = 1)
-        self.data["L sum"]     = L_numbers.apply(lambda c: c.sum(), axis = 1)
-        self.data["N sum big"] = self.data["N sum"] > self.data["N sum"].mean()
-        self.data["L sum big"] = self.data["L sum"] > self.data["L sum"].mean()
-
-        #  ---------------------------- binning features -----------------------------------------
-        from sklearn.preprocessing import LabelEncoder
-        label_encoder = LabelEncoder()
-        self.data['N sum bin']   = label_encoder.fit_transform(pd.cut(self.data['N sum'], 10))
-        self.data['L sum bin']   = label_encoder.fit_transform(pd.cut(self.data['L sum'], 6))
-        self.data['NL sum']      = self.data['N sum'] + self.data['L sum']
-        self.data['NL sum bin']  = label_encoder.fit_transform(pd.cut(self.data["NL sum"], 6))
+        if state is not None and not vectorised:
+            raise ValueError("A frozen FeatureState requires vectorised = True")
+
+        if not vectorised and backend != 'serial':
+            raise ValueError("A parallel backend requires vectorised = True")
+
+        # each engine and each of its features is a stage of its own (see src/profiling.py)
+        if vectorised:
+            with stage('engineer_features/vectorised', len(self.data)):
+                if backend == 'serial':
+                    features = VectorisedFeatureEngineering.from_dataframe(self.data).engineer_features(state)
+                else:
+                    features = engineer_sharded(self.data[TICKET_COLS].to_numpy(), self.data['YYYY'].to_numpy(),
+                                                state, backend=backend, workers=workers)
+                for col, values in features.items():
+                    self.data[col] = values
+            return self.data
+
+        rows = len(self.data)
+        with stage('engineer_features/reference', rows):
+            N_numbers = self.data.loc[:,'YYYY':'N5']
+            L_numbers = self.data.loc[:, ['L1', 'L2']]
+
+            # ---------------------------- date-based-features -----------------------------------------
+            with stage('is date', rows):
+                self.data["is date"]      = N_numbers.apply(self.is_date, axis = 1)
+            with stage('is post 2000', rows):
+                self.data["is post 2000"] = N_numbers.apply(self.is_post_2000, axis = 1)
+            with stage('is this year', rows):
+                self.data["is this year"] = N_numbers.apply(self.is_this_year, axis = 1)
+            # ---------------------------- lucky-numbers-based features -----------------------------------------
+            with stage('lucky numbers', rows):
+                self.data["lucky numbers"]      = N_numbers.apply(self.get_lucky_numbers, axis = 1)
+            with stage('lucky lucky numbers', rows):
+                self.data["lucky lucky numbers"]= L_numbers.apply(self.get_lucky_numbers, axis = 1)
+            self.data["has lucky"]          = self.data["lucky numbers"]>0
+            self.data["has lucky lucky"]    = self.data["lucky lucky numbers"]>0
+            # ---------------------------- unlucky-numbers-based features -----------------------------------------
+            with stage('7 pattern', rows):
+                self.data["7 pattern"]          = N_numbers.apply(self.get_all_7_numbers, axis = 1)
+            # ---------------------------- betting-no-based features -----------------------------------------
+            with stage('N rows', rows):
+                self.data["N rows"]    = N_numbers.apply(self.number_of_different_rows, axis=1)
+            with stage('N sum', rows):
+                self.data["N sum"]     = N_numbers.loc[:,'N1':].apply(lambda c: c.sum(), axis = 1)
+            with stage('L sum', rows):
+                self.data["L sum"]     = L_numbers.apply(lambda c: c.sum(), axis = 1)
+            self.data["N sum big"] = self.data["N sum"] > self.data["N sum"].mean()
+            self.data["L sum big"] = self.data["L sum"] > self.data["L sum"].mean()
+
+            #  ---------------------------- binning features -----------------------------------------
+            with stage('sum bins', rows):
+                from sklearn.preprocessing import LabelEncoder
+                label_encoder = LabelEncoder()
+                self.data['N sum bin']   = label_encoder.fit_transform(pd.cut(self.data['N sum'], 10))
+                self.data['L sum bin']   = label_encoder.fit_transform(pd.cut(self.data['L sum'], 6))
+                self.data['NL sum']      = self.data['N sum'] + self.data['L sum']
+                self.data['NL sum bin']  = label_encoder.fit_transform(pd.cut(self.data["NL sum"], 6))
+
+        return self.data
 
     
+    @instrument()
     def drop_unwanted_values(self) -> pd.DataFrame:
         """
         Drop unwanted information from the dataframe
@@ -336,31 +395,19 @@ class FeatureEngineering:
         """
 
         # The scoring must be date-specific. 
-        # As mentioned in ./datasets/README.md, the number of drawn lucky numers changed:
-        # -> After  Sep 24th 2016, the maximum number of lucky numbers was 12
-        # -> Before Sep 24th 2016 and after May 10th 2011, the maximum number was 11
-        #
-        # The below code therefore differentiates between the two cases
-
-        # Figure out what Lmax we need to use depending on the date in the row 
-        # Logic: Lmax = 12 if
-        # 1) it's after 2016 OR 
-        # 2) if it's the year 2016, but it's after September OR
-        # 3) it's september 2016, but after the 24th
-        if  (row['YYYY'] > 2016) or \
-            (row['YYYY'] == 2016) * (row['MMM'] in ['Oct', 'Nov', 'Dec']) or\
-            (row['YYYY'] == 2016) * (row['MMM'] == 'Sep') * (row['DD'] >= 24):
-            Lmax = 12
-        else:
-            Lmax = 11
+        # As mentioned in ./datasets/README.md, the rules changed over time:
+        # the number of lucky numbers (9, 11, then 12) and the winning groups.
+        # The era of the row's date has the Lmax and the prize fractions (see src/eras.py)
+        era  = row_era(row)
+        Lmax = era.l_max
 
         avg_win = 0
         # loop through the possible winning groups
         for N, L in itertools.product(range(1, 6), range(0, 3)):
             nl_tag = str(N)+ ("+"+str(L) if L!=0 else "")
-            if nl_tag in row.index:
+            if nl_tag in row.index and era.has_group(N, L):
                 pr_nl_win   = self.prob_NL_analyt(N, L, Lmax) # Pr[N,L] = Pr[N,L | win] * 1/13 from above
-                nl_win_frac = self.win_frac[N][L]       # f_p,k=(N,L)
+                nl_win_frac = era.win_frac[N][L]        # f_p,k=(N,L)
                 num_winners = row[nl_tag]
                 num_sales   = row['Sales']
 
@@ -372,7 +419,60 @@ class FeatureEngineering:
                 # print("k = {0}\t\tPr[N,L] = {1:.4f}, f_w,k = {2:.4f}, n_k = {3}\t\tE[win] = {4}".format(nl_tag, pr_nl_win, nl_win_frac, num_winners, avg_win))
         return avg_win
 
-    def score_dataset(self, df : pd.DataFrame) -> pd.DataFrame:
+    @instrument()
+    def score_numbers_vectorised(self, df : pd.DataFrame) -> pd.Series:
+        """
+        The same score as score_numbers, computed for all rows of df
+        at once: the era of every row is found with one searchsorted over
+        the era start dates, and each winning group adds Pr[N,L] * f_p,k
+        (looked up in the precomputed PRIZE_TABLE of src/eras.py, 0 for
+        the groups an era does not have) times f_w,k for all rows at once.
+        The groups are summed in the same order as in score_numbers, such
+        that the result is identical.
+
+        Parameters
+        ----------
+        df: pd.DataFrame
+            Rows of the euromillions dataset
+
+        Returns
+        -------
+        pd.Series
+            average winnigs for each row
+        """
+        era = draw_eras(df)
+        num_sales = df['Sales'].to_numpy(dtype=float)
+
+        avg_win = np.zeros(len(df))
+        for group, nl_tag in enumerate(GROUP_TAGS):
+            if nl_tag in df.columns:
+                num_winners = df[nl_tag].to_numpy(dtype=float)
+                f_w_nl      = (num_sales+1)/(num_winners+1)
+                # a group the era does not have adds nothing, even if its winners are missing (NaN)
+                avg_win    += np.where(PRIZE_TABLE[era, group] != 0, PRIZE_TABLE[era, group] * f_w_nl, 0.)
+
+        return pd.Series(avg_win, index=df.index)
+
+    @staticmethod
+    def lmax(df : pd.DataFrame) -> np.ndarray:
+        """
+        The number of lucky numbers in the draw pool on the date of every
+        row: 9 before May 10th 2011, 11 before Sep 24th 2016, 12 after (see src/eras.py)
+
+        Parameters
+        ----------
+        df: pd.DataFrame
+            Rows of the euromillions dataset
+
+        Returns
+        -------
+        np.ndarray
+            Lmax of each row
+        """
+        return ERA_L_MAX[draw_eras(df)]
+
+    @instrument()
+    def score_dataset(self, df : pd.DataFrame, vectorised : bool = True) -> pd.DataFrame:
         """
         Scores the datset by assigning an 'avg win' column
         representing the average winnings relative to the
@@ -382,19 +482,26 @@ class FeatureEngineering:
         ----------
         df: pd.DataFrame
             The DataFrame to be scored 
+        vectorised : bool
+            If True, score all rows at once with score_numbers_vectorised,
+            otherwise row per row with score_numbers. Both give identical scores.
         Returns
         -------
         pd.DataFrame
             The scored dataframe
         """
         # generate the average winnings for each number
-        scores = df.apply(self.score_numbers, axis = 'columns')
+        if vectorised:
+            scores = self.score_numbers_vectorised(df)
+        else:
+            scores = df.apply(self.score_numbers, axis = 'columns')
         # devide by the mean of each, thus getting the final score
         print(f"mean score: {scores.mean()}")
         scores = scores / scores.mean()
 
         # incorporate that into the euromillions dataset
-        df = pd.concat([df, scores], axis = 1).rename(columns={0: 'avg win'})
+        with stage('pd.concat', len(df)):
+            df = pd.concat([df, scores], axis = 1).rename(columns={0: 'avg win'})
 
 
         return df
@@ -0,0 +1,345 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from src.columnStore import save_columns, ColumnStore
+
+DATA_DIR  = 'datasets'
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+DRAWS_FILE   = 'euro-millions-draws.csv'
+WINNERS_FILE = 'euro-millions-winners.csv'
+SALES_FILE   = 'euro-millions-sales.csv'
+# bump when the cleaning or the dtypes change, so old caches are not used anymore
+LOADER_VERSION = 2
+# the dataset the model was trained on, as a column store in the model directory;
+# the notebook (and older model directories) pickle it as SAVED_DATASET + '.sav'
+SAVED_DATASET = 'saved-dataset'
+
+DAYS   = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+WINNING_GROUPS = ['5+2', '5+1', '5', '4+2', '4+1', '4', '3+2', '2+2', '3+1', '3', '1+2', '2+1', '2']
+
+DRAWS_DTYPES = {'Day': pd.CategoricalDtype(DAYS), 'DD': np.uint8,
+                'MMM': pd.CategoricalDtype(MONTHS), 'YYYY': np.uint16,
+                'N1': np.uint8, 'N2': np.uint8, 'N3': np.uint8, 'N4': np.uint8, 'N5': np.uint8,
+                'L1': np.uint8, 'L2': np.uint8, 'Jackpot': np.int64, 'Wins': np.uint8}
+WINNERS_DTYPE = np.int32
+SALES_DTYPE   = np.float64
+
+
+def _read_csv(filename : str, **kwargs) -> pd.DataFrame:
+    """
+    Reads one of the raw csv files, whose headers and
+    values are padded with spaces (e.g. '   Sales  ')
+    """
+    df = pd.read_csv(filename, skipinitialspace=True, **kwargs)
+    df.columns = [col.strip() for col in df.columns]
+    return df
+
+
+def read_draws(filename : str) -> pd.DataFrame:
+    """
+    Reads the drawn numbers, indexed by the draw number 'No.'
+
+    Parameters
+    ----------
+    filename : str
+        The draws csv file
+
+    Returns
+    -------
+    pd.DataFrame
+        The draws, with compact dtypes
+    """
+    draws = _read_csv(filename, index_col=0)
+    draws.index = draws.index.astype(np.int64)
+    return draws.astype(DRAWS_DTYPES)
+
+
+def read_winners(filename : str) -> pd.DataFrame:
+    """
+    Reads the number of winners per winning group, indexed by
+    the draw number 'No.'. Before May 10th 2011 there was no
+    '2' group, such that these rows lack a column and their
+    total ends up in '2' (see datasets/README.md). These are moved
+    to 'Total', with 0 winners in the '2' group.
+
+    Parameters
+    ----------
+    filename : str
+        The winners csv file
+
+    Returns
+    -------
+    pd.DataFrame
+        The winners, with compact dtypes
+    """
+    winners = _read_csv(filename, index_col=0)
+    winners.index = winners.index.astype(np.int64)
+
+    no_group_2 = winners['Total'].isna()
+    winners.loc[no_group_2, 'Total'] = winners.loc[no_group_2, '2']
+    winners.loc[no_group_2, '2'] = 0
+
+    return winners.astype(WINNERS_DTYPE)
+
+
+def read_sales(filename : str) -> pd.DataFrame:
+    """
+    Reads the number of sales per draw date. Missing sales ('N/A')
+    are returned as NaN.
+
+    Parameters
+    ----------
+    filename : str
+        The sales csv file
+
+    Returns
+    -------
+    pd.DataFrame
+        The columns DD, MMM, YYYY and Sales
+    """
+    sales = _read_csv(filename, usecols=[1, 2, 3, 4], dtype={4: str})
+    # 'N/A' is padded with spaces, which is why na_values cannot catch it
+    sales['Sales'] = sales['Sales'].str.strip().replace('N/A', np.nan)
+    return sales.astype({'DD': np.uint8, 'MMM': pd.CategoricalDtype(MONTHS), 'YYYY': np.uint16,
+                         'Sales': np.float64})
+
+
+def merge_tables(draws : pd.DataFrame, winners : pd.DataFrame, sales : pd.DataFrame,
+                 sales_ratio : float = None) -> pd.DataFrame:
+    """
+    Joins the draws and the winners on the draw number and the
+    sales on the draw date. As in euromillions.ipynb, missing sales
+    are set to the number expected from the draw's total number of winners:
+    mean(sales) / mean(total winners since May 10th 2011) * total winners,
+    kept as a float (e.g. 84406341.737) as in the notebook.
+
+    Parameters
+    ----------
+    draws : pd.DataFrame
+        The output of read_draws
+    winners : pd.DataFrame
+        The output of read_winners
+    sales : pd.DataFrame
+        The output of read_sales
+    sales_ratio : float
+        The sales per winner to impute missing sales with, instead of
+        the ratio of these tables (see sales_aggregates)
+
+    Returns
+    -------
+    pd.DataFrame
+        The merged dataset, one row per draw
+    """
+    if not draws.index.equals(winners.index):
+        raise ValueError("The draws and the winners do not have the same draw numbers")
+
+    date = ['YYYY', 'MMM', 'DD']
+    dataset = pd.concat([draws, winners], axis=1)
+    dataset['Sales'] = pd.merge(dataset[date].reset_index(), sales, on=date, how='left')['Sales'].to_numpy()
+
+    missing = dataset['Sales'].isna()
+    if missing.any():
+        if sales_ratio is None:
+            agg = sales_aggregates(dataset)
+            sales_ratio = (agg['sales sum'] / agg['sales rows']) / (agg['total sum'] / agg['total rows'])
+        dataset.loc[missing, 'Sales'] = (sales_ratio * dataset.loc[missing, 'Total'])
+
+    return dataset.astype({'Sales': SALES_DTYPE})
+
+
+def sales_aggregates(dataset : pd.DataFrame) -> dict:
+    """
+    The sums behind the sales per winner ratio of merge_tables:
+    the known sales, and the total winners since the '2' group exists
+
+    Parameters
+    ----------
+    dataset : pd.DataFrame
+        The merged dataset, with missing sales as NaN
+
+    Returns
+    -------
+    dict
+        'sales sum', 'sales rows', 'total sum' and 'total rows'
+    """
+    known = dataset['Sales'].notna()
+    has_group_2 = dataset['2'] > 0
+    return {'sales sum': float(dataset.loc[known, 'Sales'].sum()), 'sales rows': int(known.sum()),
+            'total sum': float(dataset.loc[has_group_2, 'Total'].sum()), 'total rows': int(has_group_2.sum())}
+
+
+def trim_by_date(df : pd.DataFrame, since : str = None, until : str = None) -> pd.DataFrame:
+    """
+    Selects the draws in [since, until)
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The dataset, with the columns YYYY, MMM and DD
+    since : str
+        The first date to keep (e.g. '2011-05-10'), None to keep everything before until
+    until : str
+        The first date not to keep, None to keep everything after since
+
+    Returns
+    -------
+    pd.DataFrame
+        The trimmed dataset
+    """
+    dates = draw_dates(df)
+    keep = np.ones(len(df), dtype=bool)
+    if since is not None:
+        keep &= dates >= np.datetime64(since)
+    if until is not None:
+        keep &= dates < np.datetime64(until)
+    return df[keep]
+
+
+def draw_dates(df : pd.DataFrame) -> np.ndarray:
+    """
+    The date of every draw in df
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The dataset, with the columns YYYY, MMM and DD
+
+    Returns
+    -------
+    np.ndarray
+        datetime64[D] array of dates
+    """
+    months = pd.Categorical(df['MMM'], categories=MONTHS).codes + 1
+    dates = pd.to_datetime(pd.DataFrame({'year': np.asarray(df['YYYY'], dtype=np.int64), 'month': months,
+                                         'day': np.asarray(df['DD'], dtype=np.int64)}))
+    return dates.to_numpy().astype('datetime64[D]')
+
+
+def csv_hash(data_dir : str = DATA_DIR) -> str:
+    """
+    A hash of the three csv files (and of the loader version),
+    which identifies the cached merged dataset
+
+    Parameters
+    ----------
+    data_dir : str
+        The directory with the csv files
+
+    Returns
+    -------
+    str
+        The hex digest
+    """
+    sha = hashlib.sha256(str(LOADER_VERSION).encode())
+    for filename in (DRAWS_FILE, WINNERS_FILE, SALES_FILE):
+        with open(os.path.join(data_dir, filename), 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def load_dataset(data_dir : str = DATA_DIR, cache_dir : str = CACHE_DIR, since : str = None,
+                 until : str = None, use_cache : bool = True) -> pd.DataFrame:
+    """
+    Loads the merged draws/winners/sales dataset. The parsed and
+    merged dataset is cached as memory-mappable columns in
+    cache_dir/<hash of the csv files>, such that later loads
+    skip parsing the csv files altogether.
+
+    Parameters
+    ----------
+    data_dir : str
+        The directory with the csv files
+    cache_dir : str
+        The directory of the cache
+    since : str
+        If given, only keep draws from this date on (e.g. '2011-05-10')
+    until : str
+        If given, only keep draws before this date
+    use_cache : bool
+        Whether to read and write the cache
+
+    Returns
+    -------
+    pd.DataFrame
+        The dataset, one row per draw, indexed by the draw number
+    """
+    store_dir = os.path.join(cache_dir, csv_hash(data_dir)) if use_cache else None
+
+    if store_dir is not None and os.path.exists(store_dir):
+        dataset = ColumnStore(store_dir).to_dataframe()
+    else:
+        dataset = merge_tables(read_draws(os.path.join(data_dir, DRAWS_FILE)),
+                               read_winners(os.path.join(data_dir, WINNERS_FILE)),
+                               read_sales(os.path.join(data_dir, SALES_FILE)))
+        if store_dir is not None:
+            save_columns(dataset, store_dir)
+
+    if since is not None or until is not None:
+        dataset = trim_by_date(dataset, since, until)
+    return dataset
+
+
+def save_dataset(dataset : pd.DataFrame, model_dir : str) -> None:
+    """
+    Saves the dataset the model was trained on next to the model,
+    as a column store (see save_columns), such that readers only
+    load the columns they need
+
+    Parameters
+    ----------
+    dataset : pd.DataFrame
+        The dataset
+    model_dir : str
+        The model directory
+    """
+    save_columns(dataset, os.path.join(model_dir, SAVED_DATASET))
+
+
+def open_dataset(model_dir : str) -> ColumnStore:
+    """
+    Lazy, memory-mapped access to the dataset saved next to the model
+    (see save_dataset). Nothing but the column names is read until a
+    column is accessed.
+
+    Parameters
+    ----------
+    model_dir : str
+        The model directory
+
+    Returns
+    -------
+    ColumnStore
+        The saved dataset
+    """
+    return ColumnStore(os.path.join(model_dir, SAVED_DATASET))
+
+
+def read_dataset(model_dir : str, columns : list = None) -> pd.DataFrame:
+    """
+    Reads some or all of the columns of the dataset saved next to the
+    model. Model directories without the column store, e.g. written by
+    euromillions.ipynb, have the pickled DataFrame instead, which is
+    read as a whole.
+
+    Parameters
+    ----------
+    model_dir : str
+        The model directory
+    columns : list
+        The columns to read, all of them if None
+
+    Returns
+    -------
+    pd.DataFrame
+        The columns, indexed by the draw number
+    """
+    if os.path.exists(os.path.join(model_dir, SAVED_DATASET)):
+        return open_dataset(model_dir).to_dataframe(columns)
+
+    import pickle
+
+    with open(os.path.join(model_dir, SAVED_DATASET + '.sav'), 'rb') as f:
+        dataset = pickle.load(f)
+    return dataset if columns is None else dataset[columns]
@@ -0,0 +1,386 @@
+import os
+import time
+import pickle
+import warnings
+import numpy as np
+import pandas as pd
+from src.vecEng import N_COLS, L_COLS, TICKET_COLS, VectorisedFeatureEngineering, FeatureState
+from src.tickets import N_MAX, L_MAX, TicketMasks
+from src.dataEng import FeatureEngineering
+from src.scoring import validate_tickets
+from src.compactModel import MODEL_DIR, EXPORT_FORMATS, EXPORT_TOLERANCE, SVC_KERNELS, \
+    TablePredictor, EnsemblePredictor, CompactScorer
+from src import parallel
+
+# random tickets per suite; the reference engine engineers a few hundred rows per second
+ROWS = 2000
+# the years the tickets are played in: is this year / is post 2000 compare the numbers to YYYY - 2000
+YEARS = (2000, 2061)
+# rows per shard of the thread / process engines, small enough to split every check into several shards
+SHARD_SIZE = 512
+# tickets the SVC of every kernel of SVC_KERNELS is fitted on, before its export is checked on all tickets
+SVC_ROWS = 500
+
+# the features the reference engine engineers, in its order
+FEATURES = ['is date', 'is post 2000', 'is this year', 'lucky numbers', 'lucky lucky numbers',
+            'has lucky', 'has lucky lucky', '7 pattern', 'N rows', 'N sum', 'L sum', 'N sum big',
+            'L sum big', 'N sum bin', 'L sum bin', 'NL sum', 'NL sum bin']
+
+# valid tickets at the edges of the features, with the year they are played in. The
+# sorted suite sorts them, the unsorted suite keeps the numbers in the order given
+EDGE_CASES = [
+    # is date: the first number <= 12 is the month, any later number <= 31 the day
+    ([12, 31, 40, 45, 50], 2023), ([12, 32, 40, 45, 50], 2023), ([13, 14, 15, 16, 17], 2023),
+    ([1, 2, 3, 4, 5], 2023), ([11, 12, 32, 33, 34], 2023), ([32, 33, 34, 35, 12], 2023),
+    ([13, 12, 31, 40, 50], 2023), ([31, 12, 40, 45, 50], 2023), ([40, 45, 50, 1, 2], 2023),
+    # is post 2000 (<=) and is this year (==), around the year and around 20
+    ([19, 20, 30, 40, 50], 2019), ([20, 21, 30, 40, 50], 2020), ([20, 21, 30, 40, 50], 2021),
+    ([20, 22, 30, 40, 50], 2021), ([1, 20, 30, 40, 50], 2000), ([20, 40, 48, 49, 50], 2050),
+    ([20, 23, 30, 40, 50], 2023), ([20, 24, 30, 40, 50], 2023), ([2, 20, 23, 40, 50], 2061),
+    # all lucky numbers, the 7 pattern, a single row and five rows of the ticket
+    ([1, 3, 7, 9, 13], 2023), ([7, 17, 27, 37, 47], 2023), ([41, 42, 43, 44, 45], 2023),
+    ([1, 11, 21, 31, 41], 2023), ([10, 20, 30, 40, 50], 2023),
+    # the smallest and largest sums, at the edges of the bins
+    ([1, 2, 3, 4, 5], 2004), ([46, 47, 48, 49, 50], 2004),
+]
+EDGE_STARS = [[1, 2], [11, 12], [1, 12], [3, 9], [2, 7], [6, 12]]
+
+
+def random_tickets(rng : np.random.Generator, n : int, sort : bool = True) -> np.ndarray:
+    """
+    n uniformly random tickets which pass InputHelper.validate_nums:
+    5 unique numbers between 1 and N_MAX and 2 unique stars between 1 and L_MAX
+
+    Parameters
+    ----------
+    rng : np.random.Generator
+        The random generator
+    n : int
+        The number of tickets
+    sort : bool
+        Whether to sort the numbers and the stars of every ticket, as
+        InputHelper.get_user_input and prepare_tickets do
+
+    Returns
+    -------
+    np.ndarray
+        (n, 7) array of tickets with columns N1 -> N5, L1, L2
+    """
+    numbers = np.argsort(rng.random((n, N_MAX)), axis=1)[:, :len(N_COLS)] + 1
+    stars   = np.argsort(rng.random((n, L_MAX)), axis=1)[:, :len(L_COLS)] + 1
+    tickets = np.hstack([numbers, stars])
+    if sort:
+        tickets[:, :len(N_COLS)].sort(axis=1)
+        tickets[:, len(N_COLS):].sort(axis=1)
+    return tickets
+
+
+def edge_case_tickets(sort : bool = True) -> tuple:
+    """
+    The tickets of EDGE_CASES, each with every pair of EDGE_STARS
+
+    Parameters
+    ----------
+    sort : bool
+        Whether to sort the numbers of every ticket; the unsorted edge
+        cases test the column order of the scan of is date
+
+    Returns
+    -------
+    tuple
+        (n, 7) array of tickets and the year of every ticket
+    """
+    tickets, years = [], []
+    for numbers, year in EDGE_CASES:
+        for stars in EDGE_STARS:
+            tickets.append((sorted(numbers) if sort else numbers) + stars)
+            years.append(year)
+    return np.array(tickets, dtype=np.int64), np.array(years, dtype=np.int64)
+
+
+def make_suite(rng : np.random.Generator, n : int, sort : bool = True) -> tuple:
+    """
+    The random tickets and the edge cases of a check, with random years in YEARS
+
+    Returns
+    -------
+    tuple
+        (n, 7) array of valid tickets and the year of every ticket
+    """
+    edges, edge_years = edge_case_tickets(sort)
+    tickets = np.vstack([random_tickets(rng, n, sort), edges])
+    years   = np.concatenate([rng.integers(*YEARS, size=n), edge_years])
+    if not validate_tickets(pd.DataFrame(tickets, columns=TICKET_COLS)).all():
+        raise ValueError("The generated tickets are not valid")
+    return tickets, years
+
+
+# ---------------------------- engines ----------------------------
+def reference_features(tickets : np.ndarray, years : np.ndarray) -> dict:
+    """
+    The features of the row per row methods of FeatureEngineering
+    """
+    df = pd.DataFrame({'YYYY': years, **{col: tickets[:, i] for i, col in enumerate(TICKET_COLS)}})
+    # the row per row engine warns about Series.iteritems on every row
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        df = FeatureEngineering(df).engineer_features(vectorised=False)
+    return {col: df[col].to_numpy() for col in FEATURES}
+
+
+def _sharded(backend : str):
+    def engine(tickets : np.ndarray, years : np.ndarray) -> dict:
+        return parallel.engineer_features(tickets, years, backend=backend, workers=2, shard_size=SHARD_SIZE)
+    return engine
+
+
+# name -> (engine, whether it scans the numbers in column order as the reference does, such
+# that it is checked on unsorted tickets too). The bitmask engine only sees which numbers
+# are on a ticket, not in which column, so it needs sorted tickets
+ENGINES = {'reference': (reference_features, True),
+           'vectorised': (lambda tickets, years: VectorisedFeatureEngineering(tickets, years).engineer_features(), True),
+           'bitmask': (lambda tickets, years: TicketMasks.from_numbers(tickets, years).engineer_features(), False),
+           'thread': (_sharded('thread'), True),
+           'process': (_sharded('process'), True)}
+
+
+def _timed(function, *args) -> tuple:
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def _first_mismatch(tickets : np.ndarray, years : np.ndarray, expected : np.ndarray, actual : np.ndarray) -> tuple:
+    differ = np.flatnonzero(np.asarray(expected) != np.asarray(actual))
+    if len(differ) == 0:
+        return 0, None
+    i = differ[0]
+    return len(differ), f"{tickets[i].tolist()} in {years[i]}: {expected[i]} != {actual[i]}"
+
+
+def check_features(tickets : np.ndarray, years : np.ndarray, suite : str, engines : list = None) -> tuple:
+    """
+    Compares every feature of every engine to the reference engine.
+    The sum means and bins are fitted to the tickets by every engine,
+    as the reference does.
+
+    Parameters
+    ----------
+    tickets : np.ndarray
+        (n, 7) array of valid tickets
+    years : np.ndarray
+        The year of every ticket
+    suite : str
+        The name of the tickets in the report
+    engines : list
+        The engines to compare, all of ENGINES if None. Engines which need
+        the numbers in order are skipped if the suite is not 'sorted'
+
+    Returns
+    -------
+    tuple
+        One row per engine and feature with its mismatches and the first
+        mismatching ticket, and one row per engine with its rows per second
+    """
+    expected, seconds = _timed(reference_features, tickets, years)
+    timings = [{'suite': suite, 'engine': 'reference', 'rows': len(tickets), 'seconds': seconds,
+                'rows/s': len(tickets) / seconds}]
+    rows = []
+    for name in engines or ENGINES:
+        engine, any_order = ENGINES[name]
+        if name == 'reference' or (suite != 'sorted' and not any_order):
+            continue
+        features, seconds = _timed(engine, tickets, years)
+        timings.append({'suite': suite, 'engine': name, 'rows': len(tickets), 'seconds': seconds,
+                        'rows/s': len(tickets) / seconds})
+        for col in FEATURES:
+            if col not in features:
+                rows.append({'suite': suite, 'engine': name, 'feature': col, 'mismatches': len(tickets),
+                             'first mismatch': 'missing'})
+                continue
+            mismatches, first = _first_mismatch(tickets, years, expected[col], features[col])
+            rows.append({'suite': suite, 'engine': name, 'feature': col, 'mismatches': mismatches,
+                         'first mismatch': first})
+    return rows, timings
+
+
+# ---------------------------- predictions ----------------------------
+def prediction_paths(model_dir : str = MODEL_DIR) -> dict:
+    """
+    Every way the saved model predicts an array of tickets, from the
+    artifacts which are in model_dir
+
+    Returns
+    -------
+    dict
+        Name -> function(tickets, years) -> (n, 2) array of probabilities
+    """
+    from src.scoring import TicketScorer
+
+    paths = {}
+    scorer = TicketScorer(model_dir)
+    paths['TicketScorer'] = scorer.predict_proba
+    for backend in ('thread', 'process'):
+        paths[f"TicketScorer, {backend}"] = (
+            lambda tickets, years, backend=backend:
+            parallel.predict_proba(scorer, tickets, years, backend=backend, workers=2, shard_size=SHARD_SIZE))
+    if CompactScorer.available(model_dir):
+        for predictor, fmt in ((TablePredictor, 'table'), (EnsemblePredictor, 'ensemble')):
+            if os.path.exists(os.path.join(model_dir, EXPORT_FORMATS[fmt])):
+                paths[f"CompactScorer, {predictor.__name__}"] = CompactScorer(model_dir, fmt).predict_proba
+    return paths
+
+
+def reference_inputs(tickets : np.ndarray, years : np.ndarray, model_dir : str = MODEL_DIR) -> pd.DataFrame:
+    """
+    The model features of the reference engine, binned with the
+    frozen FeatureState the model was trained with
+    """
+    with open(os.path.join(model_dir, 'model-lables.sav'), 'rb') as f:
+        model_features = pickle.load(f)
+    state = FeatureState.load(os.path.join(model_dir, 'feature-state.sav'))
+
+    features = reference_features(tickets, years)
+    features.update(state.transform(features['N sum'], features['L sum']))
+    return pd.DataFrame({col: features[col] for col in model_features})
+
+
+def check_svc_kernels(X : pd.DataFrame, labels : np.ndarray, tolerance : float = EXPORT_TOLERANCE) -> list:
+    """
+    Fits an SVC of every kernel of SVC_KERNELS, as the grid search of
+    src/train.py may pick them, and compares the predictions of its
+    flattened EnsemblePredictor to those of the SVC
+
+    Parameters
+    ----------
+    X : pd.DataFrame
+        The model features of the tickets
+    labels : np.ndarray
+        The class of every ticket to fit the SVCs to, e.g. the model's
+    tolerance : float
+        The largest difference of a probability counted as equal
+
+    Returns
+    -------
+    list
+        One row per kernel with its largest difference and mismatches
+    """
+    from sklearn.svm import SVC
+
+    rows = []
+    for kernel in SVC_KERNELS:
+        svc = SVC(kernel=kernel, probability=True, random_state=0).fit(X[:SVC_ROWS], labels[:SVC_ROWS])
+        error  = np.abs(EnsemblePredictor.export(svc, list(X.columns)).predict_proba(X) - svc.predict_proba(X)).max(axis=1)
+        differ = np.flatnonzero(error > tolerance)
+        first  = f"row {differ[0]}: difference {error[differ[0]]:.3g}" if len(differ) else None
+        rows.append({'path': f"EnsemblePredictor, {kernel} SVC", 'max error': error.max(),
+                     'mismatches': len(differ), 'first mismatch': first})
+    return rows
+
+
+def check_predictions(tickets : np.ndarray, years : np.ndarray, model_dir : str = MODEL_DIR,
+                      tolerance : float = EXPORT_TOLERANCE) -> tuple:
+    """
+    Compares the predictions of every path of prediction_paths to those of
+    the pickled model on the reference features (see reference_inputs), and
+    checks the export of every SVC kernel on the same features
+
+    Parameters
+    ----------
+    tickets : np.ndarray
+        (n, 7) array of valid, sorted tickets
+    years : np.ndarray
+        The year of every ticket
+    model_dir : str
+        The directory with the saved model
+    tolerance : float
+        The largest difference of a probability counted as equal
+
+    Returns
+    -------
+    tuple
+        One row per path with its largest difference and mismatches,
+        and one row per path with its rows per second
+    """
+    with open(os.path.join(model_dir, 'soft-vote-model.sav'), 'rb') as f:
+        model = pickle.load(f)
+    start = time.perf_counter()
+    X = reference_inputs(tickets, years, model_dir)
+    expected = model.predict_proba(X)
+    seconds = time.perf_counter() - start
+    timings = [{'suite': 'predictions', 'engine': 'reference', 'rows': len(tickets), 'seconds': seconds,
+                'rows/s': len(tickets) / seconds}]
+    rows = []
+    for name, path in prediction_paths(model_dir).items():
+        proba, seconds = _timed(path, tickets, years)
+        timings.append({'suite': 'predictions', 'engine': name, 'rows': len(tickets), 'seconds': seconds,
+                        'rows/s': len(tickets) / seconds})
+        error  = np.abs(proba - expected).max(axis=1)
+        differ = np.flatnonzero(error > tolerance)
+        first  = None
+        if len(differ):
+            i = differ[0]
+            first = f"{tickets[i].tolist()} in {years[i]}: P(GOOD) {expected[i, 1]} != {proba[i, 1]}"
+        rows.append({'path': name, 'max error': error.max(), 'mismatches': len(differ), 'first mismatch': first})
+    rows += check_svc_kernels(X, expected.argmax(axis=1), tolerance)
+    return rows, timings
+
+
+def check_equivalence(rows : int = ROWS, seed : int = None, model_dir : str = MODEL_DIR,
+                      tolerance : float = EXPORT_TOLERANCE, engines : list = None,
+                      predictions : bool = True) -> dict:
+    """
+    Checks that the fast feature engines and prediction paths give what the
+    reference row per row methods give, on random valid tickets and on the
+    EDGE_CASES, and times every engine on the same tickets:
+
+    - 'sorted': sorted tickets, as they are scored, through every engine
+    - 'unsorted': the numbers in random column order, through the engines
+      which take the numbers in order (is date scans them column by column)
+    - the predictions of every path on the sorted tickets, and the export
+      of an SVC of every kernel the grid search may pick (see check_svc_kernels)
+
+    Parameters
+    ----------
+    rows : int
+        The random tickets per suite, besides the edge cases
+    seed : int
+        The seed. If None, a fresh one is drawn from the OS
+    model_dir : str
+        The directory with the saved model
+    tolerance : float
+        The largest difference of a probability counted as equal
+    engines : list
+        The engines of ENGINES to check, all of them if None
+    predictions : bool
+        Whether to check the prediction paths
+
+    Returns
+    -------
+    dict
+        'features': one row per suite, engine and feature; 'predictions':
+        one row per path; 'throughput': the rows per second of every engine
+        and path; 'passed': whether nothing mismatched; 'seed': the entropy
+        to reproduce the tickets with
+    """
+    root = np.random.SeedSequence(seed)
+    rng  = np.random.default_rng(root)
+
+    features, throughput = [], []
+    for suite, sort in (('sorted', True), ('unsorted', False)):
+        tickets, years = make_suite(rng, rows, sort)
+        suite_rows, timings = check_features(tickets, years, suite, engines)
+        features += suite_rows
+        throughput += timings
+
+    paths = []
+    if predictions:
+        tickets, years = make_suite(rng, rows)
+        paths, timings = check_predictions(tickets, years, model_dir, tolerance)
+        throughput += timings
+
+    features = pd.DataFrame(features, columns=['suite', 'engine', 'feature', 'mismatches', 'first mismatch'])
+    paths    = pd.DataFrame(paths, columns=['path', 'max error', 'mismatches', 'first mismatch'])
+    passed   = features['mismatches'].sum() == 0 and paths['mismatches'].sum() == 0
+    return {'features': features, 'predictions': paths, 'throughput': pd.DataFrame(throughput),
+            'passed': bool(passed), 'seed': root.entropy}
@@ -0,0 +1,126 @@
+import itertools
+import numpy as np
+from scipy.special import binom
+from src.vecEng import N_MAX, L_MAX
+from src.dataLoad import MONTHS, draw_dates
+
+# the fraction of the prize fund of every winning group N+L (see datasets/README.md)
+WIN_FRAC = {5: {0: 0.0061, 1: 0.0261, 2: 0.5000},
+            4: {0: 0.0026, 1: 0.0035, 2: 0.0019},
+            3: {0: 0.0270, 1: 0.0145, 2: 0.0037},
+            2: {0: 0.1659, 1: 0.1030, 2: 0.0130},
+            1: {2: 0.0327}}
+# before May 10th 2011 there was no 2+0 group. Its prize fractions are not in the
+# datasets, so the fractions of the other groups are assumed to be today's
+WIN_FRAC_NO_2 = {N: {L: f for L, f in fracs.items() if (N, L) != (2, 0)} for N, fracs in WIN_FRAC.items()}
+# every winning group of any era, in the order score_numbers sums them up
+GROUPS = [(N, L) for N, L in itertools.product(range(1, 6), range(0, 3)) if L in WIN_FRAC[N]]
+GROUP_TAGS = [str(N) + ("+" + str(L) if L != 0 else "") for N, L in GROUPS]
+
+
+class Era:
+    """
+    The rules of the game between two rule changes
+
+    Attributes
+    ----------
+    name : str
+        The name of the era
+
+    start : np.datetime64
+        The date of the era's first draw
+
+    l_max : int
+        The number of lucky numbers (stars) in the draw pool
+
+    win_frac : dict
+        N -> L -> the fraction of the prize fund of the winning group N+L
+
+    Methods
+    -------
+    probability(N : int, L : int) -> float
+        Pr[N, L], the chance of a ticket to match exactly N numbers and L stars
+
+    has_group(N : int, L : int) -> bool
+        Whether the winning group N+L pays out in this era
+
+    tags() -> list
+        The winning groups of the era, e.g. '5+2', '2'
+    """
+
+    def __init__(self, name : str, start : str, l_max : int, win_frac : dict) -> None:
+        self.name     = name
+        self.start    = np.datetime64(start, 'D')
+        self.l_max    = l_max
+        self.win_frac = win_frac
+
+    def probability(self, N : int, L : int) -> float:
+        """
+        Pr[N, L], the chance of a ticket to match exactly N of the 5 numbers
+        and L of the 2 stars, as FeatureEngineering.prob_NL_analyt
+        """
+        return binom(5, N) * binom(N_MAX - 5, 5 - N) * binom(2, L) * binom(self.l_max - 2, 2 - L) \
+            / (binom(N_MAX, 5) * binom(self.l_max, 2))
+
+    def has_group(self, N : int, L : int) -> bool:
+        """
+        Whether the winning group N+L pays out in this era
+        """
+        return L in self.win_frac.get(N, {})
+
+    def tags(self) -> list:
+        """
+        The winning groups of the era, in the order of GROUP_TAGS
+        """
+        return [tag for tag, (N, L) in zip(GROUP_TAGS, GROUPS) if self.has_group(N, L)]
+
+
+# the rules regimes, oldest first (see datasets/README.md, remark 3)
+ERAS = [Era('2004', '2004-02-13', 9,  WIN_FRAC_NO_2),
+        Era('2011', '2011-05-10', 11, WIN_FRAC),
+        Era('2016', '2016-09-24', 12, WIN_FRAC)]
+ERA_STARTS = np.array([era.start for era in ERAS])
+# the number of stars of every era
+ERA_L_MAX = np.array([era.l_max for era in ERAS])
+assert ERA_L_MAX.max() <= L_MAX
+
+# ---------------------------- per-era tables ----------------------------
+# (eras, groups) arrays over GROUPS, built once: a draw's row is looked up with its era index
+HAS_GROUP   = np.array([[era.has_group(N, L) for N, L in GROUPS] for era in ERAS])
+PROBABILITY = np.array([[era.probability(N, L) for N, L in GROUPS] for era in ERAS])
+WIN_FRACS   = np.array([[era.win_frac[N][L] if era.has_group(N, L) else 0. for N, L in GROUPS] for era in ERAS])
+# Pr[N, L] * f_p,(N,L), the factor of the 'avg win' of score_numbers which only depends on the era
+PRIZE_TABLE = PROBABILITY * WIN_FRACS
+
+
+def era_index(dates) -> np.ndarray:
+    """
+    The index in ERAS of the era of every date
+
+    Parameters
+    ----------
+    dates : np.ndarray
+        datetime64 array of draw dates
+
+    Returns
+    -------
+    np.ndarray
+        int64 array of era indices; dates before the first era are in the first era
+    """
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    return np.maximum(np.searchsorted(ERA_STARTS, dates, side='right') - 1, 0)
+
+
+def draw_eras(df) -> np.ndarray:
+    """
+    The index in ERAS of the era of every draw of a DataFrame with the columns YYYY, MMM and DD
+    """
+    return era_index(draw_dates(df))
+
+
+def row_era(row) -> Era:
+    """
+    The era of a single draw, e.g. a row of the dataset with YYYY, MMM and DD
+    """
+    month = MONTHS.index(row['MMM']) + 1
+    return ERAS[int(era_index(np.datetime64(f"{int(row['YYYY']):04d}-{month:02d}-{int(row['DD']):02d}")))]
@@ -0,0 +1,349 @@
+import io
+import os
+import json
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+from src.dataLoad import (DATA_DIR, CACHE_DIR, DRAWS_FILE, WINNERS_FILE, SALES_FILE, MONTHS,
+                          read_draws, read_winners, read_sales, merge_tables, sales_aggregates, trim_by_date)
+from src.dataEng import FeatureEngineering
+from src.vecEng import VectorisedFeatureEngineering, FeatureState
+from src.columnStore import save_columns, ColumnStore
+from src.compactModel import MODEL_DIR
+
+INGEST_DIR = os.path.join(CACHE_DIR, 'ingest')
+# bump when the segments or the aggregates change, so old stores are rebuilt
+INGEST_VERSION = 1
+# only draws with today's prize groups, as in src/train.py
+SINCE = '2011-05-10'
+# the fraction of rows whose model features or labels may change before a rebin/retrain is flagged
+REBIN_THRESHOLD   = 0.02
+RETRAIN_THRESHOLD = 0.02
+
+
+def read_new_lines(filename : str, is_new) -> io.StringIO:
+    """
+    Reads the header and the new records of one of the csv files.
+    New draws are added at the top of the files, so reading stops at
+    the first record which is not new: old records are never parsed.
+
+    Parameters
+    ----------
+    filename : str
+        The csv file
+    is_new : callable
+        is_new(fields) -> bool, given the comma separated fields of a record
+
+    Returns
+    -------
+    io.StringIO
+        The header and the new records, to be parsed by src.dataLoad
+    """
+    lines = []
+    with open(filename) as f:
+        lines.append(f.readline())
+        for line in f:
+            if not line.strip() or not is_new([field.strip() for field in line.split(',')]):
+                break
+            lines.append(line)
+    return io.StringIO(''.join(lines))
+
+
+def known_sales_aggregates(draws : pd.DataFrame, winners : pd.DataFrame, sales : pd.DataFrame) -> dict:
+    """
+    src.dataLoad.sales_aggregates of the draws, before any missing sales are imputed
+    """
+    dataset = pd.concat([draws, winners], axis=1)
+    dataset['Sales'] = pd.merge(draws[['YYYY', 'MMM', 'DD']].reset_index(), sales,
+                                on=['YYYY', 'MMM', 'DD'], how='left')['Sales'].to_numpy()
+    return sales_aggregates(dataset)
+
+
+def draw_date(year : int, month : str, day : int) -> str:
+    """
+    The ISO date of a draw, e.g. '2023-02-28'
+    """
+    return f"{int(year):04d}-{MONTHS.index(month.strip()) + 1:02d}-{int(day):02d}"
+
+
+class DrawIngest:
+    """
+    Append-only ingestion of new draws. Each ingest only parses the
+    records of the csv files which are newer than the last ingested draw,
+    engineers their features and scores them, and saves them as a new
+    segment (a src/columnStore.py directory). The global quantities the
+    dataset is normalised with are kept as running aggregates:
+    - the sum of the (unnormalised) scores, whose mean score_dataset divides by,
+    - the counts of every (N sum, L sum) pair, which give the exact sum means and
+      bins FeatureState.fit would compute on the whole dataset,
+    - the sales and winners sums merge_tables imputes missing sales with.
+    These are compared to the reference the model was trained with, to flag
+    when enough rows would change features (rebin) or labels (retrain).
+
+    Attributes
+    ----------
+    store_dir : str
+        The directory with state.json and the segments
+
+    data_dir : str
+        The directory with the csv files
+
+    model_dir : str
+        The directory with the model's feature-state.sav and model-lables.sav
+
+    state : dict
+        The ingested draws and the running aggregates, saved as state.json
+
+    Methods
+    -------
+    exists() -> bool
+        Whether the store has been bootstrapped
+
+    bootstrap() -> dict
+        Builds the store from the whole csv files
+
+    ingest() -> dict
+        Ingests the draws added since the last ingest
+
+    feature_state() -> FeatureState
+        The sum means and bins of all ingested rows
+
+    score_mean() -> float
+        The mean (unnormalised) score of all ingested rows
+
+    drift() -> dict
+        Compares the aggregates to the reference of the model
+
+    reset_reference()
+        Makes the current aggregates the reference, e.g. after retraining
+
+    dataset(columns : list = None) -> pd.DataFrame
+        All ingested rows, newest first
+    """
+
+    def __init__(self, store_dir : str = INGEST_DIR, data_dir : str = DATA_DIR, model_dir : str = MODEL_DIR) -> None:
+        self.store_dir = store_dir
+        self.data_dir  = data_dir
+        self.model_dir = model_dir
+        self.state     = None
+        if self.exists():
+            with open(os.path.join(store_dir, 'state.json')) as f:
+                self.state = json.load(f)
+
+    def exists(self) -> bool:
+        """
+        Whether the store has been bootstrapped with this version of the ingest
+        """
+        filename = os.path.join(self.store_dir, 'state.json')
+        if not os.path.exists(filename):
+            return False
+        with open(filename) as f:
+            return json.load(f)['version'] == INGEST_VERSION
+
+    # ---------------------------- building the segments ----------------------------
+    def _frozen_state(self) -> FeatureState:
+        return FeatureState.load(os.path.join(self.model_dir, 'feature-state.sav'))
+
+    def _segment(self, dataset : pd.DataFrame) -> pd.DataFrame:
+        """
+        Engineers the features of new rows with the model's frozen
+        state and adds their unnormalised score, 'raw score'
+        """
+        segment = dataset.copy()
+        features = VectorisedFeatureEngineering.from_dataframe(segment).engineer_features(self._frozen_state())
+        for col, values in features.items():
+            segment[col] = values
+        segment['raw score'] = FeatureEngineering(segment).score_numbers_vectorised(segment).to_numpy()
+        return segment
+
+    def _add_segment(self, segment : pd.DataFrame) -> None:
+        """
+        Saves a segment and adds its rows to the running aggregates
+        """
+        name = f"{len(self.state['segments']):06d}"
+        save_columns(segment, os.path.join(self.store_dir, 'segments', name))
+        self.state['segments'].append(name)
+
+        self.state['rows'] += len(segment)
+        self.state['score sum'] += float(segment['raw score'].sum())
+        counts = {(n, l): c for n, l, c in self.state['sums']}
+        pairs, pair_counts = np.unique(segment[['N sum', 'L sum']].to_numpy(dtype=np.int64), axis=0, return_counts=True)
+        for (n, l), c in zip(pairs.tolist(), pair_counts.tolist()):
+            counts[(n, l)] = counts.get((n, l), 0) + c
+        self.state['sums'] = [[n, l, c] for (n, l), c in sorted(counts.items())]
+
+        newest = segment.index.argmax()
+        self.state['last draw'] = int(segment.index[newest])
+        self.state['last date'] = draw_date(segment['YYYY'].iloc[newest], str(segment['MMM'].iloc[newest]),
+                                            segment['DD'].iloc[newest])
+
+    def _save_state(self) -> None:
+        tmp = os.path.join(self.store_dir, 'state.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp, os.path.join(self.store_dir, 'state.json'))
+
+    def bootstrap(self) -> dict:
+        """
+        Builds the store from the whole csv files: the draws since
+        SINCE become the first segment, and the reference is set to
+        the current aggregates
+
+        Returns
+        -------
+        dict
+            The output of drift
+        """
+        if os.path.exists(self.store_dir):
+            shutil.rmtree(self.store_dir)
+        os.makedirs(self.store_dir)
+
+        draws   = read_draws(os.path.join(self.data_dir, DRAWS_FILE))
+        winners = read_winners(os.path.join(self.data_dir, WINNERS_FILE))
+        sales   = read_sales(os.path.join(self.data_dir, SALES_FILE))
+        # as load_dataset, the sales per winner are those of all draws, not only those since SINCE
+        self.state = {'version': INGEST_VERSION, 'since': SINCE, 'segments': [], 'rows': 0, 'score sum': 0.,
+                      'sums': [], 'sales': known_sales_aggregates(draws, winners, sales), 'reference': {}}
+
+        self._add_segment(self._segment(trim_by_date(merge_tables(draws, winners, sales), since=SINCE)))
+        self.reset_reference()
+        return self.drift()
+
+    def ingest(self) -> dict:
+        """
+        Ingests the draws added to the csv files since the last ingest.
+        Only the new records are parsed, engineered and scored.
+
+        Returns
+        -------
+        dict
+            The output of drift, with the number of 'new draws'
+        """
+        if not self.exists():
+            report = self.bootstrap()
+            report['new draws'] = self.state['rows']
+            return report
+
+        last_draw, last_date = self.state['last draw'], self.state['last date']
+        draws = read_new_lines(os.path.join(self.data_dir, DRAWS_FILE), lambda f: int(f[0]) > last_draw)
+        if len(draws.getvalue().splitlines()) == 1:
+            report = self.drift()
+            report['new draws'] = 0
+            return report
+
+        draws   = read_draws(draws)
+        winners = read_winners(read_new_lines(os.path.join(self.data_dir, WINNERS_FILE), lambda f: int(f[0]) > last_draw))
+        sales   = read_sales(read_new_lines(os.path.join(self.data_dir, SALES_FILE),
+                                            lambda f: draw_date(f[3], f[2], f[1]) > last_date))
+
+        # missing sales are imputed with the sales per winner of all draws so far
+        agg = self.state['sales']
+        for key, value in known_sales_aggregates(draws, winners, sales).items():
+            agg[key] += value
+        ratio = (agg['sales sum'] / agg['sales rows']) / (agg['total sum'] / agg['total rows'])
+
+        self._add_segment(self._segment(merge_tables(draws, winners, sales, sales_ratio=ratio)))
+        self._save_state()
+
+        report = self.drift()
+        report['new draws'] = len(draws)
+        return report
+
+    # ---------------------------- the aggregates ----------------------------
+    def _sum_counts(self) -> tuple:
+        sums = np.array(self.state['sums'], dtype=np.int64).reshape(-1, 3)
+        return sums[:, 0], sums[:, 1], sums[:, 2]
+
+    def feature_state(self) -> FeatureState:
+        """
+        The sum means and bins FeatureState.fit would
+        compute on all ingested rows, from their sum counts
+
+        Returns
+        -------
+        FeatureState
+            The state of the whole ingested dataset
+        """
+        n_sum, l_sum, counts = self._sum_counts()
+        return FeatureState.fit(np.repeat(n_sum, counts), np.repeat(l_sum, counts))
+
+    def score_mean(self) -> float:
+        """
+        The mean (unnormalised) score of all ingested
+        rows, which score_dataset normalises with
+        """
+        return self.state['score sum'] / self.state['rows']
+
+    def reset_reference(self) -> None:
+        """
+        Makes the current aggregates the reference the drift is measured
+        against, e.g. after retraining the model on the ingested draws
+        """
+        self.state['reference'] = {'score mean': self.score_mean(), 'rows': self.state['rows']}
+        self._save_state()
+
+    def drift(self) -> dict:
+        """
+        Compares the running aggregates to the reference of the model:
+        - 'feature changes': the fraction of rows whose model features would
+          change if the model's frozen FeatureState was refitted,
+        - 'label changes': the fraction of rows whose 'Good no.' label
+          would change with the current score mean.
+        A 'rebin' (refitting the FeatureState, and thus retraining) or a
+        'retrain' is flagged if these exceed REBIN/RETRAIN_THRESHOLD.
+
+        Returns
+        -------
+        dict
+            The drift report
+        """
+        from src.train import CUTOFF, score_width
+
+        with open(os.path.join(self.model_dir, 'model-lables.sav'), 'rb') as f:
+            model_features = pickle.load(f)
+
+        # binned features, compared on every distinct (N sum, L sum) pair
+        frozen, current = self._frozen_state(), self.feature_state()
+        n_sum, l_sum, counts = self._sum_counts()
+        before, after = frozen.transform(n_sum, l_sum), current.transform(n_sum, l_sum)
+        changed = np.zeros(len(counts), dtype=bool)
+        for col in before:
+            if col in model_features:
+                changed |= before[col] != after[col]
+        feature_changes = counts[changed].sum() / counts.sum()
+
+        # labels, as in src/train.py
+        raw = self.dataset(['raw score'])['raw score'].to_numpy()
+        labels = []
+        for mean in (self.state['reference']['score mean'], self.score_mean()):
+            scores = raw / mean
+            labels.append(scores >= 1 + score_width(scores)*CUTOFF if CUTOFF else scores >= 1)
+        label_changes = (labels[0] != labels[1]).mean()
+
+        return {'rows': self.state['rows'], 'last draw': self.state['last draw'], 'last date': self.state['last date'],
+                'rows since reference': self.state['rows'] - self.state['reference']['rows'],
+                'score mean': self.score_mean(), 'reference score mean': self.state['reference']['score mean'],
+                'N sum mean': current.means['N sum'], 'reference N sum mean': frozen.means['N sum'],
+                'L sum mean': current.means['L sum'], 'reference L sum mean': frozen.means['L sum'],
+                'feature changes': float(feature_changes), 'label changes': float(label_changes),
+                'rebin': bool(feature_changes > REBIN_THRESHOLD),
+                'retrain': bool(feature_changes > REBIN_THRESHOLD or label_changes > RETRAIN_THRESHOLD)}
+
+    def dataset(self, columns : list = None) -> pd.DataFrame:
+        """
+        All ingested rows, newest first as in the csv files
+
+        Parameters
+        ----------
+        columns : list
+            The columns to read, all of them if None
+
+        Returns
+        -------
+        pd.DataFrame
+            The ingested rows, with their features and 'raw score'
+        """
+        segments = [ColumnStore(os.path.join(self.store_dir, 'segments', name)).to_dataframe(columns)
+                    for name in reversed(self.state['segments'])]
+        return pd.concat(segments)
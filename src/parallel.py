@@ -0,0 +1,265 @@
+import os
+import numpy as np
+from multiprocessing import Pool, shared_memory
+from concurrent.futures import ThreadPoolExecutor
+from src.vecEng import N_COLS, VectorisedFeatureEngineering, FeatureState
+
+# serial: in this thread; thread: a thread pool, sharing everything (NumPy releases the GIL
+# in most of the feature engineering); process: a process pool, with the inputs and
+# outputs in shared memory
+BACKENDS = ('serial', 'thread', 'process')
+# rows per task; large enough to amortise the overhead of a task, small enough to balance the workers
+SHARD_SIZE = 100000
+
+# the task, its context and the shared arrays of each worker process, set by _init_worker
+_worker = {}
+
+
+def shards(n_rows : int, shard_size : int = SHARD_SIZE) -> list:
+    """
+    Splits the rows 0 -> n_rows into consecutive (start, stop) ranges
+    """
+    return [(start, min(start + shard_size, n_rows)) for start in range(0, n_rows, shard_size)]
+
+
+class SharedArrays:
+    """
+    NumPy arrays in named shared memory blocks, such that worker processes
+    can read and write them without pickling them for every task: a worker
+    attaches to the blocks once (see attach) and every task is a row range.
+
+    Attributes
+    ----------
+    arrays : dict
+        Name -> np.ndarray backed by the shared memory
+
+    Methods
+    -------
+    empty(specs : dict) -> SharedArrays
+        Allocates uninitialised shared arrays
+
+    spec() -> dict
+        What a worker needs to attach to the arrays
+
+    attach(spec : dict) -> tuple
+        Attaches to the arrays of a spec, from another process
+
+    close()
+        Frees the shared memory
+    """
+
+    def __init__(self, arrays : dict) -> None:
+        self.blocks = {}
+        self.arrays = {}
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            self._allocate(name, array.shape, array.dtype)[...] = array
+
+    @classmethod
+    def empty(cls, specs : dict) -> 'SharedArrays':
+        """
+        Allocates uninitialised shared arrays
+
+        Parameters
+        ----------
+        specs : dict
+            Name -> (shape, dtype)
+        """
+        shared = cls({})
+        for name, (shape, dtype) in specs.items():
+            shared._allocate(name, shape, dtype)
+        return shared
+
+    def _allocate(self, name : str, shape : tuple, dtype) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        self.blocks[name] = block
+        self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        return self.arrays[name]
+
+    def spec(self) -> dict:
+        return {name: (self.blocks[name].name, array.shape, array.dtype.str) for name, array in self.arrays.items()}
+
+    @staticmethod
+    def attach(spec : dict) -> tuple:
+        """
+        Attaches to the arrays of a spec, from another process
+
+        Returns
+        -------
+        tuple
+            (name -> np.ndarray, the shared memory blocks, which must be kept open while the arrays are used)
+        """
+        blocks = {name: shared_memory.SharedMemory(name=block) for name, (block, _, _) in spec.items()}
+        arrays = {name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[name].buf)
+                  for name, (_, shape, dtype) in spec.items()}
+        return arrays, blocks
+
+    def close(self) -> None:
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+    def __enter__(self) -> 'SharedArrays':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _slices(arrays : dict, start : int, stop : int) -> dict:
+    return {name: array[start:stop] for name, array in arrays.items()}
+
+
+def _init_worker(task, context, inputs : dict, outputs : dict) -> None:
+    """
+    Attaches the worker process to the shared inputs and outputs once
+    """
+    _worker['task'], _worker['context'] = task, context
+    _worker['inputs'], _worker['input blocks']   = SharedArrays.attach(inputs)
+    _worker['outputs'], _worker['output blocks'] = SharedArrays.attach(outputs)
+
+
+def _run_shard(rows : tuple) -> None:
+    start, stop = rows
+    _worker['task'](_worker['context'], _slices(_worker['inputs'], start, stop),
+                    _slices(_worker['outputs'], start, stop))
+
+
+def map_shards(task, inputs : dict, outputs : dict, context=None, backend : str = 'serial',
+               workers : int = None, shard_size : int = SHARD_SIZE) -> dict:
+    """
+    Runs task on consecutive row ranges of the inputs, each writing its
+    rows of the outputs, such that the results are merged in order. With
+    the process backend, the inputs and outputs are in shared memory and
+    the context is passed once per worker, so a task only sends its rows.
+
+    Parameters
+    ----------
+    task : callable
+        task(context, inputs, outputs), where inputs and outputs are the
+        dicts of arrays restricted to the task's rows. For the process
+        backend, it must be a module level function.
+    inputs : dict
+        Name -> array, all with the same number of rows
+    outputs : dict
+        Name -> (shape, dtype) of the arrays the tasks fill in
+    context
+        Whatever the task needs besides the rows, e.g. a scorer
+    backend : str
+        One of BACKENDS
+    workers : int
+        The number of threads / processes (default: all cores)
+    shard_size : int
+        The number of rows per task
+
+    Returns
+    -------
+    dict
+        Name -> the filled in output array
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+    n_rows = len(next(iter(inputs.values())))
+    ranges = shards(n_rows, shard_size)
+    workers = min(workers or os.cpu_count(), max(1, len(ranges)))
+
+    if backend == 'serial' or workers == 1:
+        results = {name: np.empty(shape, dtype=dtype) for name, (shape, dtype) in outputs.items()}
+        for start, stop in ranges:
+            task(context, _slices(inputs, start, stop), _slices(results, start, stop))
+        return results
+
+    if backend == 'thread':
+        results = {name: np.empty(shape, dtype=dtype) for name, (shape, dtype) in outputs.items()}
+        with ThreadPoolExecutor(workers) as pool:
+            # list() re-raises the exceptions of the tasks
+            list(pool.map(lambda rows: task(context, _slices(inputs, *rows), _slices(results, *rows)), ranges))
+        return results
+
+    with SharedArrays(inputs) as shared_inputs, SharedArrays.empty(outputs) as shared_outputs:
+        with Pool(workers, initializer=_init_worker,
+                  initargs=(task, context, shared_inputs.spec(), shared_outputs.spec())) as pool:
+            for _ in pool.imap_unordered(_run_shard, ranges):
+                pass
+        # copy out of the shared memory, which is freed on leaving the with block
+        return {name: array.copy() for name, array in shared_outputs.arrays.items()}
+
+
+#
+# --------------------------------- Tasks ---------------------------------
+#
+def _engineer_task(state : FeatureState, inputs : dict, outputs : dict) -> None:
+    features = VectorisedFeatureEngineering(inputs['numbers'], inputs['years']).engineer_features(state)
+    for col, values in outputs.items():
+        values[...] = features[col]
+
+
+def engineer_features(numbers : np.ndarray, years : np.ndarray, state : FeatureState = None,
+                      backend : str = 'serial', workers : int = None, shard_size : int = SHARD_SIZE) -> dict:
+    """
+    VectorisedFeatureEngineering.engineer_features, sharded over the rows
+
+    Parameters
+    ----------
+    numbers : np.ndarray
+        (n, 7) array of tickets with columns N1 -> N5, L1, L2
+    years : np.ndarray
+        The year of each ticket, or a single year for all of them
+    state : FeatureState
+        The frozen sum means and bins. If None, they are fitted to all the
+        tickets first, so the features are those of the whole array
+        (without any tickets, the features are empty).
+    backend, workers, shard_size
+        See map_shards
+
+    Returns
+    -------
+    dict
+        Column name -> np.ndarray
+    """
+    numbers = np.asarray(numbers, dtype=np.int64)
+    years   = np.broadcast_to(np.asarray(years, dtype=np.int64), (len(numbers),))
+    if state is None and len(numbers):
+        state = FeatureState.fit(numbers[:, :len(N_COLS)].sum(axis=1), numbers[:, len(N_COLS):].sum(axis=1))
+
+    # the columns and dtypes of the features, from the first ticket
+    probe = VectorisedFeatureEngineering(numbers[:1], years[:1]).engineer_features(state)
+    outputs = {col: ((len(numbers),), values.dtype) for col, values in probe.items()}
+    return map_shards(_engineer_task, {'numbers': numbers, 'years': years}, outputs, context=state,
+                      backend=backend, workers=workers, shard_size=shard_size)
+
+
+def _predict_task(scorer, inputs : dict, outputs : dict) -> None:
+    outputs['proba'][...] = scorer.predict_proba(inputs['numbers'], inputs['years'])
+
+
+def predict_proba(scorer, numbers : np.ndarray, years : np.ndarray, backend : str = 'serial',
+                  workers : int = None, shard_size : int = SHARD_SIZE) -> np.ndarray:
+    """
+    scorer.predict_proba, sharded over the rows. Each worker process has
+    its own copy of the scorer (and of its prediction cache)
+
+    Parameters
+    ----------
+    scorer : TicketScorer or CompactScorer
+        Anything with predict_proba(numbers, years)
+    numbers : np.ndarray
+        (n, 7) array of (valid, sorted) tickets with columns N1 -> N5, L1, L2
+    years : np.ndarray
+        The year of each ticket, or a single year for all of them
+    backend, workers, shard_size
+        See map_shards
+
+    Returns
+    -------
+    np.ndarray
+        (n, 2) array of probabilities
+    """
+    numbers = np.asarray(numbers, dtype=np.int64)
+    years   = np.broadcast_to(np.asarray(years, dtype=np.int64), (len(numbers),))
+    outputs = {'proba': ((len(numbers), 2), np.float64)}
+    return map_shards(_predict_task, {'numbers': numbers, 'years': years}, outputs, context=scorer,
+                      backend=backend, workers=workers, shard_size=shard_size)['proba']
@@ -0,0 +1,215 @@
+import numpy as np
+from src.vecEng import N_COLS, L_COLS, TICKET_COLS
+from src.tickets import N_MAX, L_MAX, STAR_SHIFT, decode, popcount
+from src.simulate import sample_masks
+from src.profiling import stage
+
+# good: the classifier's P(GOOD) of every line
+# ev: the expected payout of every line under a crowding model (see line_ev)
+OBJECTIVES = ('good', 'ev')
+# the default number of lines of a portfolio
+LINES = 100
+# random tickets scored per search; the best POOL_FACTOR * lines of them are kept
+CANDIDATES = 2**20
+POOL_FACTOR = 50
+# tickets scored at once, bounding the memory of the scoring
+SCORE_BATCH = 2**17
+# the penalty of a pair of lines sharing all of their numbers, in units of the objective;
+# a pair sharing k of the 7 numbers costs OVERLAP_PENALTY * (k / 7)**2
+OVERLAP_PENALTY = 1.0
+
+_main_bits = np.arange(N_MAX, dtype=np.uint64)
+_star_bits = np.arange(STAR_SHIFT, STAR_SHIFT + L_MAX, dtype=np.uint64)
+
+
+def sample_tickets(rng : np.random.Generator, n : int) -> np.ndarray:
+    """
+    n uniformly random tickets, as masks (see src/tickets.py)
+    """
+    return sample_masks(rng, _main_bits, len(N_COLS), n) | sample_masks(rng, _star_bits, len(L_COLS), n)
+
+
+def line_ev(masks : np.ndarray, year : int, crowding, sales : float = None) -> np.ndarray:
+    """
+    The expected payout of every line, as the 'avg win' of score_numbers:
+    the sum over the winning groups of Pr[N, L] * win_frac * sales / (W + 1),
+    averaged over the other winners W. With W Poisson distributed around
+    its mean m, E[1 / (W + 1)] = (1 - exp(-m)) / m. Unlike simulate, the
+    crowding of every group is that of the line itself, i.e. of the draw
+    which it wins the jackpot of, so this is a fast approximation which
+    ranks the lines by how popular their numbers are.
+
+    Parameters
+    ----------
+    masks : np.ndarray
+        uint64 array of lines
+    year : int
+        The year the lines are played in
+    crowding : CrowdingModel
+        The model of the other players (see src/simulate.py)
+    sales : float
+        The sales of the draw (default: the median sales of the past draws)
+
+    Returns
+    -------
+    np.ndarray
+        The expected payout of every line, in units of the prize fund per unit of sales
+    """
+    sales = float(np.median(crowding.sales)) if sales is None else float(sales)
+    # the covariates once for all groups (see CrowdingModel.expected_winners)
+    x  = crowding.covariates(masks, year)
+    ev = np.zeros(len(masks))
+    for group in range(len(crowding.tags)):
+        m = sales * crowding.probability[group] * np.exp(crowding.intercept[group] + x @ crowding.coef[group])
+        share = np.where(m > 1e-12, -np.expm1(-m) / np.maximum(m, 1e-12), 1.)
+        ev += crowding.probability[group] * crowding.win_frac[group] * sales * share
+    return ev
+
+
+def line_scores(masks : np.ndarray, year : int, objective : str = 'good', scorer=None,
+                crowding=None, sales : float = None) -> np.ndarray:
+    """
+    The objective of every line
+
+    Parameters
+    ----------
+    masks : np.ndarray
+        uint64 array of lines
+    year : int
+        The year the lines are played in
+    objective : str
+        One of OBJECTIVES
+    scorer : CompactScorer or TicketScorer
+        The classifier (objective 'good')
+    crowding : CrowdingModel
+        The model of the other players (objective 'ev')
+    sales : float
+        The sales of the draw (objective 'ev')
+
+    Returns
+    -------
+    np.ndarray
+        The score of every line; higher is better
+    """
+    if objective == 'good':
+        return scorer.predict_proba(decode(masks), year)[:, 1]
+    if objective == 'ev':
+        return line_ev(masks, year, crowding, sales)
+    raise ValueError(f"Unknown objective {objective!r}, expected one of {OBJECTIVES}")
+
+
+def greedy_portfolio(masks : np.ndarray, scores : np.ndarray, lines : int,
+                     penalty : float = OVERLAP_PENALTY) -> np.ndarray:
+    """
+    Picks lines one by one, each time the one which adds the most to
+
+        sum of the scores - penalty * sum over pairs of (shared numbers / 7)**2
+
+    where the shared numbers of a pair are the popcount of the AND of
+    their masks. The penalty of every candidate against the lines picked
+    so far is kept up to date with one popcount per candidate and line.
+
+    Parameters
+    ----------
+    masks : np.ndarray
+        uint64 array of candidate lines, without duplicates
+    scores : np.ndarray
+        The score of every candidate
+    lines : int
+        The number of lines to pick
+    penalty : float
+        The penalty of a pair sharing all of its numbers
+
+    Returns
+    -------
+    np.ndarray
+        The indices of the picked candidates, in the order they were picked
+    """
+    if lines > len(masks):
+        raise ValueError(f"Cannot pick {lines} lines out of {len(masks)} candidates")
+    overlap = np.zeros(len(masks))
+    gain    = np.asarray(scores, dtype=np.float64).copy()
+    picked  = np.empty(lines, dtype=np.int64)
+    for i in range(lines):
+        best = np.argmax(gain - penalty * overlap)
+        picked[i] = best
+        gain[best] = -np.inf
+        overlap += (popcount(masks & masks[best]) / len(TICKET_COLS))**2
+    return picked
+
+
+def optimise_portfolio(lines : int = LINES, objective : str = 'good', scorer=None, crowding=None,
+                       year : int = 2023, candidates : int = CANDIDATES, pool : int = None,
+                       penalty : float = OVERLAP_PENALTY, seed : int = None, sales : float = None) -> dict:
+    """
+    Searches for a portfolio of lines with a high total score and little
+    overlap between the lines: random candidates are scored in batches,
+    only the best pool of them are kept (pruning) and the lines are picked
+    from the pool greedily (see greedy_portfolio).
+
+    Parameters
+    ----------
+    lines : int
+        The number of lines to buy
+    objective : str
+        One of OBJECTIVES
+    scorer : CompactScorer or TicketScorer
+        The classifier (objective 'good')
+    crowding : CrowdingModel
+        The model of the other players (objective 'ev')
+    year : int
+        The year the lines are played in
+    candidates : int
+        The number of random tickets to score
+    pool : int
+        The number of best candidates to pick from (default: POOL_FACTOR * lines)
+    penalty : float
+        The penalty of a pair of lines sharing all of their numbers
+    seed : int
+        The seed. If None, a fresh one is drawn from the OS
+    sales : float
+        The sales of the draw (objective 'ev')
+
+    Returns
+    -------
+    dict
+        'numbers': (lines, 7) array of the lines with columns N1 -> N5, L1, L2,
+        'score': their scores, 'shared': the most numbers each line shares
+        with another line, 'objective': the total score minus the overlap
+        penalty, 'seed': the entropy to reproduce the result with
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective {objective!r}, expected one of {OBJECTIVES}")
+    if lines < 1:
+        raise ValueError(f"Cannot buy {lines} lines, expected at least 1")
+    pool = pool or POOL_FACTOR * lines
+    if pool < lines:
+        raise ValueError(f"Cannot pick {lines} lines out of a pool of {pool}")
+    root = np.random.SeedSequence(seed)
+    rng  = np.random.default_rng(root)
+
+    masks, scores = np.zeros(0, dtype=np.uint64), np.zeros(0)
+    with stage('score candidates', candidates):
+        for start in range(0, candidates, SCORE_BATCH):
+            batch  = sample_tickets(rng, min(SCORE_BATCH, candidates - start))
+            masks  = np.concatenate([masks, batch])
+            scores = np.concatenate([scores, line_scores(batch, year, objective, scorer, crowding, sales)])
+            masks, first = np.unique(masks, return_index=True)
+            scores = scores[first]
+            # prune to the best pool so far
+            if len(masks) > pool:
+                keep = np.argpartition(-scores, pool - 1)[:pool]
+                masks, scores = masks[keep], scores[keep]
+    # best first, ties in the order of the masks
+    order = np.lexsort((masks, -scores))
+    masks, scores = masks[order], scores[order]
+
+    with stage('pick lines', lines):
+        picked = greedy_portfolio(masks, scores, lines, penalty)
+    masks, scores = masks[picked], scores[picked]
+
+    shared = popcount(masks[:, None] & masks[None, :])
+    np.fill_diagonal(shared, 0)
+    pairs = np.triu((shared / len(TICKET_COLS))**2, k=1).sum()
+    return {'numbers': decode(masks), 'score': scores, 'shared': shared.max(axis=1),
+            'objective': scores.sum() - penalty * pairs, 'seed': root.entropy}
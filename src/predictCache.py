@@ -0,0 +1,171 @@
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+
+class CachedPredictor:
+    """
+    Memoizes the predictions of a model by feature signature.
+
+    The model features (see saved-models/model-lables.sav) are small
+    counts, booleans and bins, such that millions of tickets share only
+    a few thousand distinct feature vectors. Every batch is reduced to
+    its distinct signatures, which are looked up in a bounded LRU cache;
+    only the unseen signatures are passed to the model's predict_proba.
+    Since the model predicts every row independently, the cached
+    predictions are identical to calling the model on every row.
+
+    Attributes
+    ----------
+    model : sklearn estimator
+        The model whose predict_proba is cached
+
+    model_features : list
+        The names of the model features, in the order the model expects
+
+    max_size : int
+        The maximum number of cached signatures, None for no limit
+
+    rows : int
+        The number of rows predicted so far
+
+    hits : int
+        The number of distinct signatures per batch found in the cache
+
+    misses : int
+        The number of distinct signatures per batch passed to the model
+
+    Methods
+    -------
+    predict_proba(X : pd.DataFrame) -> np.ndarray
+        Predicts the class probabilities of X, going to the model only for unseen signatures
+
+    precompute(X : pd.DataFrame)
+        Fills the cache with the signatures of X, e.g. with a table of all reachable signatures
+
+    hit_rate() -> float
+        The fraction of rows that did not need to be passed to the model
+
+    stats() -> dict
+        The cache statistics
+    """
+
+    def __init__(self, model, model_features : list, max_size : int = 100000) -> None:
+        self.model          = model
+        self.model_features = list(model_features)
+        self.max_size       = max_size
+
+        self.cache  = OrderedDict()
+        self.rows   = 0
+        self.hits   = 0
+        self.misses = 0
+        # the cache is shared by the threads of the thread backend (src/parallel.py)
+        self.lock   = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state : dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def signatures(self, X : pd.DataFrame) -> tuple:
+        """
+        Reduces X to its distinct feature signatures
+
+        Parameters
+        ----------
+        X : pd.DataFrame
+            The model features
+
+        Returns
+        -------
+        tuple
+            The (m, k) array of distinct signatures and, for every
+            row of X, the index of its signature
+        """
+        values = X[self.model_features].to_numpy(dtype=np.int64)
+        if values.size and values.min() >= 0 and values.max() < 256 and values.shape[1] <= 8:
+            # pack each row into a single integer, which is much faster to make unique than rows
+            keys = (values << (8 * np.arange(values.shape[1]))).sum(axis=1)
+            _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            return values[first], inverse
+        return np.unique(values, axis=0, return_inverse=True)
+
+    def predict_proba(self, X : pd.DataFrame) -> np.ndarray:
+        """
+        Predicts the class probabilities of X, going
+        to the model only for unseen signatures
+
+        Parameters
+        ----------
+        X : pd.DataFrame
+            The model features
+
+        Returns
+        -------
+        np.ndarray
+            The class probabilities of every row of X
+        """
+        unique, inverse = self.signatures(X)
+        keys = [tuple(row) for row in unique.tolist()]
+
+        # the lock is only held to read and update the cache, not while the model
+        # predicts, such that threads with cache misses do not wait on each other
+        result = np.empty((len(keys), len(self.model.classes_)))
+        unseen = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.cache:
+                    result[i] = self.cache[key]
+                    self.cache.move_to_end(key)
+                else:
+                    unseen.append(i)
+
+        if unseen:
+            result[unseen] = self.model.predict_proba(pd.DataFrame(unique[unseen], columns=self.model_features))
+
+        with self.lock:
+            for i in unseen:
+                self.cache[keys[i]] = result[i]
+            while self.max_size is not None and len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+            self.rows   += len(X)
+            self.misses += len(unseen)
+            self.hits   += len(keys) - len(unseen)
+
+        return result[inverse.ravel()]
+
+    def precompute(self, X : pd.DataFrame) -> None:
+        """
+        Fills the cache with the signatures of X, e.g. with a table
+        of all reachable signatures, such that later predictions never
+        need the model. These do not count towards the statistics.
+
+        Parameters
+        ----------
+        X : pd.DataFrame
+            The model features to cache
+        """
+        rows, hits, misses = self.rows, self.hits, self.misses
+        self.predict_proba(X)
+        self.rows, self.hits, self.misses = rows, hits, misses
+
+    def hit_rate(self) -> float:
+        """
+        The fraction of rows that did not need
+        to be passed to the model
+        """
+        # every miss is one row passed to the model
+        return 1 - self.misses / self.rows if self.rows else 0.
+
+    def stats(self) -> dict:
+        """
+        The cache statistics
+        """
+        return {'rows': self.rows, 'hits': self.hits, 'misses': self.misses,
+                'hit rate': self.hit_rate(), 'cached signatures': len(self.cache)}
@@ -0,0 +1,280 @@
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+import contextlib
+import tracemalloc
+
+# set to one of MODES to profile any run of quick-start.py, e.g. in production
+PROFILE_ENV = 'EUROMILLIONS_PROFILE'
+# where the report or the profile is written to (default: stderr / DUMP_FILES)
+PROFILE_OUTPUT_ENV = 'EUROMILLIONS_PROFILE_OUTPUT'
+# json, prometheus: time the instrumented stages and report them as JSON or Prometheus text
+# cprofile, pyinstrument: profile the whole run with cProfile or pyinstrument (if installed)
+MODES = ('json', 'prometheus', 'cprofile', 'pyinstrument')
+DUMP_FILES = {'cprofile': 'euromillions.prof', 'pyinstrument': 'euromillions-profile.html'}
+
+
+class StageTimer:
+    """
+    Records the wall time, the rows and the peak memory of named stages.
+    It is off until start() is called; until then, stage and instrument
+    cost next to nothing. A stage inside another stage is recorded under
+    the path 'outer/inner', and the stages of the same path are summed up.
+
+    The peak memory of a stage is the largest amount of memory traced by
+    tracemalloc (which NumPy and pandas report to) above the memory at
+    the start of the stage. tracemalloc slows down the allocations, so
+    only compare the timings of profiled runs with each other. The
+    memory is traced per process, so the peaks of stages which run at
+    the same time in different threads include each other.
+
+    Attributes
+    ----------
+    enabled : bool
+        Whether stages are recorded
+
+    memory : bool
+        Whether the peak memory is traced
+
+    records : dict
+        Stage path -> {'calls', 'seconds', 'max seconds', 'rows', 'peak memory bytes'}
+
+    Methods
+    -------
+    start(memory : bool = True)
+        Starts recording
+
+    stage(name : str, rows : int = None)
+        Context manager recording a stage; rows can be set on the yielded dict
+
+    report() -> dict
+        The recorded stages
+
+    to_prometheus() -> str
+        The recorded stages in the Prometheus text format
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.memory  = False
+        self.records = {}
+        self.started = None
+        self.lock    = threading.Lock()
+        self.local   = threading.local()
+
+    def start(self, memory : bool = True) -> None:
+        self.enabled = True
+        self.memory  = memory
+        self.started = time.perf_counter()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _stack(self) -> list:
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextlib.contextmanager
+    def stage(self, name : str, rows : int = None):
+        """
+        Records the stage run inside the with block
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage
+        rows : int
+            The number of rows the stage processes, if known in advance.
+            Otherwise, set frame['rows'] of the yielded frame.
+        """
+        if not self.enabled:
+            yield {}
+            return
+
+        stack = self._stack()
+        frame = {'path': '/'.join([f['name'] for f in stack] + [name]), 'name': name, 'rows': rows,
+                 'child peak': 0, 'start memory': 0}
+        with self.lock:
+            # keep the stages in the order they are entered, outer stages first
+            self.records.setdefault(frame['path'], {'calls': 0, 'seconds': 0., 'max seconds': 0.,
+                                                    'rows': None, 'peak memory bytes': None})
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                # resetting the peak would lose the outer stage's peak so far
+                stack[-1]['child peak'] = max(stack[-1]['child peak'], peak)
+            tracemalloc.reset_peak()
+            frame['start memory'] = current
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield frame
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            peak = None
+            if self.memory:
+                peak = max(tracemalloc.get_traced_memory()[1], frame['child peak'])
+                if stack:
+                    stack[-1]['child peak'] = max(stack[-1]['child peak'], peak)
+                peak -= frame['start memory']
+            self._record(frame['path'], seconds, frame['rows'], peak)
+
+    def _record(self, path : str, seconds : float, rows : int, peak : int) -> None:
+        with self.lock:
+            record = self.records[path]
+            record['calls']      += 1
+            record['seconds']    += seconds
+            record['max seconds'] = max(record['max seconds'], seconds)
+            if rows is not None:
+                record['rows'] = (record['rows'] or 0) + int(rows)
+            if peak is not None:
+                record['peak memory bytes'] = max(record['peak memory bytes'] or 0, int(peak))
+
+    def report(self) -> dict:
+        """
+        The recorded stages
+
+        Returns
+        -------
+        dict
+            {'total seconds': since start(), 'stages': [{'stage': path, **record}, ...]},
+            the stages in the order they were first entered
+        """
+        with self.lock:
+            stages = [dict(stage=path, **record) for path, record in self.records.items()]
+        total = time.perf_counter() - self.started if self.started is not None else 0.
+        return {'total seconds': total, 'stages': stages}
+
+    def to_prometheus(self) -> str:
+        """
+        The recorded stages in the Prometheus text exposition format
+        """
+        metrics = [('seconds', 'euromillions_stage_seconds_total', 'counter', "Wall time spent in the stage"),
+                   ('calls', 'euromillions_stage_calls_total', 'counter', "Times the stage was run"),
+                   ('rows', 'euromillions_stage_rows_total', 'counter', "Rows processed by the stage"),
+                   ('peak memory bytes', 'euromillions_stage_peak_memory_bytes', 'gauge',
+                    "Peak traced memory of the stage above its start")]
+        stages = self.report()['stages']
+        lines = []
+        for key, metric, kind, description in metrics:
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}"]
+            for stage in stages:
+                if stage[key] is not None:
+                    label = stage['stage'].replace('\\', '\\\\').replace('"', '\\"')
+                    lines.append(f'{metric}{{stage="{label}"}} {stage[key]}')
+        return "\n".join(lines) + "\n"
+
+
+# the timer of this process, shared by all instrumented code
+TIMER = StageTimer()
+
+
+def stage(name : str, rows : int = None):
+    """
+    Records a stage with the process' timer (see StageTimer.stage)
+    """
+    return TIMER.stage(name, rows)
+
+
+def instrument(name : str = None, rows : int = None):
+    """
+    Records every call of the decorated function as a stage. The rows are
+    the length of the returned array / DataFrame, unless given.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage (default: the qualified name of the function)
+    rows : int
+        The rows processed per call (default: the length of the result)
+    """
+    def decorate(function):
+        stage_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TIMER.enabled:
+                return function(*args, **kwargs)
+            with TIMER.stage(stage_name, rows) as frame:
+                result = function(*args, **kwargs)
+                if rows is None and getattr(result, 'shape', ()):
+                    frame['rows'] = result.shape[0]
+            return result
+        return wrapper
+    return decorate
+
+
+def _write(text : str, output : str) -> None:
+    if output is None or output == '-':
+        sys.stderr.write(text)
+    else:
+        with open(output, 'w') as f:
+            f.write(text)
+
+
+def _write_report(mode : str, output : str) -> None:
+    if mode == 'json':
+        _write(json.dumps(TIMER.report(), indent=1) + "\n", output)
+    else:
+        _write(TIMER.to_prometheus(), output)
+
+
+def _dump_cprofile(profiler, output : str) -> None:
+    profiler.disable()
+    profiler.dump_stats(output)
+    print(f"wrote the cProfile profile to {output} (view it with python -m pstats {output})", file=sys.stderr)
+
+
+def _dump_pyinstrument(profiler, output : str) -> None:
+    profiler.stop()
+    with open(output, 'w') as f:
+        f.write(profiler.output_html())
+    print(f"wrote the pyinstrument profile to {output}", file=sys.stderr)
+
+
+def configure(mode : str = None, output : str = None) -> None:
+    """
+    Starts profiling the rest of the run and writes the result when
+    the process exits. Without arguments, the mode and the output are
+    read from the PROFILE_ENV and PROFILE_OUTPUT_ENV environment variables;
+    without a mode, nothing is profiled.
+
+    Parameters
+    ----------
+    mode : str
+        One of MODES, or None
+    output : str
+        The file to write to; the stage reports default to stderr,
+        the profiles to DUMP_FILES
+    """
+    mode   = mode or os.environ.get(PROFILE_ENV) or None
+    output = output or os.environ.get(PROFILE_OUTPUT_ENV) or None
+    if mode is None:
+        return
+    if mode not in MODES:
+        raise ValueError(f"Unknown profile mode {mode!r}, expected one of {MODES}")
+
+    if mode in ('json', 'prometheus'):
+        TIMER.start()
+        atexit.register(_write_report, mode, output)
+    elif mode == 'cprofile':
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        atexit.register(_dump_cprofile, profiler, output or DUMP_FILES[mode])
+    else:
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("The pyinstrument mode needs 'pip install pyinstrument'; "
+                              "the cprofile mode only needs the standard library") from None
+
+        profiler = Profiler()
+        profiler.start()
+        atexit.register(_dump_pyinstrument, profiler, output or DUMP_FILES[mode])
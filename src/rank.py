@@ -0,0 +1,308 @@
+import os
+import sys
+import json
+import heapq
+import itertools
+import numpy as np
+import pandas as pd
+from math import comb
+from datetime import datetime
+from multiprocessing import Pool
+from src.vecEng import TICKET_COLS
+from src.scoring import MODEL_DIR, TicketScorer
+
+# every pair of lucky numbers; each combination of 5 numbers is ranked with all of them
+STAR_PAIRS = np.array(list(itertools.combinations(range(1, 13), 2)), dtype=np.int64)
+N_MAIN_COMBINATIONS = comb(50, 5)
+N_TICKETS = N_MAIN_COMBINATIONS * len(STAR_PAIRS)
+
+# the scorer of each worker process, loaded once by _init_worker
+_scorer = None
+
+
+def unrank_combination(index : int, n : int = 50, k : int = 5) -> list:
+    """
+    The combination of k numbers of 1 -> n at position index of
+    itertools.combinations (lexicographic order), computed directly
+    with the combinatorial number system instead of iterating to it
+
+    Parameters
+    ----------
+    index : int
+        The position of the combination, 0 <= index < comb(n, k)
+    n : int
+        The largest number
+    k : int
+        The numbers per combination
+
+    Returns
+    -------
+    list
+        The k numbers of the combination, in increasing order
+    """
+    combination, x = [], 1
+    for left in range(k, 0, -1):
+        # skip the comb(n - x, left - 1) combinations which continue with x
+        while comb(n - x, left - 1) <= index:
+            index -= comb(n - x, left - 1)
+            x += 1
+        combination.append(x)
+        x += 1
+    return combination
+
+
+def main_combinations(start : int, count : int) -> np.ndarray:
+    """
+    The count combinations of 5 numbers from combination start on, in
+    lexicographic order. The combinations after the first one are those
+    which keep its first i numbers and continue with larger ones, for
+    i = 4 -> 0, so each is a slice of itertools.combinations from its start.
+
+    Parameters
+    ----------
+    start : int
+        The position of the first combination
+    count : int
+        The number of combinations
+
+    Returns
+    -------
+    np.ndarray
+        (count, 5) array of combinations
+    """
+    count = min(count, N_MAIN_COMBINATIONS - start)
+    if count <= 0:
+        return np.empty((0, 5), dtype=np.int64)
+    first = unrank_combination(start)
+    blocks = []
+    for i in range(4, -1, -1):
+        low  = first[i] if i == 4 else first[i] + 1
+        rest = itertools.islice(itertools.combinations(range(low, 51), 5 - i), count)
+        rest = np.fromiter(itertools.chain.from_iterable(rest), dtype=np.int64).reshape(-1, 5 - i)
+        blocks.append(np.hstack([np.tile(np.array(first[:i], dtype=np.int64), (len(rest), 1)), rest]))
+        count -= len(rest)
+        if not count:
+            break
+    return np.vstack(blocks)
+
+
+def chunk_tickets(chunk : int, chunk_size : int) -> np.ndarray:
+    """
+    Generates the tickets of one chunk: the chunk_size combinations
+    of 5 numbers starting at combination chunk*chunk_size (in
+    lexicographic order), each paired with all lucky number pairs.
+    The index of a ticket is main_index * 66 + star_index.
+
+    Parameters
+    ----------
+    chunk : int
+        The chunk number
+    chunk_size : int
+        The number of combinations of 5 numbers per chunk
+
+    Returns
+    -------
+    np.ndarray
+        (n, 7) array of tickets with columns N1 -> N5, L1, L2
+    """
+    mains = main_combinations(chunk * chunk_size, chunk_size)
+
+    return np.hstack([np.repeat(mains, len(STAR_PAIRS), axis=0),
+                      np.tile(STAR_PAIRS, (len(mains), 1))])
+
+
+def _init_worker(model_dir : str) -> None:
+    """
+    Loads the model once per worker process
+    """
+    global _scorer
+    _scorer = TicketScorer(model_dir)
+
+
+def _rank_chunk(task : tuple) -> tuple:
+    """
+    Scores all tickets of a chunk and returns its chunk number, its top
+    and bottom tickets as lists of (prob good, index, numbers) and the
+    prediction cache hit rate of the worker
+    """
+    chunk, chunk_size, year, top_k, bottom_k = task
+    numbers = chunk_tickets(chunk, chunk_size)
+    prob_good = _scorer.predict_proba(numbers, year)[:, 1]
+    offset = chunk * chunk_size * len(STAR_PAIRS)
+
+    def entries(order : np.ndarray) -> list:
+        return [(float(prob_good[i]), offset + int(i), numbers[i].tolist()) for i in order]
+
+    # order by probability, ties broken by the lowest ticket index
+    order = np.lexsort((np.arange(len(prob_good)), -prob_good))
+    top = entries(order[:top_k])
+    order = np.lexsort((np.arange(len(prob_good)), prob_good))
+    bottom = entries(order[:bottom_k])
+
+    return chunk, top, bottom, _scorer.predictor.hit_rate()
+
+
+class TicketRanking:
+    """
+    Ranks all 139,838,160 EuroMillions tickets (5 of 50 numbers
+    and 2 of 12 lucky numbers) with the saved model and keeps the
+    top-K and bottom-K tickets in bounded heaps.
+
+    The tickets are generated in chunks of combinations, scored in
+    parallel worker processes and merged as the chunks finish. After every
+    chunk, a checkpoint is written so that the ranking can be resumed.
+
+    Attributes
+    ----------
+    top_k : int
+        How many of the best tickets to keep
+
+    bottom_k : int
+        How many of the worst tickets to keep
+
+    chunk_size : int
+        The number of combinations of 5 numbers per chunk (x66 tickets)
+
+    year : int
+        The year the tickets are played in
+
+    checkpoint : str
+        The checkpoint file, None to not checkpoint
+
+    done : set
+        The chunks that have been ranked
+
+    Methods
+    -------
+    n_chunks() -> int
+        The number of chunks of all the tickets
+
+    run(model_dir : str, processes : int = None, limit : int = None)
+        Ranks all the (remaining) chunks
+
+    results() -> pd.DataFrame
+        The top and bottom tickets found so far
+    """
+
+    def __init__(self, top_k : int = 100, bottom_k : int = 100, chunk_size : int = 10000,
+                 year : int = None, checkpoint : str = None) -> None:
+        self.top_k      = top_k
+        self.bottom_k   = bottom_k
+        self.chunk_size = chunk_size
+        self.year       = int(datetime.today().year) if year is None else year
+        self.checkpoint = checkpoint
+
+        # min-heaps of (prob good, -index, numbers) for the top tickets and
+        # of (-prob good, -index, numbers) for the bottom tickets, such that
+        # the root is always the entry which is dropped first
+        self.done   = set()
+        self.top    = []
+        self.bottom = []
+
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self.load_checkpoint()
+
+    def config(self) -> dict:
+        """
+        The settings which a checkpoint must agree with
+        """
+        return {'top_k': self.top_k, 'bottom_k': self.bottom_k,
+                'chunk_size': self.chunk_size, 'year': self.year}
+
+    def n_chunks(self) -> int:
+        """
+        The number of chunks of all the tickets
+        """
+        return -(-N_MAIN_COMBINATIONS // self.chunk_size)
+
+    def load_checkpoint(self) -> None:
+        """
+        Resumes from self.checkpoint
+        """
+        with open(self.checkpoint) as f:
+            saved = json.load(f)
+        if saved['config'] != self.config():
+            raise ValueError(f"Checkpoint {self.checkpoint} was written with different settings: {saved['config']}")
+
+        self.done   = set(saved['done'])
+        self.top    = [tuple(entry) for entry in saved['top']]
+        self.bottom = [tuple(entry) for entry in saved['bottom']]
+        heapq.heapify(self.top)
+        heapq.heapify(self.bottom)
+
+    def save_checkpoint(self) -> None:
+        """
+        Atomically writes the state of the ranking to self.checkpoint
+        """
+        saved = {'config': self.config(), 'done': sorted(self.done),
+                 'top': self.top, 'bottom': self.bottom}
+        with open(self.checkpoint + '.tmp', 'w') as f:
+            json.dump(saved, f)
+        os.replace(self.checkpoint + '.tmp', self.checkpoint)
+
+    def merge(self, chunk : int, top : list, bottom : list) -> None:
+        """
+        Merges the top and bottom tickets of a chunk into the heaps
+
+        Parameters
+        ----------
+        chunk : int
+            The chunk number
+        top : list
+            (prob good, index, numbers) of the best tickets of the chunk
+        bottom : list
+            (prob good, index, numbers) of the worst tickets of the chunk
+        """
+        for heap, entries, k, sign in ((self.top, top, self.top_k, 1), (self.bottom, bottom, self.bottom_k, -1)):
+            for prob, index, numbers in entries:
+                entry = (sign * prob, -index, numbers)
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+        self.done.add(chunk)
+
+    def run(self, model_dir : str = MODEL_DIR, processes : int = None, limit : int = None) -> None:
+        """
+        Ranks all the chunks which have not been ranked yet
+
+        Parameters
+        ----------
+        model_dir : str
+            The directory with the saved model
+        processes : int
+            The number of worker processes. Defaults to all cores
+        limit : int
+            Only rank the first limit chunks, e.g. to try things out
+        """
+        chunks = range(self.n_chunks() if limit is None else min(limit, self.n_chunks()))
+        tasks  = [(chunk, self.chunk_size, self.year, self.top_k, self.bottom_k)
+                  for chunk in chunks if chunk not in self.done]
+
+        with Pool(processes or os.cpu_count(), initializer=_init_worker, initargs=(model_dir,)) as pool:
+            for n, (chunk, top, bottom, hit_rate) in enumerate(pool.imap_unordered(_rank_chunk, tasks), 1):
+                self.merge(chunk, top, bottom)
+                if self.checkpoint is not None:
+                    self.save_checkpoint()
+                print(f"ranked chunk {chunk} ({n}/{len(tasks)}, {len(self.done)}/{self.n_chunks()} in total), "
+                      f"prediction cache hit rate {100*hit_rate:.2f}%", file=sys.stderr, flush=True)
+
+    def results(self) -> pd.DataFrame:
+        """
+        The top and bottom tickets found so far
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per ticket with its 'group' (top/bottom), its 'rank'
+            within the group, its numbers, 'ticket index' and 'prob good'
+        """
+        rows = []
+        for prob, index, numbers in sorted(self.top, reverse=True):
+            rows.append(['top', prob, -index] + list(numbers))
+        for prob, index, numbers in sorted(self.bottom, reverse=True):
+            rows.append(['bottom', -prob, -index] + list(numbers))
+
+        df = pd.DataFrame(rows, columns=['group', 'prob good', 'ticket index'] + TICKET_COLS)
+        df.insert(1, 'rank', df.groupby('group').cumcount() + 1)
+        return df
@@ -0,0 +1,313 @@
+import os
+import re
+import sys
+import pickle
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from src.vecEng import N_COLS, L_COLS, TICKET_COLS, FeatureState
+from src.tickets import TicketMasks
+from src.predictCache import CachedPredictor
+from src.compactModel import MODEL_DIR
+from src.dataLoad import read_dataset
+from src.profiling import instrument, stage
+from src.parallel import predict_proba as parallel_predict_proba
+
+
+def read_tickets(source) -> pd.DataFrame:
+    """
+    Reads a batch of tickets. The source can be
+    - a path to a .csv or .parquet file with (at least) the columns N1 -> N5, L1, L2
+      and optionally YYYY,
+    - any other path, '-' (stdin) or an open text stream with one ticket
+      per line: 7 numbers (5 numbers followed by 2 lucky numbers)
+      separated by spaces or commas. Empty lines and lines starting
+      with '#' are skipped.
+
+    Parameters
+    ----------
+    source : str or file-like
+        Where to read the tickets from
+
+    Returns
+    -------
+    pd.DataFrame
+        The tickets with the columns N1 -> N5, L1, L2 (and YYYY if given)
+    """
+    if isinstance(source, str) and source.endswith('.parquet'):
+        return pd.read_parquet(source)
+    if isinstance(source, str) and source.endswith('.csv'):
+        return pd.read_csv(source, skipinitialspace=True)
+
+    if source == '-':
+        stream = sys.stdin
+    elif isinstance(source, str):
+        stream = open(source)
+    else:
+        stream = source
+
+    rows = []
+    for line in stream:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        rows.append([int(i) for i in re.split(r'[\s,]+', line)])
+
+    if stream is not source and stream is not sys.stdin:
+        stream.close()
+
+    if any(len(row) != len(TICKET_COLS) for row in rows):
+        raise ValueError(f"Expected {len(TICKET_COLS)} numbers per ticket")
+    return pd.DataFrame(rows, columns=TICKET_COLS, dtype=np.int64)
+
+
+def write_scores(scores : pd.DataFrame, destination) -> None:
+    """
+    Writes the scored tickets to a .csv or .parquet
+    file, or as CSV to stdout if destination is '-'
+
+    Parameters
+    ----------
+    scores : pd.DataFrame
+        The output of TicketScorer.score
+    destination : str
+        The file to write to
+    """
+    if destination == '-':
+        scores.to_csv(sys.stdout, index=False)
+    elif destination.endswith('.parquet'):
+        scores.to_parquet(destination, index=False)
+    else:
+        scores.to_csv(destination, index=False)
+
+
+def validate_tickets(tickets : pd.DataFrame) -> np.ndarray:
+    """
+    The vectorised equivalent of InputHelper.validate_nums in
+    quick-start.py: a ticket is valid if it has 5 unique numbers
+    between 1 and 50 and 2 unique lucky numbers between 1 and 12
+
+    Parameters
+    ----------
+    tickets : pd.DataFrame
+        The tickets with the columns N1 -> N5, L1, L2
+
+    Returns
+    -------
+    np.ndarray
+        bool array, True for every valid ticket
+    """
+    valid = np.ones(len(tickets), dtype=bool)
+    for cols, nmax in ((N_COLS, 50), (L_COLS, 12)):
+        nums = np.sort(tickets[cols].to_numpy(), axis=1)
+        # test whether numbers are in the correct range
+        valid &= ((nums >= 1) & (nums <= nmax)).all(axis=1)
+        # test number uniqueness
+        valid &= (np.diff(nums, axis=1) != 0).all(axis=1)
+    return valid
+
+
+def prepare_tickets(tickets : pd.DataFrame, year : int = None, drop_invalid : bool = False) -> pd.DataFrame:
+    """
+    Validates the tickets and sorts the numbers and the lucky
+    numbers of each ticket, as InputHelper.get_user_input does.
+    Tickets without a YYYY column are played in the given year.
+
+    Parameters
+    ----------
+    tickets : pd.DataFrame
+        The tickets with the columns N1 -> N5, L1, L2 and optionally YYYY
+    year : int
+        The year the tickets are played in, if not in the tickets. Defaults to today's year
+    drop_invalid : bool
+        Whether to drop invalid tickets instead of raising a ValueError
+
+    Returns
+    -------
+    pd.DataFrame
+        The prepared tickets with the columns YYYY, N1 -> N5, L1, L2
+    """
+    valid = validate_tickets(tickets)
+    if not valid.all():
+        if not drop_invalid:
+            bad = np.flatnonzero(~valid)
+            # the row label, which is the row number of the file also when it is read in chunks
+            raise ValueError(f"{len(bad)} invalid tickets, the first one being row {tickets.index[bad[0]]}: "
+                             f"{tickets[TICKET_COLS].iloc[bad[0]].tolist()}")
+        tickets = tickets[valid]
+
+    prepared = pd.DataFrame(index=tickets.index)
+    if 'YYYY' in tickets.columns:
+        prepared['YYYY'] = tickets['YYYY'].astype(np.int64)
+    else:
+        prepared['YYYY'] = int(datetime.today().year) if year is None else year
+    prepared[N_COLS] = np.sort(tickets[N_COLS].to_numpy(dtype=np.int64), axis=1)
+    prepared[L_COLS] = np.sort(tickets[L_COLS].to_numpy(dtype=np.int64), axis=1)
+
+    return prepared
+
+
+class TicketScorer:
+    """
+    Scores batches of tickets with the trained model.
+    The model, its features and the frozen feature state are loaded once,
+    such that many tickets can be scored without reloading anything.
+
+    Attributes
+    ----------
+    model : sklearn.ensemble.VotingClassifier
+        The soft-voting classifier from euromillions.ipynb
+
+    model_features : list
+        The features the model was trained on
+
+    state : FeatureState
+        The sum means and bins of the dataset the model was trained on
+
+    predictor : CachedPredictor
+        The model's predictions, memoized by feature signature
+
+    Methods
+    -------
+    prepare(tickets : pd.DataFrame, year : int = None) -> pd.DataFrame
+        Validates and normalises the tickets
+
+    features(tickets : pd.DataFrame) -> pd.DataFrame
+        Engineers the model features of the tickets
+
+    model_inputs(numbers : np.ndarray, years : np.ndarray) -> pd.DataFrame
+        Engineers the model features of an array of tickets
+
+    predict_proba(numbers : np.ndarray, years : np.ndarray) -> np.ndarray
+        Predicts the bad/good probabilities of an array of tickets
+
+    score(tickets : pd.DataFrame, year : int = None) -> pd.DataFrame
+        Scores the tickets, giving the probability of each being a bad/good number
+    """
+
+    def __init__(self, model_dir : str = MODEL_DIR, cache_size : int = 100000) -> None:
+        # This model is generated through euromillions.ipynb
+        with stage('unpickle soft-vote-model.sav'):
+            self.model = pickle.load(open(os.path.join(model_dir, 'soft-vote-model.sav'), 'rb'))
+        self.model_features = pickle.load(open(os.path.join(model_dir, 'model-lables.sav'), 'rb'))
+
+        # The binned features are defined w.r.t the whole dataset. These bins are
+        # saved next to the model; older model directories only have the dataset,
+        # of which only the numbers are read
+        state_filename = os.path.join(model_dir, 'feature-state.sav')
+        if os.path.exists(state_filename):
+            self.state = FeatureState.load(state_filename)
+        else:
+            self.state = FeatureState.from_dataframe(read_dataset(model_dir, TICKET_COLS))
+
+        # Tickets share few distinct feature vectors, so the predictions are memoized
+        self.predictor = CachedPredictor(self.model, self.model_features, max_size=cache_size)
+
+    @instrument()
+    def prepare(self, tickets : pd.DataFrame, year : int = None, drop_invalid : bool = False) -> pd.DataFrame:
+        """
+        Validates and normalises the tickets (see prepare_tickets)
+        """
+        return prepare_tickets(tickets, year=year, drop_invalid=drop_invalid)
+
+    def features(self, tickets : pd.DataFrame) -> pd.DataFrame:
+        """
+        Engineers the model features of the (prepared) tickets
+
+        Parameters
+        ----------
+        tickets : pd.DataFrame
+            The tickets with the columns YYYY, N1 -> N5, L1, L2
+
+        Returns
+        -------
+        pd.DataFrame
+            The model features of each ticket
+        """
+        features = self.model_inputs(tickets[TICKET_COLS].to_numpy(), tickets['YYYY'].to_numpy())
+        features.index = tickets.index
+        return features
+
+    @instrument()
+    def model_inputs(self, numbers : np.ndarray, years : np.ndarray) -> pd.DataFrame:
+        """
+        Engineers the model features of an array of
+        (valid, sorted) tickets
+
+        Parameters
+        ----------
+        numbers : np.ndarray
+            (n, 7) array of tickets with columns N1 -> N5, L1, L2
+        years : np.ndarray
+            The year of each ticket, or a single year for all of them
+
+        Returns
+        -------
+        pd.DataFrame
+            The model features of each ticket
+        """
+        # The features are engineered w.r.t. the frozen state of the dataset,
+        # so they do not depend on the other tickets in the batch. The tickets
+        # are sorted, so their bitmasks give the same features as their numbers
+        features = TicketMasks.from_numbers(numbers, years).engineer_features(self.state)
+
+        return pd.DataFrame({col: features[col] for col in self.model_features})
+
+    @instrument()
+    def predict_proba(self, numbers : np.ndarray, years : np.ndarray) -> np.ndarray:
+        """
+        Predicts the probability of an array of (valid, sorted)
+        tickets to be a bad (column 0) or good (column 1) number
+
+        Parameters
+        ----------
+        numbers : np.ndarray
+            (n, 7) array of tickets with columns N1 -> N5, L1, L2
+        years : np.ndarray
+            The year of each ticket, or a single year for all of them
+
+        Returns
+        -------
+        np.ndarray
+            (n, 2) array of probabilities
+        """
+        return self.predictor.predict_proba(self.model_inputs(numbers, years))
+
+    @instrument()
+    def score(self, tickets : pd.DataFrame, year : int = None, drop_invalid : bool = False,
+              backend : str = 'serial', workers : int = None) -> pd.DataFrame:
+        """
+        Scores the tickets in one go
+
+        Parameters
+        ----------
+        tickets : pd.DataFrame
+            The tickets with the columns N1 -> N5, L1, L2 and optionally YYYY
+        year : int
+            The year the tickets are played in, if not in the tickets. Defaults to today's year
+        drop_invalid : bool
+            Whether to drop invalid tickets instead of raising a ValueError
+        backend : str
+            'serial', or shard the tickets over a 'thread' or 'process' pool (see src/parallel.py)
+        workers : int
+            The number of threads / processes (default: all cores)
+
+        Returns
+        -------
+        pd.DataFrame
+            The tickets with the probabilities of being a
+            'prob bad' or 'prob good' number and the model's 'verdict'
+        """
+        tickets = self.prepare(tickets, year=year, drop_invalid=drop_invalid)
+        if backend == 'serial':
+            result = self.predict_proba(tickets[TICKET_COLS].to_numpy(), tickets['YYYY'].to_numpy())
+        else:
+            result = parallel_predict_proba(self, tickets[TICKET_COLS].to_numpy(), tickets['YYYY'].to_numpy(),
+                                            backend=backend, workers=workers)
+
+        scores = tickets.copy()
+        scores['prob bad']  = result[:, 0]
+        scores['prob good'] = result[:, 1]
+        scores['verdict']   = np.where(result.argmax(axis=1) == 1, 'GOOD', 'BAD')
+
+        return scores
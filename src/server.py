@@ -0,0 +1,375 @@
+import os
+import json
+import stat
+import time
+import queue
+import socketserver
+import threading
+import numpy as np
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.vecEng import N_COLS, L_COLS, TICKET_COLS
+
+
+def validate_ticket(numbers : list) -> str:
+    """
+    The rules of InputHelper.validate_nums in quick-start.py, applied to
+    a single ticket: 5 unique numbers between 1 and 50 followed by 2 unique
+    lucky numbers between 1 and 12. Instead of exiting, the error is returned.
+
+    Parameters
+    ----------
+    numbers : list
+        The 7 numbers of the ticket, N1 -> N5, L1, L2
+
+    Returns
+    -------
+    str
+        The error message, None if the ticket is valid
+    """
+    if not isinstance(numbers, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in numbers):
+        return f"Expected a list of {len(TICKET_COLS)} integers"
+    if len(numbers) != len(TICKET_COLS):
+        return f"Expected to receive {len(TICKET_COLS)} numbers; {len(numbers)} were received"
+    for nums, nnums, nmax in ((numbers[:len(N_COLS)], len(N_COLS), 50), (numbers[len(N_COLS):], len(L_COLS), 12)):
+        if len(set(nums)) != nnums:
+            return "Inputs must be unique"
+        if any(i < 1 or i > nmax for i in nums):
+            return f"Inputs must be between 1 and {nmax}"
+    return None
+
+
+class LatencyStats:
+    """
+    Thread-safe latency and throughput counters of the server.
+    The percentiles are computed over a window of the latest requests.
+
+    Attributes
+    ----------
+    window : int
+        How many of the latest request latencies are kept
+
+    requests : int
+        The number of answered scoring requests
+
+    tickets : int
+        The number of scored tickets
+
+    batches : int
+        The number of batches passed to the model
+
+    errors : int
+        The number of rejected requests
+
+    Methods
+    -------
+    record_request(latency : float, tickets : int)
+        Records an answered scoring request
+
+    record_batch(tickets : int)
+        Records a batch passed to the model
+
+    record_error()
+        Records a rejected request
+
+    snapshot() -> dict
+        The current counters, latency percentiles (in ms) and throughput
+    """
+
+    def __init__(self, window : int = 10000) -> None:
+        self.window    = window
+        self.latencies = deque(maxlen=window)
+        self.lock      = threading.Lock()
+        self.started   = time.perf_counter()
+
+        self.requests = 0
+        self.tickets  = 0
+        self.batches  = 0
+        self.batched  = 0
+        self.errors   = 0
+
+    def record_request(self, latency : float, tickets : int) -> None:
+        with self.lock:
+            self.latencies.append(latency)
+            self.requests += 1
+            self.tickets  += tickets
+
+    def record_batch(self, tickets : int) -> None:
+        with self.lock:
+            self.batches += 1
+            self.batched += tickets
+
+    def record_error(self) -> None:
+        with self.lock:
+            self.errors += 1
+
+    def snapshot(self) -> dict:
+        """
+        The current counters, latency percentiles (in ms) and throughput
+        """
+        with self.lock:
+            latencies = np.array(self.latencies) * 1e3
+            uptime = time.perf_counter() - self.started
+            p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) else (0., 0.)
+            return {'uptime s': uptime, 'requests': self.requests, 'tickets': self.tickets,
+                    'errors': self.errors, 'batches': self.batches,
+                    'mean batch size': self.batched / self.batches if self.batches else 0.,
+                    'latency p50 ms': float(p50), 'latency p99 ms': float(p99),
+                    'requests per s': self.requests / uptime, 'tickets per s': self.tickets / uptime}
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent scoring requests into micro-batches. A single
+    worker thread takes the first waiting request, then keeps collecting
+    requests until max_batch_size tickets are gathered or max_wait seconds
+    have passed, and scores all of them with one call to predict_proba.
+
+    Attributes
+    ----------
+    predict_proba : callable
+        predict_proba(numbers, years) of e.g. a TicketScorer
+
+    max_batch_size : int
+        The maximum number of tickets per batch
+
+    max_wait : float
+        The maximum time [s] to wait for more requests after the first one
+
+    stats : LatencyStats
+        Where the batches are recorded
+
+    Methods
+    -------
+    submit(numbers : np.ndarray, years : np.ndarray) -> Future
+        Queues (valid, sorted) tickets, the future resolves to their probabilities
+
+    close()
+        Stops the worker thread
+    """
+
+    def __init__(self, predict_proba, max_batch_size : int = 256, max_wait : float = 0.005,
+                 stats : LatencyStats = None) -> None:
+        self.predict_proba  = predict_proba
+        self.max_batch_size = max_batch_size
+        self.max_wait       = max_wait
+        self.stats          = stats if stats is not None else LatencyStats()
+
+        self.pending = queue.Queue()
+        self.worker  = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self.worker.start()
+
+    def submit(self, numbers : np.ndarray, years : np.ndarray) -> Future:
+        """
+        Queues (valid, sorted) tickets
+
+        Parameters
+        ----------
+        numbers : np.ndarray
+            (n, 7) array of tickets with columns N1 -> N5, L1, L2
+        years : np.ndarray
+            The year of each ticket
+
+        Returns
+        -------
+        Future
+            Resolves to the (n, 2) array of bad/good probabilities
+        """
+        future = Future()
+        self.pending.put((numbers, years, future))
+        return future
+
+    def close(self) -> None:
+        """
+        Stops the worker thread once the queued requests are scored
+        """
+        self.pending.put(None)
+        self.worker.join()
+
+    def _collect(self) -> list:
+        """
+        Waits for a request, then collects more until the batch is full or max_wait passed
+        """
+        first = self.pending.get()
+        if first is None:
+            return None
+        batch, size = [first], len(first[0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self.pending.get(timeout=timeout) if timeout > 0 else self.pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # score what has been collected, then stop
+                self.pending.put(None)
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            numbers = np.concatenate([item[0] for item in batch])
+            years   = np.concatenate([item[1] for item in batch])
+            try:
+                result = self.predict_proba(numbers, years)
+            except Exception as error:
+                for _, _, future in batch:
+                    future.set_exception(error)
+                continue
+            self.stats.record_batch(len(numbers))
+
+            start = 0
+            for item_numbers, _, future in batch:
+                future.set_result(result[start:start + len(item_numbers)])
+                start += len(item_numbers)
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP endpoints of the scoring server:
+    - POST /score with a JSON body {"tickets": [[N1, .., N5, L1, L2], ...], "year": YYYY},
+      where year is optional (defaults to today's year). Answers with the
+      'prob bad', 'prob good' and 'verdict' of every ticket, in order.
+    - GET /metrics answers with LatencyStats.snapshot
+    - GET /health answers with {"status": "ok"}
+    """
+
+    def _send_json(self, code : int, body : dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _reject(self, message : str) -> None:
+        self.server.stats.record_error()
+        self._send_json(400, {'error': message})
+
+    def do_GET(self) -> None:
+        if self.path == '/metrics':
+            self._send_json(200, self.server.stats.snapshot())
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self) -> None:
+        if self.path != '/score':
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        start = time.perf_counter()
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            return self._reject("The body must be JSON")
+        tickets = body.get('tickets') if isinstance(body, dict) else None
+        if not isinstance(tickets, list) or not tickets:
+            return self._reject("Expected a non-empty list of 'tickets'")
+        if len(tickets) > self.server.max_request_size:
+            return self._reject(f"At most {self.server.max_request_size} tickets per request")
+        for i, ticket in enumerate(tickets):
+            error = validate_ticket(ticket)
+            if error is not None:
+                return self._reject(f"Ticket {i}: {error}")
+        year = body.get('year', datetime.today().year)
+        if not isinstance(year, int) or isinstance(year, bool):
+            return self._reject("The year must be an integer")
+
+        # sort the numbers and the lucky numbers, as InputHelper.get_user_input does
+        numbers = np.array(tickets, dtype=np.int64)
+        numbers[:, :len(N_COLS)] = np.sort(numbers[:, :len(N_COLS)], axis=1)
+        numbers[:, len(N_COLS):] = np.sort(numbers[:, len(N_COLS):], axis=1)
+        years = np.full(len(numbers), year, dtype=np.int64)
+
+        try:
+            result = self.server.batcher.submit(numbers, years).result()
+        except Exception as error:
+            self.server.stats.record_error()
+            return self._send_json(500, {'error': str(error)})
+
+        self.server.stats.record_request(time.perf_counter() - start, len(numbers))
+        self._send_json(200, {'scores': [{'prob bad': float(bad), 'prob good': float(good),
+                                          'verdict': 'GOOD' if good > bad else 'BAD'}
+                                         for bad, good in result]})
+
+    def log_message(self, format, *args) -> None:
+        # one line per request would dominate the cost of a request at peak times
+        pass
+
+
+# connections waiting to be accepted; the default of 5 drops bursts of requests
+REQUEST_QUEUE_SIZE = 1024
+
+
+class ScoringHTTPServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer, with room for bursts of connections
+    """
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    ThreadingHTTPServer, listening on a Unix socket instead of a TCP port
+    """
+    daemon_threads = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ('local', 0)
+
+
+def make_server(scorer, host : str = '127.0.0.1', port : int = 8000, unix_socket : str = None,
+                max_batch_size : int = 256, max_wait : float = 0.005, max_request_size : int = 10000):
+    """
+    Creates the scoring server around an already loaded scorer
+
+    Parameters
+    ----------
+    scorer : TicketScorer or CompactScorer
+        Anything with predict_proba(numbers, years), loaded once for all requests
+    host : str
+        The host to listen on
+    port : int
+        The TCP port to listen on
+    unix_socket : str
+        If given, listen on this Unix socket instead of host:port. A stale
+        socket at the path is replaced, anything else at it is an error.
+    max_batch_size : int
+        The maximum number of tickets per micro-batch
+    max_wait : float
+        The maximum time [s] a request waits for others to join its batch
+    max_request_size : int
+        The maximum number of tickets per request
+
+    Returns
+    -------
+    socketserver.BaseServer
+        The server; call serve_forever() to start it
+    """
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            if not stat.S_ISSOCK(os.stat(unix_socket).st_mode):
+                raise FileExistsError(f"{unix_socket} exists and is not a socket")
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, ScoringRequestHandler)
+    else:
+        server = ScoringHTTPServer((host, port), ScoringRequestHandler)
+
+    server.stats   = LatencyStats()
+    server.batcher = MicroBatcher(scorer.predict_proba, max_batch_size=max_batch_size,
+                                  max_wait=max_wait, stats=server.stats)
+    server.max_request_size = max_request_size
+    return server
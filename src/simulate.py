@@ -0,0 +1,499 @@
+import os
+import pickle
+import contextlib
+import numpy as np
+from statistics import NormalDist
+from multiprocessing import Pool
+from src.vecEng import N_COLS, L_COLS, TICKET_COLS
+from src.tickets import N_MAX, L_MAX, STAR_SHIFT, TicketMasks, encode, popcount
+from src.compactModel import MODEL_DIR, CompactScorer
+
+# where the fitted crowding models are saved, one per source
+CROWDING_FILE = 'crowding-model-{source}.sav'
+# uniform: every ticket is played equally often (the analytic Pr[N,L] of score_numbers)
+# winners: the winners per group explained by the features of the drawn ticket
+# classifier: the winners per group explained by the classifier's P(GOOD) of the drawn ticket
+SOURCES = ('uniform', 'winners', 'classifier')
+# the row features (src/tickets.py) of a drawn ticket which explain its crowding
+CROWDING_FEATURES = ['is date', 'is this year', 'lucky numbers', 'lucky lucky numbers',
+                     '7 pattern', 'N rows', 'N sum', 'L sum']
+# the L2 penalty of the Poisson regressions, on standardised covariates
+CROWDING_ALPHA = 1e-4
+
+# the default number of simulated draws per ticket
+DRAWS = 1000000
+# simulated draws per task; the seeds are spawned per task, so the
+# results do not depend on the number of processes
+CHUNK_DRAWS = 2**16
+# the payout histogram of every ticket, in units of the prize fund per unit of sales
+PAYOUT_BINS = np.logspace(-3, 9, 241)
+CONFIDENCE = 0.95
+
+_ticket_bits = np.arange(N_MAX + L_MAX, dtype=np.uint64)
+_ticket_bits[N_MAX:] = np.arange(STAR_SHIFT, STAR_SHIFT + L_MAX, dtype=np.uint64)
+
+# the crowding model of each worker process, set by _init_worker
+_model = None
+
+
+def sample_masks(rng : np.random.Generator, bits : np.ndarray, k : int, n : int) -> np.ndarray:
+    """
+    n masks with k distinct bits each, chosen uniformly from bits. Rows
+    which drew a bit twice are redrawn, which is much cheaper than a
+    permutation per row for the few bits of a draw. To keep the redraws
+    rare, more than half of the bits are chosen by leaving out the others.
+
+    Parameters
+    ----------
+    rng : np.random.Generator
+        The random generator
+    bits : np.ndarray
+        uint64 array of the bit positions to choose from
+    k : int
+        The number of bits per mask
+    n : int
+        The number of masks
+
+    Returns
+    -------
+    np.ndarray
+        (n,) uint64 array of masks
+    """
+    if 2 * k > len(bits):
+        return np.bitwise_or.reduce(np.uint64(1) << bits) ^ sample_masks(rng, bits, len(bits) - k, n)
+    masks = np.zeros(n, dtype=np.uint64)
+    if k == 0:
+        return masks
+    redraw = np.ones(n, dtype=bool)
+    while redraw.any():
+        chosen = np.uint64(1) << bits[rng.integers(0, len(bits), size=(redraw.sum(), k))]
+        masks[redraw] = np.bitwise_or.reduce(chosen, axis=1)
+        redraw[redraw] = popcount(masks[redraw]) < k
+    return masks
+
+
+class CrowdingModel:
+    """
+    A model of how the other players bet: the expected number of other
+    winners of group (N, L) in a draw d is
+
+        sales * Pr[N, L] * exp(intercept + coef . x(d))
+
+    where Pr[N, L] is the chance of a uniformly played ticket to win the
+    group (see FeatureEngineering.prob_NL_analyt) and x(d) are the
+    standardised covariates of the drawn ticket: its features (source
+    'winners') or the classifier's P(GOOD) (source 'classifier'). The
+    coefficients of every group are a Poisson regression of the winners
+    in the dataset with the exposure sales * Pr[N, L]. The uniform model
+    has no covariates: its intercepts only scale the sales to the number
+    of tickets played.
+
+    Once fitted, the model only needs NumPy, such that the simulation
+    does not import pandas or scikit-learn.
+
+    Attributes
+    ----------
+    source : str
+        One of SOURCES
+
+    tags : list
+        The winning groups, e.g. '5+2', '2'
+
+    n_main, n_stars : np.ndarray
+        The numbers and lucky numbers matched in every group
+
+    probability : np.ndarray
+        Pr[N, L] of every group, with today's 12 lucky numbers
+
+    win_frac : np.ndarray
+        The fraction of the prize fund of every group
+
+    sales : np.ndarray
+        The sales of the draws with today's rules, which the simulation draws from
+
+    mean, scale : np.ndarray
+        The standardisation of the covariates
+
+    intercept : np.ndarray
+        The log crowding of every group at the mean covariates
+
+    coef : np.ndarray
+        (groups, covariates) array of coefficients
+
+    scorer : CompactScorer
+        The classifier (source 'classifier'), None otherwise
+
+    Methods
+    -------
+    fit(dataset : pd.DataFrame, source : str, model_dir : str) -> CrowdingModel
+        Fits the model to the winners of the draws in the dataset
+
+    covariates(masks : np.ndarray, years : np.ndarray) -> np.ndarray
+        The standardised covariates of drawn tickets
+
+    expected_winners(group : int, masks : np.ndarray, years : np.ndarray, sales : np.ndarray) -> np.ndarray
+        The expected number of other winners of a group in each draw
+
+    save(filename : str)
+        Pickles the model
+
+    load(filename : str) -> CrowdingModel
+        Loads a pickled model
+    """
+
+    def __init__(self, source : str, tags : list, n_main : np.ndarray, n_stars : np.ndarray,
+                 probability : np.ndarray, win_frac : np.ndarray, sales : np.ndarray) -> None:
+        if source not in SOURCES:
+            raise ValueError(f"Unknown source {source!r}, expected one of {SOURCES}")
+        self.source      = source
+        self.tags        = tags
+        self.n_main      = n_main
+        self.n_stars     = n_stars
+        self.probability = probability
+        self.win_frac    = win_frac
+        self.sales       = sales
+
+        self.mean      = np.zeros(0)
+        self.scale     = np.ones(0)
+        self.intercept = np.zeros(len(tags))
+        self.coef      = np.zeros((len(tags), 0))
+        self.scorer    = None
+
+    @classmethod
+    def fit(cls, dataset, source : str = 'winners', model_dir : str = MODEL_DIR) -> 'CrowdingModel':
+        """
+        Fits the model to the winners of the draws in the dataset
+
+        Parameters
+        ----------
+        dataset : pd.DataFrame
+            The draws, with the winners of every group and the sales (see src/dataLoad.py)
+        source : str
+            One of SOURCES
+        model_dir : str
+            The directory with the exported classifier (source 'classifier')
+
+        Returns
+        -------
+        CrowdingModel
+            The fitted model
+        """
+        from sklearn.linear_model import PoissonRegressor
+        from src.dataEng import FeatureEngineering
+        from src.eras import ERAS, GROUP_TAGS, HAS_GROUP, PROBABILITY, draw_eras
+
+        engineering = FeatureEngineering(dataset)
+        groups = [(N, L) for N in sorted(engineering.win_frac, reverse=True)
+                  for L in sorted(engineering.win_frac[N], reverse=True)]
+        tags   = [str(N) + ("+" + str(L) if L != 0 else "") for N, L in groups]
+        # the columns of the groups in the per-era tables of src/eras.py
+        columns = [GROUP_TAGS.index(tag) for tag in tags]
+        era    = draw_eras(dataset)
+        sales  = dataset['Sales'].to_numpy(dtype=float)
+
+        # the draws are played under today's rules, the last era
+        model = cls(source, tags,
+                    n_main=np.array([N for N, _ in groups]), n_stars=np.array([L for _, L in groups]),
+                    probability=PROBABILITY[-1, columns],
+                    win_frac=np.array([engineering.win_frac[N][L] for N, L in groups]),
+                    sales=sales[era == len(ERAS) - 1])
+        if source == 'classifier':
+            model.scorer = CompactScorer(model_dir)
+        if source != 'uniform':
+            masks = TicketMasks.from_dataframe(dataset)
+            x = model._raw_covariates(masks.masks, masks.years)
+            model.mean, model.scale = x.mean(axis=0), x.std(axis=0)
+            model.scale[model.scale == 0] = 1.
+            x = model.covariates(masks.masks, masks.years)
+            model.coef = np.zeros((len(tags), x.shape[1]))
+
+        for i, (tag, column) in enumerate(zip(tags, columns)):
+            # only the draws of the eras which have the group, with the Pr[N, L] of their era
+            rows     = HAS_GROUP[era, column]
+            exposure = sales[rows] * PROBABILITY[era[rows], column]
+            winners  = dataset[tag].to_numpy(dtype=float)[rows]
+            if source == 'uniform':
+                # the maximum likelihood rate of a Poisson distribution
+                model.intercept[i] = np.log(winners.sum() / exposure.sum())
+                continue
+            # Poisson regression with an offset: the rate winners / exposure, weighted by the exposure
+            regression = PoissonRegressor(alpha=CROWDING_ALPHA, max_iter=1000)
+            regression.fit(x[rows], winners / exposure, sample_weight=exposure)
+            model.intercept[i], model.coef[i] = regression.intercept_, regression.coef_
+        return model
+
+    def _raw_covariates(self, masks : np.ndarray, years : np.ndarray) -> np.ndarray:
+        tickets = TicketMasks(masks, years)
+        if self.source == 'classifier':
+            features = tickets.engineer_features(self.scorer.state)
+            inputs = np.column_stack([features[col] for col in self.scorer.predictor.model_features])
+            return self.scorer.predictor.predict_proba(inputs)[:, 1:]
+        features = tickets.row_features()
+        return np.column_stack([features[col] for col in CROWDING_FEATURES]).astype(float)
+
+    def covariates(self, masks : np.ndarray, years : np.ndarray) -> np.ndarray:
+        """
+        The standardised covariates of drawn tickets
+
+        Parameters
+        ----------
+        masks : np.ndarray
+            uint64 array of drawn tickets (see src/tickets.py)
+        years : np.ndarray
+            The year of each draw, or a single year for all of them
+
+        Returns
+        -------
+        np.ndarray
+            (n, covariates) array
+        """
+        if self.source == 'uniform':
+            return np.zeros((len(masks), 0))
+        return (self._raw_covariates(masks, years) - self.mean) / self.scale
+
+    def expected_winners(self, group : int, masks : np.ndarray, years : np.ndarray,
+                         sales : np.ndarray) -> np.ndarray:
+        """
+        The expected number of other winners of a group in each draw
+
+        Parameters
+        ----------
+        group : int
+            The index of the group in tags
+        masks : np.ndarray
+            uint64 array of drawn tickets
+        years : np.ndarray
+            The year of each draw, or a single year for all of them
+        sales : np.ndarray
+            The sales of each draw
+
+        Returns
+        -------
+        np.ndarray
+            The expected winners of each draw
+        """
+        crowding = np.exp(self.intercept[group] + self.covariates(masks, years) @ self.coef[group])
+        return sales * self.probability[group] * crowding
+
+    def save(self, filename : str) -> None:
+        with open(filename, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(filename : str) -> 'CrowdingModel':
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+
+def load_crowding_model(source : str = 'winners', model_dir : str = MODEL_DIR,
+                        refit : bool = False) -> CrowdingModel:
+    """
+    Loads the crowding model of a source from model_dir, fitting
+    (and saving) it on the saved dataset the first time
+
+    Parameters
+    ----------
+    source : str
+        One of SOURCES
+    model_dir : str
+        The directory with the saved dataset and model
+    refit : bool
+        Whether to refit the model even if it has been saved
+
+    Returns
+    -------
+    CrowdingModel
+        The model
+    """
+    filename = os.path.join(model_dir, CROWDING_FILE.format(source=source))
+    if os.path.exists(filename) and not refit:
+        return CrowdingModel.load(filename)
+
+    from src.dataLoad import read_dataset
+    from src.eras import GROUP_TAGS
+
+    # only the dates, numbers, winners and sales of the saved dataset
+    dataset = read_dataset(model_dir, ['YYYY', 'MMM', 'DD'] + TICKET_COLS + GROUP_TAGS + ['Sales'])
+    model = CrowdingModel.fit(dataset, source, model_dir)
+    model.save(filename)
+    return model
+
+
+def simulate_group(model : CrowdingModel, ticket : np.uint64, year : int, group : int, n : int,
+                   seed, sales : float = None) -> tuple:
+    """
+    Simulates n draws in which the ticket wins the given group, i.e.
+    matches exactly N of the numbers and L of the lucky numbers: N of its
+    numbers and 5 - N of the others are drawn, and likewise for the lucky
+    numbers. The other winners of each draw are Poisson distributed around
+    model.expected_winners, and the ticket's payout is its share of the
+    group's prize fund, win_frac * sales / (other winners + 1), in units of
+    the prize fund per unit of sales (as the 'avg win' of score_dataset).
+
+    Parameters
+    ----------
+    model : CrowdingModel
+        The model of the other players
+    ticket : np.uint64
+        The ticket's mask (see src/tickets.py)
+    year : int
+        The year the ticket is played in
+    group : int
+        The index of the group in model.tags
+    n : int
+        The number of draws
+    seed : np.random.SeedSequence
+        The seed of the draws
+    sales : float
+        The sales of every draw. If None, the sales are drawn from model.sales
+
+    Returns
+    -------
+    tuple
+        (sum, sum of squares, histogram over PAYOUT_BINS) of the payouts
+    """
+    rng = np.random.default_rng(seed)
+    ticket = np.uint64(ticket)
+    has = ((ticket >> _ticket_bits) & np.uint64(1)) == 1
+    main, stars = slice(0, N_MAX), slice(N_MAX, N_MAX + L_MAX)
+    N, L = model.n_main[group], model.n_stars[group]
+
+    draws = sample_masks(rng, _ticket_bits[main][has[main]], N, n) | \
+            sample_masks(rng, _ticket_bits[main][~has[main]], len(N_COLS) - N, n) | \
+            sample_masks(rng, _ticket_bits[stars][has[stars]], L, n) | \
+            sample_masks(rng, _ticket_bits[stars][~has[stars]], len(L_COLS) - L, n)
+    draw_sales = np.full(n, float(sales)) if sales is not None else rng.choice(model.sales, size=n)
+
+    winners = rng.poisson(model.expected_winners(group, draws, year, draw_sales))
+    payouts = model.win_frac[group] * draw_sales / (winners + 1)
+    return payouts.sum(), np.square(payouts).sum(), np.histogram(payouts, PAYOUT_BINS)[0]
+
+
+def _init_worker(model : CrowdingModel) -> None:
+    """
+    Passes the model once per worker process
+    """
+    global _model
+    _model = model
+
+
+def _simulate_task(task : tuple) -> tuple:
+    i, ticket, year, group, n, seed, sales = task
+    return (i, group, n) + simulate_group(_model, ticket, year, group, n, seed, sales)
+
+
+@contextlib.contextmanager
+def _simulate_map(model : CrowdingModel, processes : int, tasks : list):
+    """
+    Yields the (unordered) results of _simulate_task on the tasks: in this
+    process if processes == 1, otherwise from a process pool which is
+    shut down when the with block is left, also on an error
+    """
+    if processes == 1:
+        _init_worker(model)
+        yield map(_simulate_task, tasks)
+        return
+    processes = processes or os.cpu_count()
+    with Pool(processes, initializer=_init_worker, initargs=(model,)) as pool:
+        yield pool.imap_unordered(_simulate_task, tasks, chunksize=max(1, len(tasks) // (8 * processes)))
+
+
+def simulate(numbers : np.ndarray, years, model : CrowdingModel, draws : int = DRAWS, seed : int = None,
+             sales : float = None, processes : int = 1, confidence : float = CONFIDENCE) -> dict:
+    """
+    Estimates the pari-mutuel payout of tickets by Monte Carlo. Instead of
+    simulating unconditional draws, most of which win nothing, the draws
+    are stratified by winning group: every group is simulated with an
+    equal share of the draws (see simulate_group) and weighted with its
+    analytic probability Pr[N, L]. This way, the jackpot is simulated as
+    often as the 2 group, and the confidence interval of the expected
+    value is the stratified one, sqrt(sum Pr^2 var / n).
+
+    The seeds of every ticket, group and chunk of CHUNK_DRAWS draws are
+    spawned from a single SeedSequence, such that a seed reproduces the
+    same result with any number of processes.
+
+    Parameters
+    ----------
+    numbers : np.ndarray
+        (n, 7) array of (valid) tickets with columns N1 -> N5, L1, L2
+    years : int or np.ndarray
+        The year each ticket is played in
+    model : CrowdingModel
+        The model of the other players
+    draws : int
+        The number of simulated draws per ticket
+    seed : int
+        The seed. If None, a fresh one is drawn from the OS
+    sales : float
+        The sales of every draw. If None, they are drawn from the sales of past draws
+    processes : int
+        The number of worker processes, 0 or None for all cores; 1 simulates in this process
+    confidence : float
+        The confidence level of the intervals
+
+    Returns
+    -------
+    dict
+        'ev', 'ev low', 'ev high' and 'std error': the expected payout per
+        ticket and its confidence interval; 'prob win': Pr[any prize];
+        'group ev': (tickets, groups) contributions Pr[N, L] * E[payout | N, L];
+        'histogram': (tickets, len(PAYOUT_BINS) - 1) probabilities of the payouts
+        given a win; 'seed': the entropy to reproduce the result with
+    """
+    masks = encode(np.asarray(numbers, dtype=np.int64).reshape(-1, len(N_COLS) + len(L_COLS)))
+    years = np.broadcast_to(np.asarray(years, dtype=np.int64), masks.shape)
+    n_groups = len(model.tags)
+    per_group = -(-draws // n_groups)
+    chunks = [min(CHUNK_DRAWS, per_group - start) for start in range(0, per_group, CHUNK_DRAWS)]
+
+    root = np.random.SeedSequence(seed)
+    tasks = []
+    for i, ticket_seed in enumerate(root.spawn(len(masks))):
+        for group, group_seed in enumerate(ticket_seed.spawn(n_groups)):
+            for n, chunk_seed in zip(chunks, group_seed.spawn(len(chunks))):
+                tasks.append((i, masks[i], int(years[i]), group, n, chunk_seed, sales))
+
+    count = np.zeros((len(masks), n_groups))
+    total, squares = np.zeros_like(count), np.zeros_like(count)
+    histogram = np.zeros((len(masks), n_groups, len(PAYOUT_BINS) - 1))
+    with _simulate_map(model, processes, tasks) as results:
+        for i, group, n, s, s2, h in results:
+            count[i, group] += n
+            total[i, group] += s
+            squares[i, group] += s2
+            histogram[i, group] += h
+
+    mean = total / count
+    variance = (squares - count * mean**2) / np.maximum(count - 1, 1)
+    ev = mean @ model.probability
+    std_error = np.sqrt(((model.probability**2) * variance / count).sum(axis=1))
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    prob_win = model.probability.sum()
+
+    return {'ev': ev, 'ev low': ev - z * std_error, 'ev high': ev + z * std_error, 'std error': std_error,
+            'prob win': np.full(len(masks), prob_win), 'group ev': mean * model.probability,
+            'histogram': np.einsum('tgb,g->tb', histogram / count[:, :, None], model.probability) / prob_win,
+            'seed': root.entropy}
+
+
+def payout_quantiles(histogram : np.ndarray, quantiles : tuple = (0.5, 0.9, 0.99)) -> np.ndarray:
+    """
+    The quantiles of the payouts given a win, from the histograms of simulate.
+    A quantile is the upper edge of the bin it falls into.
+
+    Parameters
+    ----------
+    histogram : np.ndarray
+        (tickets, len(PAYOUT_BINS) - 1) array of probabilities
+    quantiles : tuple
+        The quantiles
+
+    Returns
+    -------
+    np.ndarray
+        (tickets, len(quantiles)) array of payouts
+    """
+    cumulative = np.cumsum(histogram, axis=1)
+    bins = np.stack([(cumulative < q).sum(axis=1) for q in quantiles], axis=1)
+    return PAYOUT_BINS[1:][np.minimum(bins, len(PAYOUT_BINS) - 2)]
@@ -0,0 +1,74 @@
+import re
+import sys
+import time
+import subprocess
+
+# a cold start should stay below this many seconds
+STARTUP_TARGET = 1.0
+
+
+def parse_importtime(stderr : str) -> list:
+    """
+    Parses the output of python -X importtime
+
+    Parameters
+    ----------
+    stderr : str
+        The stderr of the python process
+
+    Returns
+    -------
+    list
+        (package, self time [s], cumulative time [s], nesting level) of every import
+    """
+    imports = []
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)', line)
+        if match:
+            self_us, cumulative_us, indent, package = match.groups()
+            imports.append((package, int(self_us)*1e-6, int(cumulative_us)*1e-6, len(indent) // 2))
+    return imports
+
+
+def startup_report(command : list, stdin : str = '', top : int = 15) -> str:
+    """
+    Runs command (a fresh python process) with -X importtime and
+    reports its wall time, the time spent importing and the slowest
+    top-level imports, measured against STARTUP_TARGET.
+
+    Parameters
+    ----------
+    command : list
+        The python script and its arguments, e.g. ['quick-start.py']
+    stdin : str
+        What to feed the process on stdin
+    top : int
+        How many of the slowest imports to list
+
+    Returns
+    -------
+    str
+        The report
+    """
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime'] + command, input=stdin,
+                             capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed:\n{process.stderr[-2000:]}")
+
+    imports = parse_importtime(process.stderr)
+    top_level = sorted([i for i in imports if i[3] == 0], key=lambda i: -i[2])
+    import_time = sum(i[2] for i in top_level)
+
+    lines = [f"startup report for: {' '.join(command)}",
+             f"wall time:   {wall:.3f} s ({'within' if wall <= STARTUP_TARGET else 'ABOVE'} the {STARTUP_TARGET:.1f} s target)",
+             f"import time: {import_time:.3f} s in {len(imports)} modules",
+             f"slowest top-level imports (cumulative):"]
+    for package, _, cumulative, _ in top_level[:top]:
+        lines.append(f"  {cumulative:8.3f} s  {package}")
+    for heavy in ('pandas', 'sklearn', 'scipy'):
+        if any(i[0] == heavy for i in imports):
+            lines.append(f"note: '{heavy}' was imported")
+
+    return "\n".join(lines)
@@ -0,0 +1,205 @@
+import sys
+import itertools
+import pandas as pd
+from src.vecEng import TICKET_COLS, FeatureState
+from src.tickets import TicketMasks
+from src.scoring import read_tickets, prepare_tickets
+from src.profiling import stage
+
+# tickets per chunk; a chunk of scored tickets takes roughly 100 bytes per ticket
+CHUNK_SIZE = 100000
+
+
+def read_ticket_chunks(source, chunk_size : int = CHUNK_SIZE):
+    """
+    Reads a batch of tickets (see read_tickets) in chunks, such that only
+    one chunk is in memory at a time. The rows of every chunk are labelled
+    with their row number in the file, as if the file was read at once.
+
+    Parameters
+    ----------
+    source : str or file-like
+        Where to read the tickets from, as for read_tickets
+    chunk_size : int
+        The number of tickets per chunk; None reads all tickets as one chunk
+
+    Yields
+    ------
+    pd.DataFrame
+        The tickets of the next chunk, with the columns N1 -> N5, L1, L2 (and YYYY if given)
+    """
+    if chunk_size is None:
+        yield read_tickets(source)
+        return
+
+    if isinstance(source, str) and source.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        start = 0
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size):
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+        return
+    if isinstance(source, str) and source.endswith('.csv'):
+        # read_csv numbers the rows of its chunks continuously
+        yield from pd.read_csv(source, skipinitialspace=True, chunksize=chunk_size)
+        return
+
+    stream = sys.stdin if source == '-' else open(source) if isinstance(source, str) else source
+    try:
+        start = 0
+        while True:
+            # read_tickets skips empty and comment lines, so the chunks may be a bit smaller
+            lines = list(itertools.islice(stream, chunk_size))
+            if not lines:
+                return
+            chunk = read_tickets(lines)
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+    finally:
+        if stream is not source and stream is not sys.stdin:
+            stream.close()
+
+
+def engineer_chunks(chunks, state : FeatureState, year : int = None, drop_invalid : bool = False):
+    """
+    Engineers the features of every chunk of tickets with the frozen
+    sum means and bins, such that the features of a ticket do not depend
+    on the other tickets, as FeatureEngineering.engineer_features(state=state)
+
+    Parameters
+    ----------
+    chunks : iterable
+        DataFrames of tickets, e.g. from read_ticket_chunks
+    state : FeatureState
+        The sum means and bins of the dataset the model was trained on
+    year : int
+        The year the tickets are played in, if not in the tickets. Defaults to today's year
+    drop_invalid : bool
+        Whether to drop invalid tickets instead of raising a ValueError
+
+    Yields
+    ------
+    pd.DataFrame
+        The prepared tickets (see prepare_tickets) and their features
+    """
+    for chunk in chunks:
+        with stage('engineer chunk', len(chunk)):
+            tickets  = prepare_tickets(chunk, year=year, drop_invalid=drop_invalid)
+            features = TicketMasks.from_numbers(tickets[TICKET_COLS].to_numpy(),
+                                                tickets['YYYY'].to_numpy()).engineer_features(state)
+            for col, values in features.items():
+                tickets[col] = values
+        yield tickets
+
+
+def score_chunks(scorer, chunks, year : int = None, drop_invalid : bool = False,
+                 backend : str = 'serial', workers : int = None):
+    """
+    Scores every chunk of tickets
+
+    Parameters
+    ----------
+    scorer : TicketScorer
+        The scorer, loaded once for all chunks
+    chunks : iterable
+        DataFrames of tickets, e.g. from read_ticket_chunks
+    year : int
+        The year the tickets are played in, if not in the tickets. Defaults to today's year
+    drop_invalid : bool
+        Whether to drop invalid tickets instead of raising a ValueError
+    backend, workers
+        How every chunk is scored (see TicketScorer.score)
+
+    Yields
+    ------
+    pd.DataFrame
+        The output of TicketScorer.score for each chunk
+    """
+    for chunk in chunks:
+        yield scorer.score(chunk, year=year, drop_invalid=drop_invalid, backend=backend, workers=workers)
+
+
+class ChunkWriter:
+    """
+    Writes DataFrames chunk by chunk to a .csv or .parquet file, or as CSV
+    to stdout if the destination is '-', with the same output as
+    write_scores of all chunks at once
+
+    Attributes
+    ----------
+    destination : str
+        The file to write to
+
+    rows : int
+        The number of rows written so far
+
+    Methods
+    -------
+    write(chunk : pd.DataFrame)
+        Appends a chunk
+
+    close()
+        Flushes and closes the file
+    """
+
+    def __init__(self, destination : str) -> None:
+        self.destination = destination
+        self.rows    = 0
+        self.file    = None
+        self.header  = True
+        self.parquet = destination.endswith('.parquet')
+
+    def write(self, chunk : pd.DataFrame) -> None:
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self.file is None:
+                self.file = pq.ParquetWriter(self.destination, table.schema)
+            self.file.write_table(table)
+        else:
+            if self.file is None:
+                self.file = sys.stdout if self.destination == '-' else open(self.destination, 'w', newline='')
+            # the header is written once, even if the first chunks are empty
+            chunk.to_csv(self.file, index=False, header=self.header)
+            self.header = False
+        self.rows += len(chunk)
+
+    def close(self) -> None:
+        if self.file is not None and self.file is not sys.stdout:
+            self.file.close()
+        self.file = None
+
+    def __enter__(self) -> 'ChunkWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def write_chunks(chunks, destination : str) -> int:
+    """
+    Writes the chunks of a pipeline as they are produced
+
+    Parameters
+    ----------
+    chunks : iterable
+        DataFrames, e.g. from score_chunks or engineer_chunks
+    destination : str
+        The file to write to, as for write_scores
+
+    Returns
+    -------
+    int
+        The number of rows written
+    """
+    with ChunkWriter(destination) as writer:
+        for chunk in chunks:
+            with stage('write chunk', len(chunk)):
+                writer.write(chunk)
+    return writer.rows
@@ -0,0 +1,359 @@
+import numpy as np
+from src.vecEng import (N_COLS, L_COLS, TICKET_COLS, N_MAX, L_MAX, LUCKY_NUMBERS, SEVEN_PATTERN, TICKET_ROW_BINS,
+                        FeatureState)
+
+# bit n-1 marks the number n, bit STAR_SHIFT + l-1 the lucky number (star) l
+STAR_SHIFT = N_MAX
+
+
+def number_mask(numbers, shift : int = 0) -> np.uint64:
+    """
+    The bitmask of a set of numbers
+
+    Parameters
+    ----------
+    numbers : iterable
+        The numbers, starting at 1
+    shift : int
+        The bit of the number 1, STAR_SHIFT for lucky numbers
+
+    Returns
+    -------
+    np.uint64
+        The mask
+    """
+    mask = 0
+    for n in numbers:
+        mask |= 1 << (int(n) - 1 + shift)
+    return np.uint64(mask)
+
+
+MAIN_MASK       = number_mask(range(1, N_MAX + 1))
+STAR_MASK       = number_mask(range(1, L_MAX + 1), STAR_SHIFT)
+LUCKY_MASK      = number_mask(LUCKY_NUMBERS)
+LUCKY_STAR_MASK = number_mask(LUCKY_NUMBERS[LUCKY_NUMBERS <= L_MAX], STAR_SHIFT)
+SEVEN_MASK      = number_mask(SEVEN_PATTERN)
+MONTH_MASK      = number_mask(range(1, 13))
+DAY_MASK        = number_mask(range(1, 32))
+TWENTY_MASK     = number_mask([20])
+# one mask per row of the ticket, (TICKET_ROW_BINS[i], TICKET_ROW_BINS[i+1]]
+ROW_MASKS = [number_mask(range(lo + 1, hi + 1)) for lo, hi in zip(TICKET_ROW_BINS[:-1], TICKET_ROW_BINS[1:])]
+
+# the sum of the numbers (bit + 1) and the number of bits set in every 16 bit word
+_BYTE_SUMS   = np.array([sum(bit + 1 for bit in range(8) if b >> bit & 1) for b in range(256)], dtype=np.int64)
+_BYTE_COUNTS = np.array([bin(b).count('1') for b in range(256)], dtype=np.int64)
+_WORDS = np.arange(2**16)
+WORD_COUNTS = _BYTE_COUNTS[_WORDS & 0xFF] + _BYTE_COUNTS[_WORDS >> 8]
+WORD_SUMS   = _BYTE_SUMS[_WORDS & 0xFF] + _BYTE_SUMS[_WORDS >> 8] + 8 * _BYTE_COUNTS[_WORDS >> 8]
+
+
+def popcount(masks : np.ndarray) -> np.ndarray:
+    """
+    The number of set bits of every mask
+
+    Parameters
+    ----------
+    masks : np.ndarray
+        uint64 array
+
+    Returns
+    -------
+    np.ndarray
+        int64 array of bit counts
+    """
+    masks = np.asarray(masks, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(masks).astype(np.int64)
+    # SWAR: count the bits of pairs, nibbles and bytes in parallel, then add up the bytes
+    x = masks - ((masks >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((x * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+
+def encode(numbers : np.ndarray) -> np.ndarray:
+    """
+    Packs tickets into one uint64 each: the 5 numbers
+    in bits 0 -> 49 and the 2 lucky numbers in bits 50 -> 61
+
+    Parameters
+    ----------
+    numbers : np.ndarray
+        (n, 7) integer array of valid tickets with columns N1 -> N5, L1, L2
+
+    Returns
+    -------
+    np.ndarray
+        (n,) uint64 array of masks
+    """
+    numbers = np.asarray(numbers, dtype=np.uint64).reshape(-1, len(TICKET_COLS))
+    bits = numbers - np.uint64(1)
+    bits[:, len(N_COLS):] += np.uint64(STAR_SHIFT)
+    return np.bitwise_or.reduce(np.uint64(1) << bits, axis=1)
+
+
+def decode(masks : np.ndarray) -> np.ndarray:
+    """
+    Unpacks masks into tickets, with the numbers
+    and the lucky numbers each in increasing order
+
+    Parameters
+    ----------
+    masks : np.ndarray
+        (n,) uint64 array of masks
+
+    Returns
+    -------
+    np.ndarray
+        (n, 7) int64 array of tickets with columns N1 -> N5, L1, L2
+    """
+    masks = np.asarray(masks, dtype=np.uint64)
+    # the little-endian bits of every mask, one row per mask
+    bits = np.unpackbits(masks.astype('<u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    rows, positions = np.nonzero(bits[:, :STAR_SHIFT + L_MAX])
+    if len(positions) != len(TICKET_COLS) * len(masks):
+        raise ValueError(f"Every mask must have {len(N_COLS)} numbers and {len(L_COLS)} lucky numbers")
+    # np.nonzero returns the set bits row by row, in increasing order
+    numbers = positions.reshape(-1, len(TICKET_COLS)) + 1
+    numbers[:, len(N_COLS):] -= STAR_SHIFT
+    return numbers
+
+
+def bit_sum(masks : np.ndarray) -> np.ndarray:
+    """
+    The sum of the numbers (bit + 1) set in every mask
+
+    Parameters
+    ----------
+    masks : np.ndarray
+        uint64 array
+
+    Returns
+    -------
+    np.ndarray
+        int64 array of sums
+    """
+    masks = np.asarray(masks, dtype=np.uint64)
+    sums = np.zeros(masks.shape, dtype=np.int64)
+    for k in range(4):
+        words = masks >> np.uint64(16 * k)
+        if not words.any():
+            break
+        words = (words & np.uint64(0xFFFF)).astype(np.intp)
+        # a number in word k is 16*k larger than its bit within the word
+        sums += WORD_SUMS[words] + 16 * k * WORD_COUNTS[words]
+    return sums
+
+
+class TicketMasks:
+    """
+    A compact array of tickets: one uint64 bitmask per ticket (see
+    encode), i.e. 8 bytes instead of a DataFrame row. The features of
+    VectorisedFeatureEngineering are popcounts of the masks AND-ed with
+    constant masks, such as LUCKY_MASK.
+
+    The masks do not keep the order of the numbers, so the features are
+    those of the sorted tickets. This only matters for 'is date', which
+    scans the numbers in column order; all scoring in this project sorts
+    the tickets first (see TicketScorer.prepare).
+
+    Attributes
+    ----------
+    masks : np.ndarray
+        (n,) uint64 array of tickets
+
+    years : np.ndarray
+        (n,) integer array with the year each ticket was drawn / played in
+
+    Methods
+    -------
+    from_numbers(numbers : np.ndarray, years : np.ndarray) -> TicketMasks
+        Encodes an (n, 7) array of tickets
+
+    from_dataframe(df : pd.DataFrame) -> TicketMasks
+        Encodes a DataFrame with the columns YYYY, N1 -> N5, L1 and L2
+
+    numbers() -> np.ndarray
+        Decodes the tickets into an (n, 7) array
+
+    to_dataframe() -> pd.DataFrame
+        Decodes the tickets into a DataFrame with the columns YYYY, N1 -> N5, L1 and L2
+
+    row_features() -> dict
+        The features which only depend on the tickets, as VectorisedFeatureEngineering.row_features
+
+    engineer_features(state : FeatureState = None) -> dict
+        All features, as VectorisedFeatureEngineering.engineer_features
+    """
+
+    def __init__(self, masks : np.ndarray, years : np.ndarray) -> None:
+        self.masks = np.asarray(masks, dtype=np.uint64).ravel()
+        self.years = np.broadcast_to(np.asarray(years, dtype=np.int64), (len(self.masks),))
+
+    @classmethod
+    def from_numbers(cls, numbers : np.ndarray, years : np.ndarray) -> 'TicketMasks':
+        """
+        The masks of an (n, 7) array of tickets with columns N1 -> N5, L1, L2,
+        played in the given year(s)
+        """
+        return cls(encode(numbers), years)
+
+    @classmethod
+    def from_dataframe(cls, df) -> 'TicketMasks':
+        """
+        The masks of a DataFrame with YYYY, N1 -> N5, L1 and L2 columns
+        """
+        return cls(encode(df[TICKET_COLS].to_numpy()), df['YYYY'].to_numpy())
+
+    def __len__(self) -> int:
+        return len(self.masks)
+
+    def numbers(self) -> np.ndarray:
+        """
+        The tickets as an (n, 7) array with columns N1 -> N5, L1, L2, sorted
+        """
+        return decode(self.masks)
+
+    def to_dataframe(self) -> 'pd.DataFrame':
+        """
+        The tickets as a DataFrame with YYYY, N1 -> N5, L1 and L2 columns
+        """
+        import pandas as pd
+
+        df = pd.DataFrame(self.numbers(), columns=TICKET_COLS)
+        df.insert(0, 'YYYY', self.years)
+        return df
+
+    def _count(self, mask : np.uint64) -> np.ndarray:
+        return popcount(self.masks & mask)
+
+    #
+    # --------------------------------- Features ---------------------------------
+    #
+    def is_date(self) -> np.ndarray:
+        """
+        For sorted numbers, the first number <= 12 is the smallest one and
+        the day is any later one <= 31: a month and another number <= 31
+        """
+        return (self._count(MONTH_MASK) >= 1) & (self._count(DAY_MASK) >= 2)
+
+    def _year_masks(self) -> tuple:
+        # the last two digits of the year, as a number mask (0 if it is not a number)
+        second = self.years - 2000
+        valid = (second >= 1) & (second <= N_MAX)
+        year_bit = np.where(valid, np.uint64(1) << np.clip(second - 1, 0, N_MAX - 1).astype(np.uint64), np.uint64(0))
+        # all numbers <= second
+        upto = np.where(second >= 1, (np.uint64(1) << np.clip(second, 0, N_MAX).astype(np.uint64)) - np.uint64(1),
+                        np.uint64(0))
+        return year_bit, upto
+
+    def is_this_year(self) -> np.ndarray:
+        """
+        20 and the last two digits of the year, which is a different number
+        """
+        year_bit, _ = self._year_masks()
+        has_20 = (self.masks & TWENTY_MASK) != 0
+        return has_20 & ((self.masks & year_bit & ~TWENTY_MASK) != 0)
+
+    def is_post_2000(self) -> np.ndarray:
+        """
+        20 and any other number <= the last two digits of the year
+        """
+        _, upto = self._year_masks()
+        has_20 = (self.masks & TWENTY_MASK) != 0
+        return has_20 & ((self.masks & upto & ~TWENTY_MASK) != 0)
+
+    def lucky_numbers(self) -> np.ndarray:
+        """
+        How many of the 5 numbers are lucky numbers (see FeatureEngineering.get_lucky_numbers)
+        """
+        return self._count(LUCKY_MASK)
+
+    def lucky_lucky_numbers(self) -> np.ndarray:
+        """
+        How many of the 2 lucky numbers (stars) are lucky numbers
+        """
+        return self._count(LUCKY_STAR_MASK)
+
+    def seven_pattern(self) -> np.ndarray:
+        """
+        How many of the 5 numbers are in the 7 pattern
+        """
+        return self._count(SEVEN_MASK)
+
+    def number_of_different_rows(self) -> np.ndarray:
+        """
+        On how many rows of the ticket the 5 numbers are
+        """
+        rows = np.zeros(len(self.masks), dtype=np.int64)
+        for row_mask in ROW_MASKS:
+            rows += (self.masks & row_mask) != 0
+        return rows
+
+    def n_sum(self) -> np.ndarray:
+        """
+        N1 + ... + N5, the sum of the set bits of the numbers
+        """
+        return bit_sum(self.masks & MAIN_MASK)
+
+    def l_sum(self) -> np.ndarray:
+        """
+        L1 + L2, the sum of the set bits of the stars
+        """
+        return bit_sum((self.masks & STAR_MASK) >> np.uint64(STAR_SHIFT))
+
+    def row_features(self) -> dict:
+        """
+        Engineer the features which only depend on the
+        ticket itself, i.e. all but the sum means and bins
+
+        Returns
+        -------
+        dict
+            Column name -> np.ndarray, in the same order
+            as VectorisedFeatureEngineering.row_features
+        """
+        f = {}
+        # ---------------------------- date-based-features -----------------------------------------
+        f["is date"]      = self.is_date()
+        f["is post 2000"] = self.is_post_2000()
+        f["is this year"] = self.is_this_year()
+        # ---------------------------- lucky-numbers-based features -----------------------------------------
+        f["lucky numbers"]       = self.lucky_numbers()
+        f["lucky lucky numbers"] = self.lucky_lucky_numbers()
+        f["has lucky"]           = f["lucky numbers"] > 0
+        f["has lucky lucky"]     = f["lucky lucky numbers"] > 0
+        # ---------------------------- unlucky-numbers-based features -----------------------------------------
+        f["7 pattern"]           = self.seven_pattern()
+        # ---------------------------- betting-no-based features -----------------------------------------
+        f["N rows"]    = self.number_of_different_rows()
+        f["N sum"]     = self.n_sum()
+        f["L sum"]     = self.l_sum()
+
+        return f
+
+    def engineer_features(self, state : FeatureState = None) -> dict:
+        """
+        Engineer all features of VectorisedFeatureEngineering.engineer_features
+
+        Parameters
+        ----------
+        state : FeatureState
+            The frozen sum means and bins to use. If None, these are
+            computed w.r.t. the tickets in this array (without any
+            tickets, the features are empty, see FeatureState.transform_empty).
+
+        Returns
+        -------
+        dict
+            Column name -> np.ndarray
+        """
+        f = self.row_features()
+        if state is None and not len(f["N sum"]):
+            f.update(FeatureState.transform_empty(f["N sum"], f["L sum"]))
+            return f
+        if state is None:
+            state = FeatureState.fit(f["N sum"], f["L sum"])
+        f.update(state.transform(f["N sum"], f["L sum"]))
+
+        return f
@@ -0,0 +1,466 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import tempfile
+import warnings
+import numpy as np
+import pandas as pd
+from time import perf_counter
+from joblib import Memory, Parallel, delayed
+from scipy.optimize import curve_fit
+from sklearn import ensemble, model_selection
+from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
+from sklearn.svm import SVC
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score, roc_auc_score
+from sklearn.preprocessing import LabelEncoder
+from sklearn.utils import Bunch
+from src.dataLoad import DATA_DIR, load_dataset, save_dataset
+from src.dataEng import FeatureEngineering
+from src.vecEng import FeatureState
+from src.compactModel import MODEL_DIR, EXPORT_FORMATS, export_model, source_hash
+
+# fitted estimators, grid searches and the tuned hyperparameters
+TRAIN_CACHE_DIR = os.path.join(MODEL_DIR, 'cache')
+BEST_PARAMS_FILE = 'best-params.json'
+
+# ---------------------------- the setup of euromillions.ipynb ----------------------------
+# only draws with today's prize groups (see datasets/README.md)
+SINCE  = '2011-05-10'
+TARGET = 'Good no.'
+# numbers are 'good' if their avg win > mean + CUTOFF * std
+CUTOFF = 0.0
+MODEL_FEATURES = ['is date',
+                  'lucky numbers', 'lucky lucky numbers',
+                  'N rows',
+                  'N sum big', 'N sum bin', 'L sum bin']
+TEST_SIZE, SPLIT_SEED = 0.15, 11
+
+grid_n_estimator  = [10, 50, 100, 150, 300, 500]
+grid_learn        = [.01, .03, .05, .1, .25, 0.4]
+grid_max_depth    = [2, 4, 6, 8, 10, None]
+grid_gamma        = [.1, .25, .5, .75, 1.0, 'auto']
+grid_criterion    = ['gini', 'entropy']
+grid_max_features = ['sqrt', 2, 5, 7]
+grid_seed         = [0]
+
+GRID_PARAM = {'rf':      [{'n_estimators': grid_n_estimator, 'criterion': grid_criterion,
+                           'max_depth': grid_max_depth, 'max_features': grid_max_features,
+                           'random_state': grid_seed, 'bootstrap': [True], 'oob_score': [True]}],
+              'xgboost': [{'learning_rate': grid_learn, 'n_estimators': grid_n_estimator,
+                           'max_depth': grid_max_depth, 'random_state': grid_seed}],
+              'C-SVM':   [{'kernel': ['rbf', 'sigmoid'], 'C': [0.5, 1, 2, 3, 4, 5], 'gamma': grid_gamma,
+                           'decision_function_shape': ['ovo', 'ovr'], 'probability': [True],
+                           'random_state': grid_seed}]}
+
+
+def base_estimators() -> list:
+    """
+    The untuned base estimators of the voting ensembles, as MLA in euromillions.ipynb
+    """
+    return [('rf', RandomForestClassifier()),
+            ('xgboost', GradientBoostingClassifier()),
+            ('C-SVM', SVC())]
+
+
+def cv_split() -> model_selection.ShuffleSplit:
+    """
+    The cross validation splits of the grid searches and the ensembles
+    """
+    return model_selection.ShuffleSplit(n_splits = 10, test_size = .25, train_size = .75, random_state = 10)
+
+
+# ---------------------------- the cached steps ----------------------------
+# joblib.Memory keys these by the hash of their arguments, i.e.
+# by the training data and the estimator's hyperparameters
+def grid_search(estimator, param_grid : list, X : pd.DataFrame, y : np.ndarray, cv, n_jobs : int) -> dict:
+    """
+    Runs GridSearchCV on the ROC AUC, returning the best hyperparameters and the fold results
+    """
+    search = model_selection.GridSearchCV(estimator = estimator, n_jobs = n_jobs, param_grid = param_grid,
+                                          cv = cv, scoring = 'roc_auc')
+    search.fit(X, y)
+    return {'best_params': search.best_params_, 'best_score': search.best_score_, 'cv_results': search.cv_results_}
+
+
+def fit_estimator(estimator, X : pd.DataFrame, y : np.ndarray):
+    """
+    Fits a clone of the estimator, as VotingClassifier does for each of its estimators
+    """
+    return clone(estimator).fit(X, y)
+
+
+def score_width(avg_win : pd.Series, n_bin : int = 50) -> float:
+    """
+    The standard deviation of a gaussian fitted to
+    the histogram of the average winnings
+
+    Parameters
+    ----------
+    avg_win : pd.Series
+        The 'avg win' column of the scored dataset
+    n_bin : int
+        The number of histogram bins
+
+    Returns
+    -------
+    float
+        The fitted standard deviation
+    """
+    def gauss(x, *p):
+        A, mu, sigma = p
+        return A*np.exp(-(x-mu)**2/(2.*sigma**2))
+
+    hist, bins = np.histogram(avg_win, bins = n_bin)
+    bin_cent = (bins[:-1] + bins[1:])/2.
+    coeff, _ = curve_fit(gauss, bin_cent, hist, p0=[1., 0., 1.])
+    return coeff[2]
+
+
+def prepare_data(dataset : pd.DataFrame, cutoff : float = CUTOFF) -> tuple:
+    """
+    Engineers the features and the 'Good no.' target of
+    the dataset, as in euromillions.ipynb
+
+    Parameters
+    ----------
+    dataset : pd.DataFrame
+        The cleaned dataset, e.g. from src.dataLoad.load_dataset
+    cutoff : float
+        Numbers are good if their avg win > mean + cutoff * std
+
+    Returns
+    -------
+    tuple
+        The dataset with the features, 'avg win' and the target,
+        and the FeatureState the features were engineered with
+    """
+    eng = FeatureEngineering(dataset.copy())
+    eng.engineer_features()
+    state = FeatureState.from_dataframe(eng.data)
+
+    data = eng.score_dataset(eng.data)
+    s = score_width(data['avg win'])
+    data[TARGET] = (data['avg win'] >= 1 + s*cutoff).astype(int)
+
+    return data, state
+
+
+class TrainingPipeline:
+    """
+    The training of euromillions.ipynb as a script: the grid search
+    of every base estimator, the hard and soft voting ensembles and their
+    cross validation. The searches and every fitted estimator are cached on
+    disk, keyed by the data and the hyperparameters, and the ensembles reuse
+    the fitted base estimators instead of refitting them.
+
+    Attributes
+    ----------
+    memory : joblib.Memory
+        The cache of the searches and the fitted estimators
+
+    n_jobs : int
+        The number of processes to search and fit with
+
+    Methods
+    -------
+    tune(X : pd.DataFrame, y : np.ndarray, reuse_params : bool = False) -> list
+        Finds the best hyperparameters of every base estimator
+
+    fit_estimators(estimators : list, X : pd.DataFrame, y : np.ndarray) -> list
+        Fits the base estimators, in parallel
+
+    assemble(fitted : list, y : np.ndarray, voting : str) -> ensemble.VotingClassifier
+        Builds a fitted voting ensemble out of fitted base estimators
+
+    cross_validate_ensembles(estimators : list, X : pd.DataFrame, y : np.ndarray) -> dict
+        Cross validates the hard and soft voting ensembles
+
+    run(dataset : pd.DataFrame, reuse_params : bool = False) -> dict
+        Trains the ensembles on the dataset
+
+    save(result : dict, model_dir : str)
+        Writes the artifacts quick-start.py loads
+    """
+
+    def __init__(self, cache_dir : str = TRAIN_CACHE_DIR, n_jobs : int = None, verbose : bool = True) -> None:
+        self.cache_dir = cache_dir
+        self.memory    = Memory(cache_dir, verbose = 0)
+        self.n_jobs    = os.cpu_count() if n_jobs is None else n_jobs
+        self.verbose   = verbose
+
+        self._grid_search = self.memory.cache(grid_search, ignore = ['n_jobs'])
+        self._fit         = self.memory.cache(fit_estimator)
+
+    def _log(self, message : str) -> None:
+        if self.verbose:
+            print(message)
+
+    def _params_key(self, name : str) -> str:
+        # the tuned hyperparameters are only reused for an unchanged grid
+        return name + ':' + hashlib.sha256(repr(GRID_PARAM[name]).encode()).hexdigest()[:16]
+
+    def tune(self, X : pd.DataFrame, y : np.ndarray, reuse_params : bool = False) -> list:
+        """
+        Finds the best hyperparameters of every base estimator
+        with a (cached) grid search. The best hyperparameters are kept
+        in cache_dir/best-params.json, such that a retrain after a new
+        draw can reuse them and skip the search.
+
+        Parameters
+        ----------
+        X : pd.DataFrame
+            The model features of the training set
+        y : np.ndarray
+            The target of the training set
+        reuse_params : bool
+            Whether to reuse the last tuned hyperparameters instead of searching
+
+        Returns
+        -------
+        list
+            (name, estimator) of the tuned, unfitted base estimators
+        """
+        params_file = os.path.join(self.cache_dir, BEST_PARAMS_FILE)
+        best_params = {}
+        if os.path.exists(params_file):
+            with open(params_file) as f:
+                best_params = json.load(f)
+
+        estimators = []
+        for name, estimator in base_estimators():
+            key = self._params_key(name)
+            if reuse_params and key in best_params:
+                self._log(f"reusing the tuned parameters of {name}: {best_params[key]}")
+            else:
+                self._log(f"optimising {name}")
+                start = perf_counter()
+                search = self._grid_search(estimator, GRID_PARAM[name], X, y, cv_split(), self.n_jobs)
+                best_params[key] = search['best_params']
+                self._log(f"The best parameter for {estimator.__class__.__name__} is {search['best_params']} "
+                          f"with a runtime of {perf_counter() - start:.2f} seconds.")
+            estimators.append((name, estimator.set_params(**best_params[key])))
+
+        os.makedirs(self.cache_dir, exist_ok = True)
+        with open(params_file, 'w') as f:
+            json.dump(best_params, f, indent = 1)
+        return estimators
+
+    def fit_estimators(self, estimators : list, X : pd.DataFrame, y : np.ndarray) -> list:
+        """
+        Fits (cached) clones of the base estimators, in parallel
+
+        Parameters
+        ----------
+        estimators : list
+            (name, estimator) of the base estimators
+        X : pd.DataFrame
+            The model features
+        y : np.ndarray
+            The target
+
+        Returns
+        -------
+        list
+            (name, fitted estimator)
+        """
+        fitted = Parallel(n_jobs = self.n_jobs)(delayed(self._fit)(estimator, X, y) for _, estimator in estimators)
+        return [(name, f) for (name, _), f in zip(estimators, fitted)]
+
+    @staticmethod
+    def assemble(fitted : list, y : np.ndarray, voting : str) -> ensemble.VotingClassifier:
+        """
+        Builds a fitted voting ensemble out of fitted base estimators.
+        The result is the same as VotingClassifier(estimators, voting).fit(X, y),
+        which would fit clones of the same estimators on the same data again.
+
+        Parameters
+        ----------
+        fitted : list
+            (name, estimator) of the base estimators, fitted on y
+        y : np.ndarray
+            The target the estimators were fitted on
+        voting : str
+            'hard' or 'soft'
+
+        Returns
+        -------
+        ensemble.VotingClassifier
+            The fitted ensemble
+        """
+        model = ensemble.VotingClassifier(estimators = fitted, voting = voting)
+        model.le_ = LabelEncoder().fit(y)
+        model.classes_ = model.le_.classes_
+        model.estimators_ = [estimator for _, estimator in fitted]
+        model.named_estimators_ = Bunch(**dict(fitted))
+        for _, estimator in fitted:
+            if hasattr(estimator, 'feature_names_in_'):
+                model.feature_names_in_ = estimator.feature_names_in_
+        return model
+
+    def cross_validate_ensembles(self, estimators : list, X : pd.DataFrame, y : np.ndarray) -> dict:
+        """
+        Cross validates the hard and soft voting ensembles with
+        cv_split, as model_selection.cross_validate does. The base
+        estimators are fitted once per fold, for both ensembles,
+        and all folds are fitted in parallel.
+
+        Parameters
+        ----------
+        estimators : list
+            (name, estimator) of the tuned base estimators
+        X : pd.DataFrame
+            The model features of the training set
+        y : np.ndarray
+            The target of the training set
+
+        Returns
+        -------
+        dict
+            voting -> {'train_score': array, 'test_score': array} of accuracies
+        """
+        folds = list(cv_split().split(X))
+        jobs = [(fold, name, estimator) for fold in range(len(folds)) for name, estimator in estimators]
+        fitted = Parallel(n_jobs = self.n_jobs)(delayed(self._fit)(estimator, X.iloc[folds[fold][0]], y[folds[fold][0]])
+                                                for fold, _, estimator in jobs)
+
+        scores = {voting: {'train_score': [], 'test_score': []} for voting in ('hard', 'soft')}
+        for fold, (train, test) in enumerate(folds):
+            fold_fitted = [(name, f) for (i, name, _), f in zip(jobs, fitted) if i == fold]
+            for voting in scores:
+                model = self.assemble(fold_fitted, y[train], voting)
+                scores[voting]['train_score'].append(accuracy_score(y[train], model.predict(X.iloc[train])))
+                scores[voting]['test_score'].append(accuracy_score(y[test], model.predict(X.iloc[test])))
+
+        return {voting: {k: np.array(v) for k, v in s.items()} for voting, s in scores.items()}
+
+    def run(self, dataset : pd.DataFrame, reuse_params : bool = False) -> dict:
+        """
+        Trains the ensembles on the dataset, as euromillions.ipynb does
+
+        Parameters
+        ----------
+        dataset : pd.DataFrame
+            The cleaned dataset, e.g. from src.dataLoad.load_dataset
+        reuse_params : bool
+            Whether to reuse the last tuned hyperparameters instead of searching
+
+        Returns
+        -------
+        dict
+            The 'hard' and 'soft' ensembles, their 'cv' scores and test 'metrics',
+            the 'state' the features were engineered with and the 'dataset'
+        """
+        start_total = perf_counter()
+        data, state = prepare_data(dataset)
+        X_train, X_test, y_train, y_test = model_selection.train_test_split(data[MODEL_FEATURES], data[TARGET],
+                                                                            test_size = TEST_SIZE, random_state = SPLIT_SEED)
+        y_train, y_test = np.ravel(y_train), np.ravel(y_test)
+
+        estimators = self.tune(X_train, y_train, reuse_params = reuse_params)
+        fitted = self.fit_estimators(estimators, X_train, y_train)
+        for name, model in fitted:
+            self._log(f"{name} accuracy on test dataset: {accuracy_score(model.predict(X_test), y_test):.3f}")
+
+        cv = self.cross_validate_ensembles(estimators, X_train, y_train)
+        result = {'cv': cv, 'metrics': {}, 'state': state, 'dataset': dataset}
+        for voting in ('hard', 'soft'):
+            model = self.assemble(fitted, y_train, voting)
+            prediction = model.predict(X_test)
+            # the AUC is computed as in euromillions.ipynb, to be comparable to saved-models/README.md
+            result[voting] = model
+            result['metrics'][voting] = {'train cv accuracy': cv[voting]['train_score'].mean(),
+                                         'test cv accuracy': cv[voting]['test_score'].mean(),
+                                         'test cv accuracy 3*std': 3*cv[voting]['test_score'].std(),
+                                         'test accuracy': accuracy_score(prediction, y_test),
+                                         'test AUC': roc_auc_score(prediction, y_test)}
+            for metric, value in result['metrics'][voting].items():
+                self._log(f"{voting}-voting {metric}: {100*value:.1f}")
+
+        self._log(f"Total training time was {(perf_counter() - start_total)/60:.2f} minutes.")
+        return result
+
+    def save(self, result : dict, model_dir : str = MODEL_DIR) -> None:
+        """
+        Writes the artifacts quick-start.py loads: the soft-voting
+        model, its features, the feature state, the dataset (as a
+        column store, see save_dataset) and the exported model.
+        The model is exported before anything is written, and all
+        artifacts are written to a temporary directory first and only
+        then moved in place, such that a failure leaves the artifacts
+        of the last model as they were. An export format the model
+        cannot be exported to is skipped with a warning (and its old
+        file removed, so it is not used with the new model).
+
+        Parameters
+        ----------
+        result : dict
+            The output of run
+        model_dir : str
+            Where to write the artifacts
+        """
+        predictors = {}
+        for fmt, filename in EXPORT_FORMATS.items():
+            try:
+                predictors[filename], _ = export_model(result['soft'], MODEL_FEATURES, result['state'], fmt=fmt)
+            except ValueError as error:
+                warnings.warn(f"Skipping the {fmt} export: {error}")
+
+        os.makedirs(model_dir, exist_ok = True)
+        tmp = tempfile.mkdtemp(prefix='.save-', dir=model_dir)
+        try:
+            with open(os.path.join(tmp, 'soft-vote-model.sav'), 'wb') as f:
+                pickle.dump(result['soft'], f)
+            with open(os.path.join(tmp, 'model-lables.sav'), 'wb') as f:
+                pickle.dump(MODEL_FEATURES, f)
+            save_dataset(result['dataset'], tmp)
+            result['state'].save(os.path.join(tmp, 'feature-state.sav'))
+            # the exports are only used with the artifacts they were exported from
+            for filename, predictor in predictors.items():
+                predictor.source = source_hash(tmp)
+                predictor.save(os.path.join(tmp, filename))
+
+            # everything is written, swap it in
+            for name in os.listdir(tmp):
+                destination = os.path.join(model_dir, name)
+                if os.path.isdir(destination):
+                    shutil.rmtree(destination)
+                os.replace(os.path.join(tmp, name), destination)
+            for filename in EXPORT_FORMATS.values():
+                if filename not in predictors and os.path.exists(os.path.join(model_dir, filename)):
+                    os.remove(os.path.join(model_dir, filename))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def train(model_dir : str = MODEL_DIR, data_dir : str = DATA_DIR, cache_dir : str = TRAIN_CACHE_DIR,
+          n_jobs : int = None, reuse_params : bool = False) -> dict:
+    """
+    Loads the dataset from the csv files, trains the
+    ensembles and writes the artifacts to model_dir
+
+    Parameters
+    ----------
+    model_dir : str
+        Where to write the artifacts
+    data_dir : str
+        The directory with the csv files
+    cache_dir : str
+        The cache of the searches and the fitted estimators
+    n_jobs : int
+        The number of processes, os.cpu_count() if None
+    reuse_params : bool
+        Whether to reuse the last tuned hyperparameters instead of searching
+
+    Returns
+    -------
+    dict
+        The output of TrainingPipeline.run
+    """
+    dataset = load_dataset(data_dir, since = SINCE)
+    pipeline = TrainingPipeline(cache_dir = cache_dir, n_jobs = n_jobs)
+    result = pipeline.run(dataset, reuse_params = reuse_params)
+    pipeline.save(result, model_dir)
+    return result
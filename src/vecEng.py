@@ -0,0 +1,604 @@
+import pickle
+import numpy as np
+from src.profiling import stage
+
+# the columns of a EuroMillions ticket, in the order used throughout the project
+N_COLS = ['N'+str(i+1) for i in range(5)]
+L_COLS = ['L1', 'L2']
+TICKET_COLS = N_COLS + L_COLS
+# the largest number and lucky number (star)
+N_MAX, L_MAX = 50, 12
+
+# these lucky numbers are directly from the web
+# https://schoolworkhelper.net/numerology-lucky-unlucky-numbers/
+LUCKY_NUMBERS = np.array([1, 3, 7, 9, 13, 15, 21, 25, 31, 33, 37, 43, 49])
+# https://uk.movies.yahoo.com/most-popular-lottery-numbers-040000570.html
+SEVEN_PATTERN = np.array([7, 17, 27, 37, 47])
+# the rows on the Euromillions ticket (see https://www.euromillions.eu.com/imagenes/euromillions-ticket.jpg)
+TICKET_ROW_BINS = np.array([0, 8, 16, 24, 32, 40, 48, 50])
+# number of set bits for every bitmask of the 7 ticket rows
+ROW_COUNT = np.array([bin(i).count('1') for i in range(2**7)])
+
+
+def cut_edges(values : np.ndarray, nbins : int) -> np.ndarray:
+    """
+    Computes the bin edges which pd.cut(values, nbins) would use,
+    i.e. nbins equal-width bins spanning the range of values, with
+    the lowest edge extended by 0.1% of the range.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The values to bin
+    nbins : int
+        The number of equal-width bins
+
+    Returns
+    -------
+    np.ndarray
+        The nbins+1 bin edges
+    """
+    mn, mx = values.min() + 0.0, values.max() + 0.0
+    if mn == mx:
+        mn -= 0.001 * abs(mn) if mn != 0 else 0.001
+        mx += 0.001 * abs(mx) if mx != 0 else 0.001
+        return np.linspace(mn, mx, nbins + 1, endpoint=True)
+
+    edges = np.linspace(mn, mx, nbins + 1, endpoint=True)
+    edges[0] -= (mx - mn) * 0.001
+    return edges
+
+
+def cut_ids(values : np.ndarray, edges : np.ndarray) -> np.ndarray:
+    """
+    Returns the index of the right-closed bin (edges[i], edges[i+1]]
+    that each value falls into, as pd.cut(values, edges, labels=False) does.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The values to bin
+    edges : np.ndarray
+        The bin edges
+
+    Returns
+    -------
+    np.ndarray
+        The bin index of every value
+    """
+    return np.searchsorted(edges, values, side='left') - 1
+
+
+# ---------------------------- per-number lookup tables ----------------------------
+# Every per-number property is a table indexed by the number itself (entry 0 is unused),
+# so a feature of all tickets is one fancy-indexing of the (n, 5) or (n, 2) numbers.
+NUMBERS = np.arange(N_MAX + 1)
+STARS   = np.arange(L_MAX + 1)
+
+# the contributions of every number to the features which are sums over the numbers of a
+# ticket. A new per-number feature (e.g. the ticket columns or diagonals of ideas.md) is
+# one more column here, and costs nothing extra per ticket (see pack_table).
+NUMBER_TABLE = {'lucky numbers': np.isin(NUMBERS, LUCKY_NUMBERS),
+                '7 pattern':     np.isin(NUMBERS, SEVEN_PATTERN),
+                'N sum':         NUMBERS}
+STAR_TABLE   = {'lucky lucky numbers': np.isin(STARS, LUCKY_NUMBERS),
+                'L sum':               STARS}
+# the ticket row of every number as a bit, to be OR-ed over a ticket
+ROW_BIT   = np.where(NUMBERS > 0, 1 << np.maximum(cut_ids(NUMBERS, TICKET_ROW_BINS), 0), 0)
+# whether a number can be the month or the day of a date
+IS_MONTH  = (NUMBERS >= 1) & (NUMBERS <= 12)
+IS_DAY    = (NUMBERS >= 1) & (NUMBERS <= 31)
+# whether a number or a star is lucky
+IS_LUCKY  = np.isin(NUMBERS, LUCKY_NUMBERS)
+
+# the width of a column in a packed table; the sum of a column over a ticket must fit in it
+LANE_BITS = 8
+
+
+def pack_table(table : dict, count : int) -> np.ndarray:
+    """
+    Packs the columns of a lookup table into one integer per number:
+    column i takes the bits LANE_BITS * i -> LANE_BITS * (i+1). Summing
+    the packed entries of the numbers of a ticket sums every column at
+    once, as long as no column sum overflows its lane.
+
+    Parameters
+    ----------
+    table : dict
+        Column name -> contribution of every number (non-negative integers)
+    count : int
+        How many numbers are summed, e.g. 5 for N1 -> N5
+
+    Returns
+    -------
+    np.ndarray
+        uint64 array with the packed contributions of every number
+    """
+    if len(table) * LANE_BITS > 64:
+        raise ValueError(f"{len(table)} columns of {LANE_BITS} bits do not fit in 64 bits")
+    packed = np.zeros(len(next(iter(table.values()))), dtype=np.uint64)
+    for lane, (col, values) in enumerate(table.items()):
+        values = np.asarray(values, dtype=np.int64)
+        if values.min() < 0 or values.max() * count >= 2**LANE_BITS:
+            raise ValueError(f"The sums of {col!r} over {count} numbers do not fit in {LANE_BITS} bits")
+        packed |= values.astype(np.uint64) << np.uint64(LANE_BITS * lane)
+    return packed
+
+
+def table_sums(numbers : np.ndarray, table : dict, packed : np.ndarray) -> dict:
+    """
+    Sums every column of a lookup table over the numbers of each ticket
+
+    Parameters
+    ----------
+    numbers : np.ndarray
+        (n, k) integer array of valid numbers, e.g. N1 -> N5
+    table : dict
+        The lookup table, e.g. NUMBER_TABLE
+    packed : np.ndarray
+        pack_table(table, k)
+
+    Returns
+    -------
+    dict
+        Column name -> (n,) int64 array of the column sums
+    """
+    sums = packed[numbers].sum(axis=1, dtype=np.uint64)
+    mask = np.uint64(2**LANE_BITS - 1)
+    return {col: ((sums >> np.uint64(LANE_BITS * lane)) & mask).astype(np.int64)
+            for lane, col in enumerate(table)}
+
+
+NUMBER_PACKED = pack_table(NUMBER_TABLE, len(N_COLS))
+STAR_PACKED   = pack_table(STAR_TABLE, len(L_COLS))
+
+
+class VectorisedFeatureEngineering:
+    """
+    A vectorised feature engineering class.
+    Computes the same features as FeatureEngineering,
+    but on whole (n, 7) arrays of tickets at once
+    instead of row per row through DataFrame.apply.
+
+
+    Attributes
+    ----------
+    numbers : np.ndarray
+        (n, 7) integer array of tickets with columns N1 -> N5, L1, L2
+
+    years : np.ndarray
+        (n,) integer array with the year each ticket was drawn / played in
+
+    Methods
+    -------
+    from_dataframe(df : pd.DataFrame) -> VectorisedFeatureEngineering
+        Builds the engine from a DataFrame with YYYY, N1 -> N5, L1 and L2 columns
+
+    engineer_features() -> dict
+        Engineer all features; returns a dict of column name -> np.ndarray
+
+    is_date() -> np.ndarray
+        Checks which tickets contain a valid date
+
+    is_this_year() -> np.ndarray
+        Checks which tickets contain the same year that the draw happend
+
+    is_post_2000() -> np.ndarray
+        Checks which tickets contain a valid year past the year 2000
+
+    get_lucky_numbers(c : np.ndarray) -> np.ndarray
+        Counts how many lucky numbers each row of c contains
+
+    get_all_7_numbers() -> np.ndarray
+        Counts how many numbers of each ticket have the number 7
+
+    number_of_different_rows() -> np.ndarray
+        Counts how many different ticket rows are needed to mark each ticket
+    """
+
+    def __init__(self, numbers : np.ndarray, years : np.ndarray) -> None:
+        # work in int64 so that sums or "year - 2000" never overflow
+        # for compact (e.g. uint8) inputs
+        self.numbers = np.asarray(numbers, dtype=np.int64).reshape(-1, 7)
+        self.years   = np.broadcast_to(np.asarray(years, dtype=np.int64), (len(self.numbers),))
+
+        self.N = self.numbers[:, :5]
+        self.L = self.numbers[:, 5:]
+
+    @classmethod
+    def from_dataframe(cls, df) -> 'VectorisedFeatureEngineering':
+        """
+        Builds the engine from a DataFrame with
+        the columns YYYY, N1 -> N5, L1 and L2
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The tickets
+
+        Returns
+        -------
+        VectorisedFeatureEngineering
+            The engine for the tickets in df
+        """
+        return cls(df[TICKET_COLS].to_numpy(), df['YYYY'].to_numpy())
+
+    #
+    # --------------------------------- Methods for new features ---------------------------------
+    #
+    def is_date(self) -> np.ndarray:
+        """
+        Checks which tickets contain a valid date.
+        As in FeatureEngineering.is_date, N1 -> N5 are scanned
+        in column order: the first number <= 12 is the month
+        and any later number <= 31 is the day.
+
+        Returns
+        -------
+        np.ndarray
+            bool array, True where the ticket contains a valid date
+        """
+        month = IS_MONTH[self.N]
+        first_month = month.argmax(axis=1)
+        after_month = np.arange(5)[None, :] > first_month[:, None]
+        return month.any(axis=1) & (IS_DAY[self.N] & after_month).any(axis=1)
+
+    def is_this_year(self) -> np.ndarray:
+        """
+        Checks which tickets contain 20 and the last two
+        digits of the year the draw happend
+
+        Returns
+        -------
+        np.ndarray
+            bool array, True where the ticket contains the year
+        """
+        second = (self.years - 2000)[:, None]
+        has_20 = (self.N == 20).any(axis=1)
+        # a 20 is always consumed as the first half of the year
+        has_second = ((self.N != 20) & (self.N == second)).any(axis=1)
+        return has_20 & has_second
+
+    def is_post_2000(self) -> np.ndarray:
+        """
+        Checks which tickets contain a valid
+        year past the year 2000
+
+        Returns
+        -------
+        np.ndarray
+            bool array, True where the ticket contains such a year
+        """
+        second = (self.years - 2000)[:, None]
+        has_20 = (self.N == 20).any(axis=1)
+        has_second = ((self.N != 20) & (self.N <= second)).any(axis=1)
+        return has_20 & has_second
+
+    def get_lucky_numbers(self, c : np.ndarray) -> np.ndarray:
+        """
+        Counts how many lucky numbers each row of c contains
+
+        Parameters
+        ----------
+        c : np.ndarray
+            (n, k) integer array of numbers (1 -> N_MAX) to check
+
+        Returns
+        -------
+        np.ndarray
+            The number of lucky numbers in each row
+        """
+        return IS_LUCKY[c].sum(axis=1)
+
+    def get_all_7_numbers(self) -> np.ndarray:
+        """
+        Counts how many numbers of each ticket
+        have the number 7: 7, 17, 27, 37, 47
+
+        Returns
+        -------
+        np.ndarray
+            The number of numbers matching the pattern
+        """
+        return NUMBER_TABLE['7 pattern'][self.N].sum(axis=1)
+
+    def number_of_different_rows(self) -> np.ndarray:
+        """
+        Counts how many different rows on the EuroMillions
+        ticket need to be marked to bet on each ticket
+
+        Returns
+        -------
+        np.ndarray
+            The number of different ticket rows
+        """
+        # mark the occupied rows as bits and count them
+        occupied = np.bitwise_or.reduce(ROW_BIT[self.N], axis=1)
+        return ROW_COUNT[occupied]
+
+    def row_features(self) -> dict:
+        """
+        Engineer the features which only depend on the
+        ticket itself, i.e. all but the sum means and bins
+
+        Returns
+        -------
+        dict
+            Column name -> np.ndarray, in the same order
+            as FeatureEngineering.engineer_features
+        """
+        rows = len(self.numbers)
+        # all the per-number sums (lucky numbers, 7 pattern, N sum, ...) in one look-up per ticket,
+        # so these features are timed together as one stage
+        with stage('table sums', rows):
+            sums = table_sums(self.N, NUMBER_TABLE, NUMBER_PACKED)
+            sums.update(table_sums(self.L, STAR_TABLE, STAR_PACKED))
+
+        f = {}
+        # ---------------------------- date-based-features -----------------------------------------
+        with stage('is date', rows):
+            f["is date"]      = self.is_date()
+        with stage('is post 2000', rows):
+            f["is post 2000"] = self.is_post_2000()
+        with stage('is this year', rows):
+            f["is this year"] = self.is_this_year()
+        # ---------------------------- lucky-numbers-based features -----------------------------------------
+        f["lucky numbers"]       = sums["lucky numbers"]
+        f["lucky lucky numbers"] = sums["lucky lucky numbers"]
+        f["has lucky"]           = f["lucky numbers"] > 0
+        f["has lucky lucky"]     = f["lucky lucky numbers"] > 0
+        # ---------------------------- unlucky-numbers-based features -----------------------------------------
+        f["7 pattern"]           = sums["7 pattern"]
+        # ---------------------------- betting-no-based features -----------------------------------------
+        with stage('N rows', rows):
+            f["N rows"]    = self.number_of_different_rows()
+        f["N sum"]     = sums["N sum"]
+        f["L sum"]     = sums["L sum"]
+
+        return f
+
+    def engineer_features(self, state : 'FeatureState' = None) -> dict:
+        """
+        Engineer all features of FeatureEngineering.engineer_features
+        for the whole array at once.
+
+        Parameters
+        ----------
+        state : FeatureState
+            The frozen sum means and bins to use. If None, these are
+            computed w.r.t. the tickets in this engine, exactly as
+            FeatureEngineering.engineer_features does (without any
+            tickets, the features are empty, see transform_empty).
+
+        Returns
+        -------
+        dict
+            Column name -> np.ndarray, in the same order
+            as FeatureEngineering.engineer_features
+        """
+        f = self.row_features()
+        if state is None and not len(self.numbers):
+            f.update(FeatureState.transform_empty(f["N sum"], f["L sum"]))
+            return f
+        with stage('sum bins', len(self.numbers)):
+            if state is None:
+                state = FeatureState.fit(f["N sum"], f["L sum"])
+            f.update(state.transform(f["N sum"], f["L sum"]))
+
+        return f
+
+
+class FeatureState:
+    """
+    The frozen global quantities of the feature engineering:
+    the means behind 'N sum big' and 'L sum big' and the
+    bins behind 'N sum bin', 'L sum bin' and 'NL sum bin'.
+
+    These are fitted once (on the dataset the model was trained on)
+    and then applied to any number of new tickets, such that the
+    features of a ticket do not depend on which other tickets
+    are engineered with it.
+
+
+    Attributes
+    ----------
+    means : dict
+        Column name -> mean of the column at fit time
+
+    edges : dict
+        Column name -> the bin edges of pd.cut at fit time
+
+    occupied : dict
+        Column name -> bool array, which bins were occupied at fit time
+
+    Methods
+    -------
+    fit(n_sum : np.ndarray, l_sum : np.ndarray) -> FeatureState
+        Fits the state on the sums of numbers and lucky numbers
+
+    from_dataframe(df : pd.DataFrame) -> FeatureState
+        Fits the state on a DataFrame of tickets
+
+    transform(n_sum : np.ndarray, l_sum : np.ndarray) -> dict
+        Engineers the sum-based features w.r.t. the frozen state
+
+    transform_empty(n_sum : np.ndarray, l_sum : np.ndarray) -> dict
+        The sum-based features of no tickets, which need no state
+
+    save(filename : str)
+        Saves the state
+
+    load(filename : str) -> FeatureState
+        Loads a saved state
+    """
+
+    # the number of equal-width bins of each binned column
+    nbins = {'N sum': 10, 'L sum': 6, 'NL sum': 6}
+
+    def __init__(self, means : dict, edges : dict, occupied : dict) -> None:
+        self.means    = {col: float(m) for col, m in means.items()}
+        self.edges    = {col: np.asarray(e, dtype=np.float64) for col, e in edges.items()}
+        self.occupied = {col: np.asarray(o, dtype=bool) for col, o in occupied.items()}
+
+        # LabelEncoder codes of the bins. Bins that were empty at fit time
+        # share the code of the closest lower occupied bin
+        self.codes = {col: np.maximum(np.cumsum(o) - 1, 0) for col, o in self.occupied.items()}
+
+    @classmethod
+    def fit(cls, n_sum : np.ndarray, l_sum : np.ndarray) -> 'FeatureState':
+        """
+        Fits the state on the sums of numbers and lucky numbers
+
+        Parameters
+        ----------
+        n_sum : np.ndarray
+            N1 + ... + N5 of every ticket
+        l_sum : np.ndarray
+            L1 + L2 of every ticket
+
+        Returns
+        -------
+        FeatureState
+            The fitted state
+        """
+        if not len(n_sum):
+            raise ValueError("Cannot fit a FeatureState on no tickets")
+        sums = {'N sum': n_sum, 'L sum': l_sum, 'NL sum': n_sum + l_sum}
+
+        means = {col: sums[col].mean() for col in ['N sum', 'L sum']}
+        edges, occupied = {}, {}
+        for col, nbins in cls.nbins.items():
+            edges[col]    = cut_edges(sums[col], nbins)
+            occupied[col] = np.bincount(cut_ids(sums[col], edges[col]), minlength=nbins) > 0
+
+        return cls(means, edges, occupied)
+
+    @classmethod
+    def from_dataframe(cls, df) -> 'FeatureState':
+        """
+        Fits the state on a DataFrame of tickets
+        with the columns N1 -> N5, L1 and L2
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The tickets, e.g. the dataset the model was trained on
+
+        Returns
+        -------
+        FeatureState
+            The fitted state
+        """
+        return cls.fit(df[N_COLS].to_numpy(dtype=np.int64).sum(axis=1),
+                       df[L_COLS].to_numpy(dtype=np.int64).sum(axis=1))
+
+    def bin_codes(self, col : str, values : np.ndarray) -> np.ndarray:
+        """
+        Bins values with the frozen bins of col and returns
+        their label-encoded bin. Values outside of the
+        fitted range end up in the first or last bin.
+
+        Parameters
+        ----------
+        col : str
+            The binned column
+        values : np.ndarray
+            The values to bin
+
+        Returns
+        -------
+        np.ndarray
+            The encoded bins
+        """
+        ids = np.clip(cut_ids(values, self.edges[col]), 0, self.nbins[col] - 1)
+        return self.codes[col][ids]
+
+    def transform(self, n_sum : np.ndarray, l_sum : np.ndarray) -> dict:
+        """
+        Engineers the sum-based features w.r.t. the frozen state
+
+        Parameters
+        ----------
+        n_sum : np.ndarray
+            N1 + ... + N5 of every ticket
+        l_sum : np.ndarray
+            L1 + L2 of every ticket
+
+        Returns
+        -------
+        dict
+            Column name -> np.ndarray, in the same order
+            as FeatureEngineering.engineer_features
+        """
+        f = {}
+        f["N sum big"]  = n_sum > self.means['N sum']
+        f["L sum big"]  = l_sum > self.means['L sum']
+        f["N sum bin"]  = self.bin_codes('N sum', n_sum)
+        f["L sum bin"]  = self.bin_codes('L sum', l_sum)
+        f["NL sum"]     = n_sum + l_sum
+        f["NL sum bin"] = self.bin_codes('NL sum', f["NL sum"])
+
+        return f
+
+    @staticmethod
+    def transform_empty(n_sum : np.ndarray, l_sum : np.ndarray) -> dict:
+        """
+        The sum-based features of transform for no tickets, with the same
+        columns and dtypes. There is nothing to fit a state on then, so
+        the engines use this when they engineer an empty array without one.
+
+        Parameters
+        ----------
+        n_sum : np.ndarray
+            The (empty) N1 + ... + N5
+        l_sum : np.ndarray
+            The (empty) L1 + L2
+
+        Returns
+        -------
+        dict
+            Column name -> empty np.ndarray
+        """
+        f = {}
+        f["N sum big"]  = np.empty(0, dtype=bool)
+        f["L sum big"]  = np.empty(0, dtype=bool)
+        f["N sum bin"]  = np.empty(0, dtype=np.int64)
+        f["L sum bin"]  = np.empty(0, dtype=np.int64)
+        f["NL sum"]     = n_sum + l_sum
+        f["NL sum bin"] = np.empty(0, dtype=np.int64)
+
+        return f
+
+    def save(self, filename : str) -> None:
+        """
+        Saves the state with pickle, as plain python
+        types such that loading it needs no extra imports
+
+        Parameters
+        ----------
+        filename : str
+            Where to save the state
+        """
+        state = {'means':    self.means,
+                 'edges':    {col: e.tolist() for col, e in self.edges.items()},
+                 'occupied': {col: o.tolist() for col, o in self.occupied.items()}}
+        with open(filename, 'wb') as f:
+            pickle.dump(state, f)
+
+    @classmethod
+    def load(cls, filename : str) -> 'FeatureState':
+        """
+        Loads a state saved with FeatureState.save
+
+        Parameters
+        ----------
+        filename : str
+            The saved state
+
+        Returns
+        -------
+        FeatureState
+            The loaded state
+        """
+        with open(filename, 'rb') as f:
+            return cls(**pickle.load(f))